@@ -1,9 +1,24 @@
-import duckdb
+import argparse
 import logging
+import os
 import matplotlib.pyplot as plt
+import pandas as pd
+
+from export import EXPORT_DIR, parquet_connection
+from instrument import instrument
+from resources import connect_duckdb
+from result_cache import CACHE_DIR, ResultCache, database_version, export_version
+from rollup import aggregate_sql, rollup_is_current
+from sample import CONFIDENCE, estimate_sql, sample_is_current
 
 #DISCLAIMER: # Execute the SQL query and fetch the results as a pandas DataFrame
 # This allows us to manipulate, print, and plot the data easily with pandas and matplotlib
+# The per-group aggregates come from aggregate_sql(), which answers them from the
+# pre-aggregated trip_rollup table (built by transform.py) instead of scanning every trip.
+# Results are cached on disk per data version (see result_cache.py), so rerunning
+# on unchanged data doesn't query the trip table or redraw the plot.
+# With --approximate the averages and totals are estimated from the stratified
+# sample kept by transform.py (see sample.py) and reported with confidence intervals.
 
 
 # Logging setup
@@ -15,121 +30,204 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Wide enough to print the --approximate margin columns without truncation
+pd.set_option("display.width", 160)
+pd.set_option("display.max_columns", None)
+
+
+PLOT_PATH = "monthly_co2_trend.png"
+
+# Most/least carbon-heavy questions: query name -> (label, trip columns of a group).
+# Months are told apart by year too, so a multi-year load doesn't merge each January.
+EXTREMES = {
+    "hours": ("hour", ["trip_hour"]),
+    "days": ("day", ["trip_day_of_week"]),
+    "weeks": ("week", ["trip_week"]),
+    "months": ("month", ["trip_year", "trip_month"]),
+}
+
+# Every question analysis answers, in report order
+QUESTIONS = ["largest_trip"] + list(EXTREMES) + ["monthly_totals"]
+
+
+def fetchdf(con, sql, cache=None):
+    """Run `sql` into a DataFrame, through the result cache when one is given."""
+    if cache is None:
+        return con.execute(sql).fetchdf()
+    return cache.fetchdf(con, sql)
+
+
+def co2_sql(con, agg, group_by, alias, current, approximate=False):
+    """
+    `agg` of CO2 per group: estimated from the sample (with an `{alias}_margin`
+    column) when `approximate`, otherwise exact from the rollup or trip table.
+    """
+    if approximate:
+        return estimate_sql("co2_kg_per_trip", agg, group_by, alias)
+    return aggregate_sql(con, "co2_kg_per_trip", agg, group_by, alias, current)
+
+
+def margin_columns(name, approximate):
+    """Confidence-interval columns of the heaviest and lightest `name` (nothing when exact)."""
+    if not approximate:
+        return ""
+    return f""",
+               arg_max(avg_co2_margin, avg_co2) AS max_{name}_margin,
+               arg_min(avg_co2_margin, avg_co2) AS min_{name}_margin"""
+
+
+def extremes_sql(con, name, columns, current, approximate=False):
+    """Highest and lowest average CO2 per trip over the groups of `columns`, per taxi type."""
+    return f"""
+        SELECT taxi_type,
+               MAX(avg_co2) AS max_{name}_avg_co2,
+               MIN(avg_co2) AS min_{name}_avg_co2{margin_columns(name, approximate)}
+        FROM (
+            {co2_sql(con, "avg", ["taxi_type"] + columns, "avg_co2", current, approximate)}
+        )
+        GROUP BY taxi_type
+    """
+
+
+def analysis_queries(con, approximate=False):
+    """
+    SQL of every analysis question by name (see QUESTIONS), and whether it is
+    approximate: `approximate` only holds if the trip sample is current.
+    """
+    # Checked once here rather than by every aggregate_sql() call
+    current = rollup_is_current(con)
+    approximate = approximate and sample_is_current(con)
+    queries = {
+        # Always exact: a sample can't estimate a maximum, and the rollup answers it cheaply anyway
+        "largest_trip": aggregate_sql(con, "co2_kg_per_trip", "max", ["taxi_type"], "max_co2", current),
+    }
+    for key, (name, columns) in EXTREMES.items():
+        queries[key] = extremes_sql(con, name, columns, current, approximate)
+    queries["monthly_totals"] = f"""
+        SELECT trip_year, trip_month, taxi_type, total_co2{", total_co2_margin" if approximate else ""}
+        FROM ({co2_sql(con, "sum", ["trip_year", "trip_month", "taxi_type"], "total_co2", current, approximate)})
+        ORDER BY trip_year, trip_month
+    """
+    return queries, approximate
+
+
+def run_analysis(con, cache=None, approximate=False):
+    """
+    Print and log the CO2 statistics and save the monthly trend plot, reading from `con`.
+
+    With a `cache` (result_cache.ResultCache) results come from disk when the
+    data hasn't changed, and the plot is only redrawn if it is out of date.
+    With `approximate` the averages and totals come from the trip sample, each
+    with the half-width of its confidence interval (a `_margin` column); this
+    falls back to exact answers when the sample is missing or out of date.
+    """
+    queries, sampled = analysis_queries(con, approximate)
+    if approximate and not sampled:
+        print("Trip sample missing or out of date (run transform.py); computing exact results")
+        logger.warning("Trip sample not current; --approximate fell back to exact results")
+    approximate = sampled
+    if approximate:
+        print(f"Approximate results from the trip sample; margins are {CONFIDENCE:.0%} confidence intervals (+/-)")
+
+    # Largest carbon-producing trip for each taxi type
+    print("\nLargest carbon producing trip per taxi type")
+    largest_trip = fetchdf(con, queries["largest_trip"], cache)
+    print(largest_trip)
+
+    logger.info(f"Largest CO2 trip:\n{largest_trip}")
+
+    # Most and least carbon-heavy hours of the day
+    print("\n Most and least carbon heavy hours per taxi type")
+    hours = fetchdf(con, queries["hours"], cache)
+    print(hours)
+
+    logger.info(f"CO2-heavy/light hours:\n{hours}")
+
+    # Most and least carbon-heavy days of the week
+    print("\nMost and least carbon heavy days per taxi type")
+    days = fetchdf(con, queries["days"], cache)
+    print(days)
+
+    logger.info(f"CO2-heavy/light days:\n{days}")
+
+    # Most and least carbon-heavy weeks of the year (2024)
+    print("\nMost and least carbon heavy weeks per taxi type")
+    weeks = fetchdf(con, queries["weeks"], cache)
+    print(weeks)
+
+    logger.info(f"CO2-heavy/light weeks:\n{weeks}")
+
+    # Most and least carbon-heavy months of the year
+    print("\nMost and least carbon heavy months per taxi type")
+    months = fetchdf(con, queries["months"], cache)
+    print(months)
+
+    logger.info(f"CO2-heavy/light months:\n{months}")
+
+    print("\n Plotting total monthly CO2 per taxi type")
+    monthly_totals = fetchdf(con, queries["monthly_totals"], cache)
+
+    mode = "approximate" if approximate else "exact"
+    if cache is not None and cache.misses == 0 and cache.artifact_is_current(PLOT_PATH, mode):
+        print(f"Data unchanged since '{PLOT_PATH}' was saved; not redrawing it")
+        logger.info(f"{PLOT_PATH} is current; skipped redrawing")
+        return
+
+    # One point per year-month, so a load spanning several years plots them side by side
+    periods = sorted({(int(y), int(m)) for y, m in zip(monthly_totals['trip_year'], monthly_totals['trip_month'])})
+    position = {period: i for i, period in enumerate(periods)}
+    monthly_totals['period'] = [position[(int(y), int(m))]
+                                for y, m in zip(monthly_totals['trip_year'], monthly_totals['trip_month'])]
+
+    plt.figure(figsize=(10,6))
+    colors= {'yellow': 'gold', 'green': 'green'}
+    for taxi_type in sorted(monthly_totals['taxi_type'].unique()):
+        subset = monthly_totals[monthly_totals['taxi_type'] == taxi_type]
+        plt.plot(subset['period'], subset['total_co2'], marker='o', label=taxi_type.capitalize(), color= colors.get(taxi_type))
+        if approximate:
+            plt.errorbar(subset['period'], subset['total_co2'], yerr=subset['total_co2_margin'],
+                         fmt='none', capsize=3, color=colors.get(taxi_type))
+        max_idx = subset['total_co2'].idxmax()
+        max_month = subset.loc[max_idx, 'period']
+        max_co2 = subset.loc[max_idx, 'total_co2']
+        plt.text(max_month, max_co2, f'{max_co2:.0f}', ha='center', va='bottom', color=colors.get(taxi_type), fontweight='bold')
+        
+    plt.title("Total Monthly CO2 by Taxi Type" + (" (estimated from sample)" if approximate else ""))
+    plt.yscale('log')
+    plt.xlabel("Month")
+    plt.ylabel("Total CO2 (kg)")
+    plt.xticks(range(len(periods)), [f"{y}-{m:02d}" for y, m in periods], rotation=45)
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(PLOT_PATH)
+    plt.close()
+    if cache is not None:
+        cache.record_artifact(PLOT_PATH, mode)
+    print(f"Plot saved as '{PLOT_PATH}'")
+    logger.info(f"Plot saved as '{PLOT_PATH}'")
+
 
 #LET'S make a function that does some analysis of our now transformed and cleaned data
-def analyze_taxi_data():
-    con = duckdb.connect(database='emissions.duckdb', read_only=True)
-    logger.info("Connected to emissions.duckdb for analysis")
+def analyze_taxi_data(source="duckdb", use_cache=True, approximate=False):
+    # "parquet" reads the hive-partitioned export (see export.py) instead of the
+    # database file, so analysis can run while the pipeline holds the write lock.
+    if source == "parquet":
+        con = instrument(parquet_connection(), "analysis")
+        logger.info("Connected to the parquet export for analysis")
+    else:
+        con = instrument(connect_duckdb('emissions.duckdb', read_only=True), "analysis")
+        logger.info("Connected to emissions.duckdb for analysis")
 
     try:
-        # Largest carbon-producing trip for each taxi type
-        print("\nLargest carbon producing trip per taxi type")
-        largest_trip = con.execute("""
-            SELECT taxi_type, MAX(co2_kg_per_trip) AS max_co2
-            FROM taxi_trips_transformed
-            GROUP BY taxi_type
-        """).fetchdf()
-        print(largest_trip)
-
-        logger.info(f"Largest CO2 trip:\n{largest_trip}")
-
-        # Most and least carbon-heavy hours of the day
-        print("\n Most and least carbon heavy hours per taxi type")
-        hours = con.execute("""
-            SELECT taxi_type,
-                   MAX(avg_co2) AS max_hour_avg_co2,
-                   MIN(avg_co2) AS min_hour_avg_co2
-            FROM (
-                SELECT taxi_type, trip_hour, AVG(co2_kg_per_trip) AS avg_co2
-                FROM taxi_trips_transformed
-                GROUP BY taxi_type, trip_hour
-            )
-            GROUP BY taxi_type
-        """).fetchdf()
-        print(hours)
-
-        logger.info(f"CO2-heavy/light hours:\n{hours}")
-
-        # Most and least carbon-heavy days of the week
-        print("\nMost and least carbon heavy days per taxi type")
-        days = con.execute("""
-            SELECT taxi_type,
-                   MAX(avg_co2) AS max_day_avg_co2,
-                   MIN(avg_co2) AS min_day_avg_co2
-            FROM (
-                SELECT taxi_type, trip_day_of_week, AVG(co2_kg_per_trip) AS avg_co2
-                FROM taxi_trips_transformed
-                GROUP BY taxi_type, trip_day_of_week
-            )
-            GROUP BY taxi_type
-        """).fetchdf()
-        print(days)
-
-        logger.info(f"CO2-heavy/light days:\n{days}")
-
-        # Most and least carbon-heavy weeks of the year (2024)
-        print("\nMost and least carbon heavy weeks per taxi type")
-        weeks = con.execute("""
-            SELECT taxi_type,
-                   MAX(avg_co2) AS max_week_avg_co2,
-                   MIN(avg_co2) AS min_week_avg_co2
-            FROM (
-                SELECT taxi_type, trip_week, AVG(co2_kg_per_trip) AS avg_co2
-                FROM taxi_trips_transformed
-                GROUP BY taxi_type, trip_week
-            )
-            GROUP BY taxi_type
-        """).fetchdf()
-        print(weeks)
-
-        logger.info(f"CO2-heavy/light weeks:\n{weeks}")
-
-        # Most and least carbon-heavy months of the year
-        print("\nMost and least carbon heavy months per taxi type")
-        months = con.execute("""
-            SELECT taxi_type,
-                   MAX(avg_co2) AS max_month_avg_co2,
-                   MIN(avg_co2) AS min_month_avg_co2
-            FROM (
-                SELECT taxi_type, trip_month, AVG(co2_kg_per_trip) AS avg_co2
-                FROM taxi_trips_transformed
-                GROUP BY taxi_type, trip_month
-            )
-            GROUP BY taxi_type
-        """).fetchdf()
-        print(months)
-    
-        logger.info(f"CO2-heavy/light months:\n{months}")
-
-        print("\n Plotting total monthly CO2 per taxi type")
-        monthly_totals = con.execute("""
-            SELECT trip_month, taxi_type, SUM(co2_kg_per_trip) AS total_co2
-            FROM taxi_trips_transformed
-            GROUP BY trip_month, taxi_type
-            ORDER BY trip_month
-        """).fetchdf()
-
-        plt.figure(figsize=(10,6))
-        colors= {'yellow': 'gold', 'green': 'green'}
-        for taxi_type in ['yellow', 'green']:
-            subset = monthly_totals[monthly_totals['taxi_type'] == taxi_type]
-            plt.plot(subset['trip_month'], subset['total_co2'], marker='o', label=taxi_type.capitalize(), color= colors[taxi_type])
-            max_idx = subset['total_co2'].idxmax()
-            max_month = subset.loc[max_idx, 'trip_month']
-            max_co2 = subset.loc[max_idx, 'total_co2']
-            plt.text(max_month, max_co2, f'{max_co2:.0f}', ha='center', va='bottom', color=colors[taxi_type], fontweight='bold')
-            
-        plt.title("Total Monthly CO2 by Taxi Type")
-        plt.yscale('log')
-        plt.xlabel("Month")
-        plt.ylabel("Total CO2 (kg)")
-        plt.xticks(range(1,13))
-        plt.legend()
-        plt.grid(True)
-        plt.tight_layout()
-        plt.savefig("monthly_co2_trend.png")
-        print("Plot saved as 'monthly_co2_trend.png'")
-        logger.info("Plot saved as 'monthly_co2_trend.png'")
+        cache = None
+        if use_cache:
+            version = export_version(EXPORT_DIR) if source == "parquet" else database_version(con)
+            # Each source keeps its own results, so switching between them doesn't evict the other
+            cache = ResultCache(version, os.path.join(CACHE_DIR, source))
+        run_analysis(con, cache, approximate)
+        if cache is not None:
+            logger.info(f"Result cache (data version {cache.version}): {cache.hits} hit(s), {cache.misses} miss(es)")
 
     except Exception as e:
         logger.error(f"Error during analysis: {e}")
@@ -140,5 +238,13 @@ def analyze_taxi_data():
         logger.info("DuckDB connection closed")
 
 if __name__ == "__main__":
-    analyze_taxi_data()
+    parser = argparse.ArgumentParser(description="Report CO2 statistics for yellow and green taxi trips")
+    parser.add_argument("--source", choices=["duckdb", "parquet"], default="duckdb",
+                        help="Read emissions.duckdb or the hive-partitioned parquet export")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always query the data instead of reusing results cached for unchanged data")
+    parser.add_argument("--approximate", action="store_true",
+                        help="Estimate averages and totals from the stratified trip sample, with confidence intervals")
+    args = parser.parse_args()
+    analyze_taxi_data(args.source, not args.no_cache, args.approximate)
 
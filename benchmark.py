@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from instrument import new_run_id
+from fleets import select_fleets
+from resources import check_peaks, connect_duckdb, resource_profile
+from synthetic import generate, parse_scale
+
+# Benchmark harness for the pipeline stages.
+# For each requested scale it generates (or reuses) deterministic synthetic trip
+# files, then runs load, clean, transform and analysis against a scratch
+# emissions.duckdb, each stage in its own Python process so peak RSS is measured
+# per stage. With --memory the stages are sized for that much memory (the
+# PIPELINE_MEMORY of resources.py) and each result says whether the stage stayed
+# within it. Every run writes one JSON file to bench_results/ that can be diffed
+# against another commit's with --compare.
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(REPO_DIR, "bench_runs")
+RESULTS_DIR = os.path.join(REPO_DIR, "bench_results")
+
+STAGES = ["load", "clean", "transform", "analysis"]
+
+# Fleets synthetic.py generates data for
+BENCH_FLEETS = ["yellow", "green"]
+
+
+def run_stage(stage, source):
+    """
+    Run one pipeline stage in the current process (the working directory is the scratch dir).
+
+    Uses the stage functions the pipeline runs, which raise on failure (the
+    stage scripts' entry points only print errors), so a failed stage can't
+    pass for a timing.
+    """
+    from clean import configure
+    from instrument import instrument
+    con = instrument(connect_duckdb("emissions.duckdb", read_only=stage == "analysis"), stage)
+    try:
+        if stage == "analysis":
+            from analysis import run_analysis
+            run_analysis(con)
+            return
+        configure(con)
+        if stage == "load":
+            from load import load_fleet, load_vehicle_emissions
+            fleets = select_fleets(BENCH_FLEETS)
+            load_vehicle_emissions(con, fleets)
+            for fleet in fleets.values():
+                load_fleet(con, fleet, source=source, rate=0)
+        elif stage == "clean":
+            from clean import clean_taxi
+            for taxi_type in BENCH_FLEETS:
+                clean_taxi(con, taxi_type)
+        elif stage == "transform":
+            from transform import transform_pending
+            transform_pending(con)
+    finally:
+        con.close()
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # spill files come and go while we walk
+    return total
+
+
+def child_main(stage, source, out):
+    """
+    Entry point of the per-stage child process.
+
+    Writes one JSON line to `out` with wall time, peak RSS, the largest size the
+    DuckDB spill directory reached while the stage ran, and whether the peak RSS
+    stayed within the stage's resource profile.
+    """
+    profile = resource_profile()
+    spill_dir = profile["temp_directory"]
+    peak_spill = [0]
+    done = threading.Event()
+
+    def sample_spill():
+        while not done.is_set():
+            peak_spill[0] = max(peak_spill[0], dir_size(spill_dir))
+            done.wait(0.05)
+
+    sampler = threading.Thread(target=sample_spill, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    run_stage(stage, source)
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({
+        "seconds": seconds, "peak_rss_mb": peak_rss_bytes / 1024 ** 2, "spill_bytes": peak_spill[0],
+        "memory_bytes": profile["memory_bytes"],
+        "within_budget": check_peaks(stage, None, peak_rss_bytes, profile),
+    }), file=out)
+
+
+def stage_input_rows(stage):
+    """Rows a stage processed (its input; for load, the rows it loaded), read from the partition manifest."""
+    import duckdb
+    upstream = {"load": "load", "clean": "load", "transform": "clean", "analysis": "transform"}[stage]
+    con = duckdb.connect("emissions.duckdb", read_only=True)
+    try:
+        return con.execute(
+            "SELECT COALESCE(SUM(row_count), 0) FROM partition_manifest WHERE stage = ?", [upstream]
+        ).fetchone()[0]
+    finally:
+        con.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def benchmark_scale(scale, seed, memory=None):
+    """
+    Generate data for one scale and time every stage; returns the per-stage results.
+
+    With `memory` (e.g. "4GB") every stage is sized for that much memory instead
+    of the machine's.
+    """
+    rows = parse_scale(scale)
+    data_dir = os.path.join(BENCH_DIR, f"data-{scale}-seed{seed}")
+    if not os.path.exists(os.path.join(data_dir, ".complete")):
+        print(f"Generating {scale} synthetic rows in {data_dir}")
+        generate(data_dir, rows, seed=seed)
+        open(os.path.join(data_dir, ".complete"), "w").close()
+
+    # Fresh scratch database per scale so runs are comparable
+    work_dir = os.path.join(BENCH_DIR, f"work-{scale}")
+    os.makedirs(work_dir, exist_ok=True)
+    for name in ("emissions.duckdb", "emissions.duckdb.wal"):
+        if os.path.exists(os.path.join(work_dir, name)):
+            os.remove(os.path.join(work_dir, name))
+    os.makedirs(os.path.join(work_dir, "data"), exist_ok=True)
+    emissions_csv = os.path.join(work_dir, "data", "vehicle_emissions.csv")
+    if not os.path.exists(emissions_csv):
+        os.symlink(os.path.join(REPO_DIR, "data", "vehicle_emissions.csv"), emissions_csv)
+
+    # The stages' run_metrics rows share one run id, so the run can be compared stage by stage
+    run_id = new_run_id()
+    env = dict(os.environ, PIPELINE_RUN_ID=run_id)
+    if memory:
+        env["PIPELINE_MEMORY"] = memory
+    results = {}
+    for stage in STAGES:
+        out = subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, "benchmark.py"), "--child-stage", stage, "--source", data_dir],
+            cwd=work_dir, capture_output=True, text=True, env=env,
+        )
+        if out.returncode != 0:
+            # Later stages would only measure the failed stage's leftovers
+            error = (out.stderr.strip().splitlines() or ["exit status %d" % out.returncode])[-1]
+            results[stage] = {"failed": True, "error": error, "run_id": run_id}
+            print(f"  {scale:>6} {stage:<10} FAILED: {error}")
+            logger.error(f"{scale} {stage} failed:\n{out.stderr}")
+            break
+        metrics = json.loads(out.stdout.strip().splitlines()[-1])
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            metrics["rows"] = stage_input_rows(stage)
+        finally:
+            os.chdir(cwd)
+        metrics["rows_per_sec"] = metrics["rows"] / metrics["seconds"] if metrics["seconds"] else None
+        metrics["run_id"] = run_id
+        results[stage] = metrics
+        print(f"  {scale:>6} {stage:<10} {metrics['seconds']:8.2f}s  {metrics['rows']:>12,} rows  "
+              f"{metrics['peak_rss_mb']:8.1f} MB RSS  {metrics['spill_bytes']:>12,} B spilled"
+              f"{'' if metrics['within_budget'] else '  OVER BUDGET'}")
+        logger.info(f"{scale} {stage}: {metrics}")
+    return results
+
+
+def compare(old_path, new_path):
+    """Print per-stage time ratios between two result files (new / old)."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    for scale, stages in new["scales"].items():
+        for stage, metrics in stages.items():
+            before = old["scales"].get(scale, {}).get(stage)
+            if not before:
+                continue
+            if before.get("failed") or metrics.get("failed"):
+                print(f"  {scale:>6} {stage:<10} {'failed' if before.get('failed') else 'ok'} -> "
+                      f"{'failed' if metrics.get('failed') else 'ok'}")
+                continue
+            ratio = metrics["seconds"] / before["seconds"] if before["seconds"] else float("nan")
+            print(f"  {scale:>6} {stage:<10} {before['seconds']:8.2f}s -> {metrics['seconds']:8.2f}s  ({ratio:.2f}x)")
+
+
+def main(scales, seed, memory=None):
+    result = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "memory": memory,
+        "scales": {},
+    }
+    for scale in scales:
+        result["scales"][scale] = benchmark_scale(scale, seed, memory)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{result['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {path}")
+    logger.info(f"Results written to {path}")
+    failed = [f"{scale} {stage}" for scale, stages in result["scales"].items()
+              for stage, metrics in stages.items() if metrics.get("failed")]
+    if failed:
+        print(f"Failed stages: {', '.join(failed)}")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark load/clean/transform/analysis on synthetic trip data")
+    parser.add_argument("--scales", nargs="+", default=["1M"], help="Yellow rows per run, e.g. 1M 10M 50M")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--memory", help="Size every stage for this much memory, e.g. 4GB (default: the machine's)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result JSON files")
+    parser.add_argument("--child-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_stage:
+        # The stage configures its own log file; keep its prints off stdout so the
+        # parent only sees the JSON line
+        real_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            child_main(args.child_stage, args.source, real_stdout)
+        finally:
+            sys.stdout = real_stdout
+        sys.exit(0)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='benchmark.log'
+    )
+    if args.compare:
+        compare(*args.compare)
+    else:
+        sys.exit(0 if main(args.scales, args.seed, args.memory) else 1)
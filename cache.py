@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# Local content-addressed cache for trip-data downloads.
+# Files are stored once per content hash under data/cache/objects/ and an index
+# (data/cache/index.json) maps each URL to its hash plus the ETag, Last-Modified
+# and size the server reported. A URL validated recently is served straight from
+# disk with no network I/O; older entries are revalidated with a conditional GET
+# (If-None-Match / If-Modified-Since) and only re-downloaded when they changed.
+# The cache is bounded in size and evicts the least recently used files.
+# For files read with byte-range requests instead (see ranged.py) only the footer
+# fingerprint is kept (data/cache/footers.json), trusted for the same time, so an
+# unchanged month costs no network I/O with either reader.
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "data/cache"
+
+# Upper bound on the bytes kept on disk (a full year of yellow + green is ~700 MB)
+MAX_CACHE_BYTES = 20 * 1024 ** 3
+
+# How long a cached URL is trusted without asking the server again. Published
+# TLC month files almost never change, so a week avoids any network I/O on reruns.
+REVALIDATE_AFTER = 7 * 24 * 3600
+
+
+class ParquetCache:
+    """
+    Size-bounded, content-addressed on-disk cache keyed by URL.
+
+    `get(url)` returns a local path for the URL's current content, downloading
+    it only when it is missing, stale and changed on the server. Safe to share
+    between the ingestion worker threads.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES,
+                 revalidate_after=REVALIDATE_AFTER):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.footers_path = os.path.join(cache_dir, "footers.json")
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index = self._read_index()
+        self.footers = self._read_json(self.footers_path)
+
+    # Index bookkeeping
+
+    def _read_index(self):
+        return self._read_json(self.index_path)
+
+    def _write_index(self):
+        self._write_json(self.index_path, self.index)
+
+    def _read_json(self, path):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache index {path}: {e}")
+            return {}
+
+    def _write_json(self, path, data):
+        # Write to a temp file and rename so a crash never leaves a half-written index
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, f"{sha256}.parquet")
+
+    def _cached_entry(self, url):
+        """Return the index entry for `url` if its object is still on disk."""
+        entry = self.index.get(url)
+        if entry and os.path.exists(self.object_path(entry["sha256"])):
+            return entry
+        return None
+
+    # Public API
+
+    def get(self, url, limiter=None):
+        """
+        Return a local path holding the current content of `url`.
+
+        `limiter` (an ingest.RateLimiter) is only consulted when a network
+        request is actually made.
+        """
+        with self.lock:
+            entry = self._cached_entry(url)
+            if entry and time.time() - entry["validated_at"] < self.revalidate_after:
+                entry["last_used"] = time.time()
+                self._write_index()
+                logger.info(f"Cache hit (fresh): {url}")
+                return self.object_path(entry["sha256"])
+
+        if limiter:
+            limiter.wait()
+        request = urllib.request.Request(url)
+        if entry:
+            if entry.get("etag"):
+                request.add_header("If-None-Match", entry["etag"])
+            if entry.get("last_modified"):
+                request.add_header("If-Modified-Since", entry["last_modified"])
+
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry:
+                with self.lock:
+                    entry["validated_at"] = entry["last_used"] = time.time()
+                    self._write_index()
+                logger.info(f"Cache hit (revalidated): {url}")
+                return self.object_path(entry["sha256"])
+            raise
+
+        with response:
+            logger.info(f"Downloading file: {url}")
+            sha256, size, tmp_path = self._download(response)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        with self.lock:
+            path = self.object_path(sha256)
+            if os.path.exists(path):
+                # Same bytes already cached under another URL (or an unchanged re-send)
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            now = time.time()
+            self.index[url] = {
+                "sha256": sha256,
+                "size": size,
+                "etag": etag,
+                "last_modified": last_modified,
+                "validated_at": now,
+                "last_used": now,
+            }
+            self._evict(keep=url)
+            self._write_index()
+        return path
+
+    def footer(self, url):
+        """(fingerprint, size) of `url`'s footer if it was read recently, else None."""
+        with self.lock:
+            entry = self.footers.get(url)
+            if entry and time.time() - entry["validated_at"] < self.revalidate_after:
+                return entry["fingerprint"], entry["size"]
+        return None
+
+    def record_footer(self, url, fingerprint, size):
+        """Remember the footer fingerprint the range reader just read from `url`."""
+        with self.lock:
+            self.footers[url] = {"fingerprint": fingerprint, "size": size, "validated_at": time.time()}
+            self._write_json(self.footers_path, self.footers)
+
+    def _download(self, response):
+        """Stream a response to a temp file while hashing it; return (sha256, size, tmp_path)."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.objects_dir, f".download-{threading.get_ident()}.part")
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = response.read(1 << 20)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        return digest.hexdigest(), size, tmp_path
+
+    def _evict(self, keep=None):
+        """Drop least recently used URLs (never `keep`) until the cached objects fit in max_bytes."""
+        sizes = {e["sha256"]: e["size"] for e in self.index.values()}
+        total = sum(sizes.values())
+        for url, entry in sorted(self.index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if url == keep:
+                continue
+            del self.index[url]
+            sha256 = entry["sha256"]
+            # Only delete the object once no other URL still points at it
+            if not any(e["sha256"] == sha256 for e in self.index.values()):
+                total -= sizes[sha256]
+                if os.path.exists(self.object_path(sha256)):
+                    os.remove(self.object_path(sha256))
+                logger.info(f"Evicted {url} from cache")
+
+    def total_bytes(self):
+        return sum({e["sha256"]: e["size"] for e in self.index.values()}.values())
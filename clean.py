@@ -1,6 +1,11 @@
 import duckdb
 import logging
-import pandas as pd
+
+from fleets import load_fleets
+from instrument import instrument
+from manifest import CLEAN, LOAD, ensure_manifest, get_partitions, month_bounds, pending_partitions, record_partition
+from resources import apply_profile
+from storage import QUARANTINE_TABLE, create_quarantine_table, create_trip_table
 
 # Logging Setup
 logging.basicConfig(
@@ -10,85 +15,234 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# This is the Timeframe we are working with
-YEAR_START = '2024-01-01'
-YEAR_END = '2024-12-31'
+# Raw tables from the load step come from the fleet specs (fleets.yml): each
+# fleet is a taxi type with its own raw table. Cleaned rows go to clean_<table>;
+# the raw tables are kept so that a single month can be re-cleaned when it is reloaded.
+
+# Instead of chunking by month by hand (the old version got "Killed"), DuckDB's
+# memory is capped and large aggregates spill to disk; the limits come from the
+# resource profile (see resources.py).
+
+# Rejected rows are kept (with their rule bitmask) instead of silently discarded,
+# and a per-month, per-rule count is kept next to them (the quarantine table's
+# schema is in storage.py).
+REJECTION_SUMMARY_TABLE = "clean_rejection_summary"
+
+# Cleaning rules as (bit, name, condition that REJECTS a row).
+# Every raw row gets a bitmask of the rules it breaks; 0 means the row is clean.
+REJECTION_RULES = [
+    (1, "missing_dropoff", "drop_off_dt IS NULL"),
+    (2, "no_passengers", "passenger_count IS NULL OR passenger_count <= 0"),
+    (4, "zero_distance", "trip_distance IS NULL OR trip_distance <= 0"),
+    (8, "over_100_miles", "trip_distance > 100"),
+    (16, "over_24_hours", "(drop_off_dt - pick_up_datetime) > INTERVAL '24 hours'"),
+]
+
+
+def rejection_mask_sql():
+    """SQL expression that evaluates to the rule bitmask of a raw row."""
+    return " + ".join(f"(CASE WHEN {cond} THEN {bit} ELSE 0 END)" for bit, _, cond in REJECTION_RULES)
+
+
+def months_filter_sql(partitions):
+    """WHERE clause selecting the pickup months of the given (year, month) partitions."""
+    ranges = []
+    for year, month in partitions:
+        start, end = month_bounds(year, month)
+        ranges.append(f"(pick_up_datetime >= '{start}' AND pick_up_datetime < '{end}')")
+    return " OR ".join(ranges)
+
+
+def stage_partitions(con, taxi, partitions):
+    """
+    Single pass over the raw table: dedup and flag every row of the given months.
+
+    Rows are grouped on all four columns, which removes duplicates (`copies`
+    keeps how many times each trip appeared) and attaches the rejection bitmask
+    in the same hash aggregate. DuckDB spills the aggregate to the profile's
+    temp_directory if it outgrows its memory_limit. Everything downstream reads
+    this staged result, never the raw table again.
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE staged_{taxi} AS
+        SELECT pick_up_datetime, drop_off_dt, passenger_count, trip_distance,
+               {rejection_mask_sql()} AS reject_mask,
+               COUNT(*) AS copies
+        FROM {taxi}
+        WHERE {months_filter_sql(partitions)}
+        GROUP BY ALL
+    """)
+
+
+def summarize_staged(con, taxi):
+    """
+    Verification counts per month, computed from the staged rows.
+
+    Returns a list of dicts with rows_in, duplicates, rejected, rows_out and one
+    count per rejection rule (a row breaking several rules counts under each).
+    """
+    rule_counts = ",\n".join(
+        f"SUM(copies) FILTER (WHERE reject_mask & {bit} <> 0) AS {name}"
+        for bit, name, _ in REJECTION_RULES
+    )
+    df = con.execute(f"""
+        SELECT EXTRACT(YEAR FROM pick_up_datetime) AS year,
+               EXTRACT(MONTH FROM pick_up_datetime) AS month,
+               SUM(copies) AS rows_in,
+               COALESCE(SUM(copies - 1) FILTER (WHERE reject_mask = 0), 0) AS duplicates,
+               COALESCE(SUM(copies) FILTER (WHERE reject_mask <> 0), 0) AS rejected,
+               COUNT(*) FILTER (WHERE reject_mask = 0) AS rows_out,
+               {rule_counts}
+        FROM staged_{taxi}
+        GROUP BY ALL
+        ORDER BY year, month
+    """).fetchdf()
+    return df.fillna(0).to_dict("records")
+
+
+def ensure_quarantine_tables(con):
+    create_quarantine_table(con)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {REJECTION_SUMMARY_TABLE} (
+            taxi_type VARCHAR,
+            year INTEGER,
+            month INTEGER,
+            rule VARCHAR,
+            rows_rejected BIGINT,
+            PRIMARY KEY (taxi_type, year, month, rule)
+        )
+    """)
+
+
+def quarantine_months(con, taxi_type, taxi, partitions, summary):
+    """
+    Replace the quarantined rows and rule summary of the given months.
+
+    Rejected rows come from the same staged table as the clean insert, so this
+    adds no pass over the raw table. Each distinct rejected trip is stored once
+    with its rule bitmask and the number of raw copies. Must run inside the
+    caller's transaction.
+    """
+    con.execute(f"DELETE FROM {QUARANTINE_TABLE} WHERE taxi_type = ? AND ({months_filter_sql(partitions)})", [taxi_type])
+    con.execute(f"""
+        INSERT INTO {QUARANTINE_TABLE}
+        SELECT '{taxi_type}', pick_up_datetime, drop_off_dt, passenger_count, trip_distance, reject_mask, copies
+        FROM staged_{taxi}
+        WHERE reject_mask <> 0
+    """)
+
+    rows = []
+    for s in summary:
+        year, month = int(s["year"]), int(s["month"])
+        rows.append([taxi_type, year, month, "duplicate", int(s["duplicates"])])
+        rows.extend([taxi_type, year, month, name, int(s[name])] for _, name, _ in REJECTION_RULES)
+    for year, month in partitions:
+        con.execute(f"DELETE FROM {REJECTION_SUMMARY_TABLE} WHERE taxi_type = ? AND year = ? AND month = ?",
+                    [taxi_type, year, month])
+    if rows:
+        con.executemany(f"INSERT INTO {REJECTION_SUMMARY_TABLE} VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def configure(con):
+    """Apply the resource profile and create the shared tables; the settings hold for every connection to the database."""
+    apply_profile(con)
+    ensure_manifest(con)
+    ensure_quarantine_tables(con)
+
+
+def clean_taxi(con, taxi_type):
+    """
+    Clean the loaded months of one taxi type that changed since they were last cleaned.
+    Returns the number of months cleaned.
+    """
+    taxi = load_fleets()[taxi_type]["table"]
+    clean_table = f"clean_{taxi}"
+
+    # Create clean table (same compact types as the raw table, see storage.py)
+    create_trip_table(con, clean_table)
+    logger.info(f"Created {clean_table} table (if not exists)")
+
+    # Only months that were loaded or reloaded since they were last cleaned
+    pending = pending_partitions(con, CLEAN, LOAD, taxi_type)
+    if not pending:
+        print(f"{taxi} - No new or changed months to clean.")
+        logger.info(f"{taxi} - clean table is up to date")
+        return 0
+    fingerprints = {(y, m): fp for _, y, m, fp in pending}
+
+    stage_partitions(con, taxi, list(fingerprints))
+    summary = summarize_staged(con, taxi)
+    by_month = {(int(s["year"]), int(s["month"])): s for s in summary}
+
+    # Swap in the cleaned and quarantined months and record them in the manifest atomically
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM {clean_table} WHERE {months_filter_sql(fingerprints)}")
+        inserted = con.execute(f"""
+            INSERT INTO {clean_table}
+            SELECT pick_up_datetime, drop_off_dt, passenger_count, trip_distance
+            FROM staged_{taxi}
+            WHERE reject_mask = 0
+            ORDER BY pick_up_datetime
+        """).fetchone()[0]
+        quarantine_months(con, taxi_type, taxi, list(fingerprints), summary)
+        for (year, month), fingerprint in fingerprints.items():
+            rows_out = int(by_month.get((year, month), {}).get("rows_out", 0))
+            record_partition(con, CLEAN, taxi_type, year, month, fingerprint, rows_out)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    con.execute(f"DROP TABLE staged_{taxi}")
+    logger.info(f"Inserted cleaned {taxi} data for {len(fingerprints)} month(s)")
+
+    for s in summary:
+        reasons = ", ".join(f"{name}={int(s[name])}" for _, name, _ in REJECTION_RULES)
+        logger.info(f"{taxi} {int(s['year'])}-{int(s['month']):02d}: rows_in={int(s['rows_in'])}, "
+                    f"duplicates={int(s['duplicates'])}, rejected={int(s['rejected'])} ({reasons}), "
+                    f"rows_out={int(s['rows_out'])}")
+
+    # Verification comes from the staged counts: every row that reached the clean
+    # table had a zero rejection mask and was unique within its group.
+    rows_in = sum(int(s["rows_in"]) for s in summary)
+    duplicates = sum(int(s["duplicates"]) for s in summary)
+    rejected = sum(int(s["rejected"]) for s in summary)
+    rows_out = sum(int(s["rows_out"]) for s in summary)
+    if rows_out != inserted:
+        raise RuntimeError(f"{taxi}: inserted {inserted} rows but expected {rows_out}")
+
+    print(f"{taxi} - Months cleaned: {len(fingerprints)}")
+    print(f"{taxi} - Raw rows: {rows_in}")
+    print(f"{taxi} - Duplicates removed: {duplicates}")
+    print(f"{taxi} - Invalid rows quarantined: {rejected}")
+    for _, name, _ in REJECTION_RULES:
+        print(f"    {name}: {sum(int(s[name]) for s in summary)}")
+    print(f"{taxi} - Clean rows: {rows_out}")
+
+    logger.info(f"{taxi} - rows_in={rows_in}, duplicates={duplicates}, invalid={rejected}, clean={rows_out}")
+    return len(fingerprints)
+
 
 # Let's define a function that will clean and verify the cleaned components
-def clean_and_verify_chunked():
-    con = duckdb.connect(database='emissions.duckdb', read_only=False)
+def clean_and_verify():
+    con = instrument(duckdb.connect(database='emissions.duckdb', read_only=False), "clean")
     logger.info("Connected to emissions.duckdb for cleaning and verification")
-    
-    # Taxi tables
-    taxis = ["yellow_taxi_data", "green_taxi_data"]  # These are the two tables we created in the load step
-    
-    # Monthly chunks
-    dates = pd.date_range(start=YEAR_START, end=YEAR_END, freq='MS')
-    
-    for taxi in taxis:
-        clean_table = f"clean_{taxi}"
-        
-        # Create clean table
-        con.execute(f"""
-            CREATE TABLE IF NOT EXISTS {clean_table} (
-                pick_up_datetime TIMESTAMP,
-                drop_off_dt TIMESTAMP,
-                passenger_count INT,
-                trip_distance DOUBLE
-            )
-        """)
-        logger.info(f"Created {clean_table} table (if not exists)")
-
-        invalid_count = 0  # Counter for the invalid rows across months
-        
-        # CHATGPT helped me frame this for loop because my terminal kept throwing a "Killed" statement 
-        # and it offered a step of chunking by months.
-        for start, end in zip(dates, dates[1:].append(pd.Index([pd.Timestamp(YEAR_END)]))):
-            # Insert cleaned data per month
-            con.execute(f"""
-                INSERT INTO {clean_table}
-                SELECT DISTINCT pick_up_datetime, drop_off_dt, passenger_count, trip_distance 
-                FROM {taxi}
-                WHERE pick_up_datetime >= '{start}' AND pick_up_datetime < '{end}'
-                  AND drop_off_dt IS NOT NULL
-                  AND passenger_count > 0
-                  AND trip_distance > 0 
-                  AND trip_distance <= 100
-                  AND (drop_off_dt - pick_up_datetime) <= INTERVAL '24 hours';
-            """)
-            logger.info(f"Inserted cleaned {taxi} data from {start.date()} to {end.date()}")
-            
-            # Verify invalid rows for this month
-            issues = con.execute(f"""
-                SELECT COUNT(*) FROM {clean_table}
-                WHERE pick_up_datetime IS NULL
-                   OR drop_off_dt IS NULL
-                   OR passenger_count <= 0
-                   OR trip_distance <= 0 OR trip_distance > 100
-                   OR (drop_off_dt - pick_up_datetime) > INTERVAL '24 hours'
-                   OR pick_up_datetime NOT BETWEEN '{YEAR_START}' AND '{YEAR_END}'
-                   OR drop_off_dt NOT BETWEEN '{YEAR_START}' AND '{YEAR_END}';
-            """).fetchone()[0]
-            invalid_count += issues
-
-        # Replace original table with cleaned table (swing method)
-        con.execute(f"DROP TABLE IF EXISTS {taxi}")
-        con.execute(f"ALTER TABLE {clean_table} RENAME TO {taxi}")
-        logger.info(f"{taxi} cleaned and old table replaced")
-        
-        # Check for duplicates
-        total_rows = con.execute(f"SELECT COUNT(*) FROM {taxi}").fetchone()[0]
-        distinct_rows = con.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {taxi})").fetchone()[0]
-        
-        # The total invalid rows is the verification step that makes sure passenger_count, 
-        # trip_distance, and the time interval is valid and satisfies the requirements for this project
-        print(f"{taxi} - Invalid rows (2024): {invalid_count}")
-        print(f"{taxi} - Total rows: {total_rows}")
-        print(f"{taxi} - Distinct rows: {distinct_rows}")
-        print("No duplicates found." if total_rows == distinct_rows else "Duplicates found.")
-        
-        logger.info(f"{taxi} - Invalid rows: {invalid_count}, Duplicates check: {'No duplicates' if total_rows == distinct_rows else 'Duplicates found'}")
+    configure(con)
 
-if __name__ == "__main__":
-    clean_and_verify_chunked()
+    try:
+        # Every fleet that has been loaded, whether or not it is enabled by default
+        loaded = {taxi_type for taxi_type, _, _ in get_partitions(con, LOAD)}
+        for taxi_type in load_fleets():
+            if taxi_type in loaded:
+                clean_taxi(con, taxi_type)
+
+    except Exception as e:
+        logger.error(f"Error during cleaning: {e}")
+        print("Error during cleaning:", e)
 
+    finally:
+        con.close()
+        logger.info("DuckDB connection closed")
+
+if __name__ == "__main__":
+    clean_and_verify()
@@ -0,0 +1,42 @@
+{#
+    Pickup months of one taxi type that were (re)cleaned since this model last
+    processed them, according to the partition manifest written by the Python
+    pipeline (see manifest.py). Used by incremental models to only process new
+    or changed months.
+#}
+{% macro pending_months(taxi_type) %}
+    SELECT make_timestamp(c.year, c.month, 1, 0, 0, 0)
+    FROM {{ source('nyc_taxi', 'partition_manifest') }} c
+    LEFT JOIN {{ source('nyc_taxi', 'partition_manifest') }} d
+        ON d.stage = 'dbt_transform'
+       AND d.taxi_type = c.taxi_type
+       AND d.year = c.year
+       AND d.month = c.month
+    WHERE c.stage = 'clean'
+      AND c.taxi_type = '{{ taxi_type }}'
+      AND d.fingerprint IS DISTINCT FROM c.fingerprint
+{% endmacro %}
+
+
+{#
+    Post-hook: record the months this run processed under the 'dbt_transform'
+    stage, so the next incremental run skips them until they are cleaned again.
+    Only the cleaned months of `taxi_types` (the ones the model selects) are
+    recorded; a fleet the model doesn't read was not processed by it.
+#}
+{% macro record_dbt_months(taxi_types) %}
+    INSERT OR REPLACE INTO {{ source('nyc_taxi', 'partition_manifest') }}
+    SELECT 'dbt_transform', c.taxi_type, c.year, c.month, c.fingerprint,
+           (SELECT COUNT(*) FROM {{ this }} t
+            WHERE t.taxi_type = c.taxi_type AND t.trip_year = c.year AND t.trip_month = c.month),
+           now()
+    FROM {{ source('nyc_taxi', 'partition_manifest') }} c
+    LEFT JOIN {{ source('nyc_taxi', 'partition_manifest') }} d
+        ON d.stage = 'dbt_transform'
+       AND d.taxi_type = c.taxi_type
+       AND d.year = c.year
+       AND d.month = c.month
+    WHERE c.stage = 'clean'
+      AND c.taxi_type IN ({% for taxi_type in taxi_types %}'{{ taxi_type }}'{{ ", " if not loop.last }}{% endfor %})
+      AND d.fingerprint IS DISTINCT FROM c.fingerprint
+{% endmacro %}
@@ -0,0 +1,241 @@
+import argparse
+import logging
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from export import parquet_connection
+from instrument import instrument
+from resources import connect_duckdb
+
+# Streaming analysis of per-trip data.
+# analysis.py's summaries are a few dozen rows, so they are fetched straight
+# into pandas. Per-trip outputs (top-N trips, distributions of avg_mph or
+# co2_kg_per_trip) can be as large as the trip table itself, so here results
+# are streamed from DuckDB as Arrow record batches of BATCH_ROWS rows and
+# written out batch by batch; memory stays bounded by one batch no matter how
+# many rows the query returns. Quantiles and histograms are computed inside
+# DuckDB per group and only the small per-group result comes back:
+#   - approximate quantiles use approx_quantile (a t-digest of fixed size per group)
+#   - exact quantiles use quantile_cont (which has to sort each group's values)
+#   - histograms count rows per fixed-width bin
+logger = logging.getLogger(__name__)
+
+DATABASE = "emissions.duckdb"
+TRIP_TABLE = "taxi_trips_transformed"
+
+# Rows per Arrow record batch handed to Python
+BATCH_ROWS = 100_000
+
+# Per-trip numeric columns a distribution can be computed for
+MEASURES = ["avg_mph", "co2_kg_per_trip", "trip_distance", "trip_duration_seconds"]
+
+# Trip columns a distribution can be grouped by
+GROUP_COLUMNS = ["taxi_type", "trip_year", "trip_month", "trip_week", "trip_day_of_week", "trip_hour",
+                 "passenger_count"]
+
+DEFAULT_GROUP_BY = ["taxi_type", "trip_hour"]
+DEFAULT_QUANTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+DEFAULT_BINS = 20
+
+# Histograms default to this quantile as their upper edge, so a handful of absurd
+# values (e.g. a 5,000 mph trip) don't squash every other trip into the first bin
+HISTOGRAM_UPPER_QUANTILE = 0.99
+
+
+def check_measure(measure):
+    if measure not in MEASURES:
+        raise ValueError(f"Unknown measure '{measure}'; choose from {', '.join(MEASURES)}")
+
+
+def check_group_by(group_by):
+    for column in group_by:
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Unknown group_by column '{column}'; choose from {', '.join(GROUP_COLUMNS)}")
+
+
+def stream_batches(con, sql, batch_rows=BATCH_ROWS):
+    """Yield the result of `sql` as Arrow record batches of at most `batch_rows` rows."""
+    result = con.execute(sql)
+    # DuckDB 1.4 renamed fetch_record_batch to to_arrow_reader
+    if hasattr(result, "to_arrow_reader"):
+        reader = result.to_arrow_reader(batch_rows)
+    else:
+        reader = result.fetch_record_batch(batch_rows)
+    for batch in reader:
+        yield batch
+
+
+def write_batches(batches, path):
+    """Write record batches to a parquet file one at a time; returns the number of rows written."""
+    writer = None
+    rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema, compression="zstd")
+            writer.write_table(pa.Table.from_batches([batch]))
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def top_trips_sql(measure, n, group_by=("taxi_type",)):
+    """The `n` trips with the largest `measure` in each group, largest first."""
+    check_measure(measure)
+    check_group_by(group_by)
+    groups = ", ".join(group_by)
+    return f"""
+        SELECT *
+        FROM {TRIP_TABLE}
+        WHERE {measure} IS NOT NULL
+        QUALIFY row_number() OVER (PARTITION BY {groups} ORDER BY {measure} DESC) <= {int(n)}
+        ORDER BY {groups}, {measure} DESC
+    """
+
+
+def quantiles_sql(measure, quantiles=DEFAULT_QUANTILES, group_by=DEFAULT_GROUP_BY, exact=False):
+    """
+    One row per group and quantile: (*group_by, quantile, value).
+
+    approx_quantile keeps a fixed-size t-digest per group, so its memory doesn't
+    grow with the number of trips; quantile_cont is exact but buffers and sorts
+    every value of a group.
+    """
+    check_measure(measure)
+    check_group_by(group_by)
+    for q in quantiles:
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantiles must be between 0 and 1, not {q}")
+    groups = ", ".join(group_by)
+    probs = ", ".join(str(float(q)) for q in quantiles)
+    function = "quantile_cont" if exact else "approx_quantile"
+    return f"""
+        SELECT {groups},
+               UNNEST([{probs}]::DOUBLE[]) AS quantile,
+               UNNEST({function}({measure}, [{probs}])) AS value
+        FROM {TRIP_TABLE}
+        WHERE {measure} IS NOT NULL AND isfinite({measure})
+        GROUP BY {groups}
+        ORDER BY {groups}, quantile
+    """
+
+
+def histogram_range(con, measure, upper_quantile=HISTOGRAM_UPPER_QUANTILE):
+    """Default (low, high) histogram edges: the smallest value and an upper quantile of `measure`."""
+    check_measure(measure)
+    low, high = con.execute(f"""
+        SELECT MIN({measure}), approx_quantile({measure}, {upper_quantile})
+        FROM {TRIP_TABLE}
+        WHERE {measure} IS NOT NULL AND isfinite({measure})
+    """).fetchone()
+    return float(low), float(high)
+
+
+def histogram_sql(measure, low, high, bins=DEFAULT_BINS, group_by=DEFAULT_GROUP_BY):
+    """
+    One row per group and bin: (*group_by, bin, bin_low, bin_high, trips).
+
+    Bins are `bins` equal-width intervals over [low, high); values below `low`
+    are counted in the first bin and values at or above `high` in the last one.
+    Empty bins are left out.
+    """
+    check_measure(measure)
+    check_group_by(group_by)
+    if high <= low:
+        raise ValueError(f"Histogram range is empty: low={low}, high={high}")
+    if bins < 1:
+        raise ValueError(f"A histogram needs at least one bin, not {bins}")
+    groups = ", ".join(group_by)
+    width = (high - low) / bins
+    return f"""
+        SELECT {groups},
+               bin,
+               CAST({low} + bin * {width} AS DOUBLE) AS bin_low,
+               CAST({low} + (bin + 1) * {width} AS DOUBLE) AS bin_high,
+               COUNT(*) AS trips
+        FROM (
+            SELECT {groups},
+                   CAST(LEAST(GREATEST(FLOOR(({measure} - {low}) / {width}), 0), {bins - 1}) AS INTEGER) AS bin
+            FROM {TRIP_TABLE}
+            WHERE {measure} IS NOT NULL AND isfinite({measure})
+        )
+        GROUP BY {groups}, bin
+        ORDER BY {groups}, bin
+    """
+
+
+def connect(source="duckdb"):
+    if source == "parquet":
+        return instrument(parquet_connection(), "distributions")
+    return instrument(connect_duckdb(DATABASE, read_only=True), "distributions")
+
+
+def report_distribution(args):
+    """
+    Compute one distribution and print it or stream it to a parquet file.
+
+    Workflow:
+    1. Connect read-only to emissions.duckdb (or the parquet export).
+    2. Build the quantile, histogram or top-N query for the measure.
+    3. Stream the result in Arrow batches to --out, or print it when it is small.
+    """
+    con = None
+    try:
+        con = connect(args.source)
+        # Top trips are ranked per taxi type unless asked otherwise
+        group_by = args.group_by or (["taxi_type"] if args.kind == "top" else DEFAULT_GROUP_BY)
+        if args.kind == "quantiles":
+            sql = quantiles_sql(args.measure, args.quantiles or DEFAULT_QUANTILES, group_by, args.exact)
+        elif args.kind == "histogram":
+            low, high = args.range or histogram_range(con, args.measure)
+            sql = histogram_sql(args.measure, low, high, args.bins, group_by)
+        else:
+            sql = top_trips_sql(args.measure, args.top, group_by)
+
+        batches = stream_batches(con, sql, args.batch_rows)
+        if args.out:
+            rows = write_batches(batches, args.out)
+            print(f"Wrote {rows:,} rows to {args.out}")
+        else:
+            rows = 0
+            for batch in batches:
+                print(batch.to_pandas().to_string(index=False, header=rows == 0))
+                rows += batch.num_rows
+        logger.info(f"{args.kind} of {args.measure} by {', '.join(group_by)}: {rows} rows")
+
+    except Exception as e:
+        logger.error(f"Error computing distribution: {e}")
+        print("Error computing distribution:", e)
+
+    finally:
+        if con:
+            con.close()
+            logger.info("DuckDB connection closed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantiles, histograms and top trips computed in DuckDB and streamed in Arrow batches")
+    parser.add_argument("kind", choices=["quantiles", "histogram", "top"])
+    parser.add_argument("--measure", choices=MEASURES, default="co2_kg_per_trip")
+    parser.add_argument("--group-by", nargs="+", choices=GROUP_COLUMNS, help=f"Grouping columns (default: {' '.join(DEFAULT_GROUP_BY)})")
+    parser.add_argument("--quantiles", nargs="+", type=float, help="Quantiles to compute (default: 0.01 0.25 0.5 0.75 0.99)")
+    parser.add_argument("--exact", action="store_true", help="Exact quantiles (sorts every group) instead of approximate ones")
+    parser.add_argument("--bins", type=int, default=DEFAULT_BINS, help="Number of histogram bins")
+    parser.add_argument("--range", nargs=2, type=float, metavar=("LOW", "HIGH"),
+                        help="Histogram range (default: minimum to the 99th percentile)")
+    parser.add_argument("--top", type=int, default=10, help="Trips per group for `top`")
+    parser.add_argument("--out", help="Stream the result to this parquet file instead of printing it")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Rows per Arrow record batch")
+    parser.add_argument("--source", choices=["duckdb", "parquet"], default="duckdb",
+                        help="Read emissions.duckdb or the hive-partitioned parquet export")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='distributions.log'
+    )
+    report_distribution(args)
@@ -0,0 +1,100 @@
+import logging
+
+# Per-trip CO2 models used by transform.py.
+# A model turns a trip's distance and average speed into kg of CO2, given its
+# fleet's row of vehicle_emissions. The row is resolved once per fleet and its
+# numbers are written into the transform SQL as constants, so DuckDB computes
+# every trip's CO2 with vectorized arithmetic instead of joining each trip to
+# vehicle_emissions. Models are picked by name (transform.py / pipeline.py
+# --emissions-model); the name is part of the transform's partition salt, so
+# switching models re-transforms every month.
+#
+#   per_mile:      distance * co2_grams_per_mile (the original calculation)
+#   city_highway:  the fuel a trip burns is blended between mpg_city and
+#                  mpg_highway by its average speed, and scaled so a trip at the
+#                  EPA combined mix (55% city / 45% highway) emits exactly
+#                  co2_grams_per_mile; slow, stop-and-go trips come out heavier
+#                  and fast ones lighter
+#
+# Neither model has a separate trip-duration term: the average speed is the
+# distance over the duration, so a long trip for its distance (slow traffic)
+# already counts as city driving. A time-based term such as fuel burnt while
+# idling would need an idle rate per vehicle, which vehicle_emissions.csv
+# doesn't have, so it was deliberately left out.
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "per_mile"
+
+# Average speeds of the EPA city and highway test cycles. A trip at or below
+# CITY_MPH counts as all city driving, at or above HIGHWAY_MPH as all highway,
+# and in between as a linear mix.
+CITY_MPH = 21.2
+HIGHWAY_MPH = 48.3
+
+# City share of the EPA combined fuel economy rating
+COMBINED_CITY_SHARE = 0.55
+
+# vehicle_emissions columns the models read
+FACTOR_COLUMNS = ["co2_grams_per_mile", "mpg_city", "mpg_highway"]
+
+
+def sql_number(value):
+    return "NULL" if value is None else repr(float(value))
+
+
+def per_mile_sql(factors, distance, mph):
+    return f"{distance} * {sql_number(factors.get('co2_grams_per_mile'))} / 1000"
+
+
+def city_highway_sql(factors, distance, mph):
+    """
+    Speed-blended CO2: `mph` (distance / duration) places the trip between the
+    city and highway cycles. Duration only enters through `mph`; see the notes above.
+    """
+    grams, mpg_city, mpg_highway = (factors.get(c) for c in FACTOR_COLUMNS)
+    if None in (grams, mpg_city, mpg_highway):
+        return "NULL"
+    # Grams of CO2 per gallon implied by the rated grams per mile at the combined mix
+    fuel_per_mile_combined = COMBINED_CITY_SHARE / mpg_city + (1 - COMBINED_CITY_SHARE) / mpg_highway
+    grams_per_gallon = grams / fuel_per_mile_combined
+    city = grams_per_gallon / mpg_city
+    highway = grams_per_gallon / mpg_highway
+    highway_share = f"LEAST(GREATEST(({mph} - {CITY_MPH}) / {HIGHWAY_MPH - CITY_MPH}, 0), 1)"
+    return f"{distance} * ({sql_number(city)} + {highway_share} * {sql_number(highway - city)}) / 1000"
+
+
+# Model name -> function(factors, distance SQL, mph SQL) returning the SQL of kg CO2 per trip
+EMISSIONS_MODELS = {
+    "per_mile": per_mile_sql,
+    "city_highway": city_highway_sql,
+}
+
+
+def resolve_factors(con, vehicle_type):
+    """The vehicle_emissions numbers of one vehicle_type as a dict ({} if it isn't in the table)."""
+    row = con.execute(
+        f"SELECT {', '.join(FACTOR_COLUMNS)} FROM vehicle_emissions WHERE vehicle_type = ?", [vehicle_type]
+    ).fetchone()
+    if row is None:
+        logger.warning(f"vehicle_type '{vehicle_type}' is not in vehicle_emissions; its CO2 will be NULL")
+        return {}
+    return dict(zip(FACTOR_COLUMNS, row))
+
+
+def co2_sql(model, factors, distance, mph):
+    """SQL computing kg of CO2 per trip with the named `model`."""
+    if model not in EMISSIONS_MODELS:
+        raise ValueError(f"Unknown emissions model '{model}'; choose from {', '.join(EMISSIONS_MODELS)}")
+    return EMISSIONS_MODELS[model](factors, distance, mph)
+
+
+def model_salt(model, emissions_fp):
+    """
+    Transform partition salt for `model` with the lookup table fingerprint `emissions_fp`.
+
+    The default model keeps the bare fingerprint, so databases transformed
+    before models existed aren't re-transformed.
+    """
+    if model == DEFAULT_MODEL:
+        return emissions_fp
+    return f"{emissions_fp}:{model}"
@@ -0,0 +1,100 @@
+import logging
+import os
+
+from instrument import instrument
+from manifest import EXPORT, TRANSFORM, ensure_manifest, pending_partitions, record_partition
+from resources import connect_duckdb
+
+# Parquet materialization of taxi_trips_transformed.
+# The trip table is written as zstd-compressed parquet in a hive layout:
+#   exports/taxi_trips_transformed/taxi_type=yellow/trip_year=2024/trip_month=1/data.parquet
+# with rows sorted by pickup time, so row-group min/max statistics let readers
+# skip whole row groups on time filters and the directory names let them skip
+# whole partitions. Readers don't need emissions.duckdb (or its writer lock).
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = "exports/taxi_trips_transformed"
+
+# Rows per parquet row group (DuckDB's default vector-aligned size)
+ROW_GROUP_SIZE = 122880
+
+
+def partition_path(taxi_type, year, month, export_dir=EXPORT_DIR):
+    return os.path.join(export_dir, f"taxi_type={taxi_type}", f"trip_year={year}", f"trip_month={month}", "data.parquet")
+
+
+def export_partition(con, taxi_type, year, month, export_dir=EXPORT_DIR):
+    """
+    Write one (taxi_type, year, month) partition of the trip table to parquet.
+
+    The file is written next to its final name and renamed into place, so
+    concurrent readers see either the old or the new partition, never half of one.
+    Returns the number of rows written.
+    """
+    path = partition_path(taxi_type, year, month, export_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    con.execute(f"""
+        COPY (
+            SELECT * EXCLUDE (taxi_type, trip_year, trip_month)
+            FROM taxi_trips_transformed
+            WHERE taxi_type = '{taxi_type}' AND trip_year = {year} AND trip_month = {month}
+            ORDER BY pick_up_datetime
+        ) TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {ROW_GROUP_SIZE})
+    """)
+    os.replace(tmp_path, path)
+    return con.execute(f"SELECT COUNT(*) FROM read_parquet('{path}')").fetchone()[0]
+
+
+def export_pending(con, export_dir=EXPORT_DIR):
+    """Export every partition transformed since it was last exported; returns how many were written."""
+    ensure_manifest(con)
+    pending = pending_partitions(con, EXPORT, TRANSFORM)
+    for taxi_type, year, month, fingerprint in pending:
+        rows = export_partition(con, taxi_type, year, month, export_dir)
+        record_partition(con, EXPORT, taxi_type, year, month, fingerprint, rows)
+        logger.info(f"Exported {taxi_type} {year}-{month:02d}: {rows} rows")
+    return len(pending)
+
+
+def parquet_connection(export_dir=EXPORT_DIR):
+    """
+    In-memory DuckDB connection exposing the parquet export as `taxi_trips_transformed`.
+
+    Lets analysis (or any other reader) run the usual queries against the export
+    concurrently with a pipeline that holds emissions.duckdb open for writing.
+    """
+    con = connect_duckdb()
+    con.execute(f"""
+        CREATE VIEW taxi_trips_transformed AS
+        SELECT * FROM read_parquet('{export_dir}/*/*/*/*.parquet', hive_partitioning = true)
+    """)
+    return con
+
+
+def export_taxi_data():
+    con = instrument(connect_duckdb('emissions.duckdb', read_only=False), "export")
+    logger.info("Connected to emissions.duckdb for parquet export")
+
+    try:
+        written = export_pending(con)
+        logger.info(f"Export complete: {written} partition(s) written to {EXPORT_DIR}")
+        print(f"Export complete: {written} partition(s) written to {EXPORT_DIR}")
+
+    except Exception as e:
+        logger.error(f"Error during export: {e}")
+        print("Error during export:", e)
+
+    finally:
+        con.close()
+        logger.info("DuckDB connection closed")
+
+if __name__ == "__main__":
+    # Logging is configured here rather than at import time, because transform.py
+    # and analysis.py import this module and keep their own log files.
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='export.log'
+    )
+    export_taxi_data()
@@ -0,0 +1,61 @@
+import logging
+import os
+
+import yaml
+
+# Declarative fleet specs (fleets.yml) shared by the loader, the clean and
+# transform stages and the pipeline. A fleet is a plain dict:
+#   {"name", "file", "table", "columns", "filter", "vehicle_type", "years", "months", "enabled"}
+# where "columns" always maps all four trip columns below.
+logger = logging.getLogger(__name__)
+
+FLEETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleets.yml")
+
+# Trip columns every fleet must provide (the raw table schema, in this order)
+TRIP_COLUMNS = ["pick_up_datetime", "drop_off_dt", "passenger_count", "trip_distance"]
+
+REQUIRED_KEYS = ["file", "table", "columns", "vehicle_type"]
+
+
+def load_fleets(path=FLEETS_FILE):
+    """Read and validate the fleet specs; returns {name: fleet} in file order."""
+    with open(path) as f:
+        spec = yaml.safe_load(f)
+    defaults = spec.get("defaults", {})
+    fleets = {}
+    for name, entry in spec["fleets"].items():
+        fleet = {"filter": {}, "years": [2024], "months": list(range(1, 13)), "enabled": True}
+        fleet.update(defaults)
+        fleet.update(entry)
+        fleet["name"] = name
+        missing = [key for key in REQUIRED_KEYS if key not in fleet]
+        if missing:
+            raise ValueError(f"{path}: fleet '{name}' is missing {', '.join(missing)}")
+        unmapped = [c for c in TRIP_COLUMNS if c not in fleet["columns"]]
+        if unmapped:
+            raise ValueError(f"{path}: fleet '{name}' does not map {', '.join(unmapped)}")
+        fleets[name] = fleet
+    return fleets
+
+
+def select_fleets(names=None, path=FLEETS_FILE):
+    """Fleets by name (all enabled fleets when `names` is empty)."""
+    fleets = load_fleets(path)
+    if not names:
+        return {name: fleet for name, fleet in fleets.items() if fleet["enabled"]}
+    unknown = [n for n in names if n not in fleets]
+    if unknown:
+        raise ValueError(f"Unknown fleet(s) {', '.join(unknown)}; {path} defines {', '.join(fleets)}")
+    return {name: fleets[name] for name in names}
+
+
+def fleet_file_name(fleet, year, month):
+    """Return the file name of one month of a fleet, e.g. yellow_tripdata_2024-01.parquet."""
+    return fleet["file"].format(year=year, month=month)
+
+
+def source_columns(fleet):
+    """Source parquet columns a fleet reads (mapped trip columns plus filter columns)."""
+    columns = [c for c in fleet["columns"].values() if isinstance(c, str)]
+    columns += [c for c in fleet["filter"] if c not in columns]
+    return columns
@@ -0,0 +1,363 @@
+import duckdb
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cache import ParquetCache
+from fleets import TRIP_COLUMNS, fleet_file_name, source_columns
+from manifest import LOAD, file_fingerprint, forget_partitions, get_partitions, month_bounds, record_partition
+from ranged import read_month
+from resources import resource_profile
+from storage import create_trip_table, raw_column_sql
+
+# Shared month-file ingestion engine used by load.py.
+# The fleet specs (fleets.yml) only describe WHAT to load (file names, table,
+# column mapping, months); this module decides HOW: files are fetched
+# concurrently by a bounded worker pool, requests are spaced out by a rate
+# limiter, memory held between download and insert is capped, and every
+# finished month is recorded in the partition manifest (see manifest.py) with
+# the fingerprint of its source file. A crashed run resumes where it stopped,
+# and a rerun only reloads months whose source file is new or changed.
+logger = logging.getLogger(__name__)
+
+# Where the monthly parquet files live. Can be overridden with a local directory
+# (e.g. one written by synthetic.py) or a local HTTP stand-in (e.g.
+# 'http://localhost:8000'); tests/test_ingest.py runs against both.
+# Remote files are read with range requests (see ranged.py) or through the local
+# parquet cache (see cache.py).
+TRIP_DATA_SOURCE = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+
+# Default concurrency and politeness settings (replace the old fixed 5 second sleep)
+MAX_WORKERS = 4
+REQUESTS_PER_SECOND = 1.0
+
+# How remote month files are read:
+#   "ranges" - footer first, then byte ranges of only the needed columns and row groups (see ranged.py)
+#   "cache"  - download whole files into the local parquet cache (see cache.py)
+# Both skip a month with no network I/O when its file was checked recently and
+# was unchanged: the cache keeps the files' hashes, and the footer fingerprints
+# the range reader read.
+# The two fingerprint files differently, so switching readers reloads every month once.
+READERS = ("ranges", "cache")
+DEFAULT_READER = "ranges"
+
+
+class RateLimiter:
+    """
+    Space out request starts so that at most `rate` requests begin per second.
+
+    A rate of None or 0 disables limiting. Safe to share between worker threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def is_remote(source):
+    """True when the source is an HTTP(S) location rather than a local directory."""
+    return source.startswith("http://") or source.startswith("https://")
+
+
+class ByteBudget:
+    """
+    Bound the bytes of fetched-but-not-yet-inserted month data held in memory.
+
+    Workers reserve a month's estimated size before reading it and the inserting
+    thread releases it afterwards. A reservation larger than the whole budget is
+    granted when nothing else is held, so one huge month can't stall the load.
+    Loads running at the same time share one budget through share().
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def reserve(self, nbytes, share=None):
+        with self.condition:
+            while (self.used and self.used + nbytes > self.max_bytes
+                   and not self.closed and not (share and share.closed)):
+                self.condition.wait()
+            if self.closed or (share and share.closed):
+                raise RuntimeError("load cancelled")
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    def close(self):
+        """Fail every waiting and future reservation (the load is being abandoned)."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def share(self):
+        """A view of this budget for one load, which can be closed without affecting the others."""
+        return BudgetShare(self)
+
+
+class BudgetShare:
+    """One load's use of a shared ByteBudget; close() only cancels this load's reservations."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.closed = False
+
+    def reserve(self, nbytes):
+        self.budget.reserve(nbytes, self)
+
+    def release(self, nbytes):
+        self.budget.release(nbytes)
+
+    def close(self):
+        with self.budget.condition:
+            self.closed = True
+            self.budget.condition.notify_all()
+
+
+_download_budget = None
+_download_budget_lock = threading.Lock()
+
+
+def download_budget():
+    """
+    The process-wide ByteBudget for range-read month data, sized from the
+    resource profile's buffer share (see resources.py). Every load in the
+    process draws from it, so fleets loading in parallel share one cap.
+    """
+    global _download_budget
+    with _download_budget_lock:
+        if _download_budget is None:
+            _download_budget = ByteBudget(resource_profile()["buffer_bytes"])
+        return _download_budget
+
+
+def fetch_month(source, name, limiter, cache):
+    """
+    Make one month's parquet file `name` available on local disk and return its path.
+
+    Local directories are read in place. Remote files go through `cache`, which
+    only touches the network when the file is missing or stale and changed.
+    """
+    if not is_remote(source):
+        path = os.path.join(source, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        return path
+    return cache.get(f"{source.rstrip('/')}/{name}", limiter)
+
+
+def reset_table(con, table, taxi_type):
+    """Drop `table` and forget its loaded partitions so the next ingest starts from scratch."""
+    con.execute(f"DROP TABLE IF EXISTS {table}")
+    forget_partitions(con, LOAD, taxi_type)
+    logger.info(f"Reset {table} and its partition manifest entries")
+
+
+def sql_value(value):
+    return str(value) if isinstance(value, (int, float)) else "'" + str(value).replace("'", "''") + "'"
+
+
+def select_trips_sql(relation, fleet, year, month):
+    """
+    SELECT statement that maps one month of a fleet onto our four-column trip schema.
+
+    `relation` is what to read from: a read_parquet() call or a registered view.
+    The fleet's column mapping (see fleets.yml) names the source column behind
+    each trip column, or a constant; values are cast to the raw table's types
+    (see storage.py). Only trips picked up in the file's own month
+    and dropped off within the same year are kept, so every row belongs to
+    exactly one (year, month) partition and a month can be replaced on its own.
+    """
+    columns = fleet["columns"]
+    select = ",\n               ".join(
+        f"{raw_column_sql(c, columns[c] if isinstance(columns[c], str) else sql_value(columns[c]))} AS {c}"
+        for c in TRIP_COLUMNS
+    )
+    pickup, dropoff = columns["pick_up_datetime"], columns["drop_off_dt"]
+    start, end = month_bounds(year, month)
+    filters = "".join(f"\n          AND {column} = {sql_value(value)}" for column, value in fleet["filter"].items())
+    return f"""
+        SELECT {select}
+        FROM {relation}
+        WHERE {pickup} >= '{start}' AND {pickup} < '{end}'
+          AND {dropoff} >= '{year}-01-01' AND {dropoff} < '{year + 1}-01-01'{filters}
+    """
+
+
+def insert_month(con, fleet, year, month, data, fingerprint):
+    """
+    Replace one month partition of the fleet's table with the rows of a month.
+
+    `data` is the path of a local month file or an Arrow table read by ranged.py.
+    The delete, insert and manifest update share a transaction, so a partition is
+    either fully loaded and recorded or left exactly as it was. Returns the
+    number of rows inserted.
+    """
+    table, taxi_type = fleet["table"], fleet["name"]
+    if isinstance(data, str):
+        relation = f"read_parquet('{data}')"
+    else:
+        relation = f"month_rows_{taxi_type}"
+        con.register(relation, data)
+
+    create_trip_table(con, table)
+
+    start, end = month_bounds(year, month)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM {table} WHERE pick_up_datetime >= '{start}' AND pick_up_datetime < '{end}'")
+        # Sorted by pickup time so the month's row groups have tight zonemaps
+        rows = con.execute(f"""
+            INSERT INTO {table}
+            {select_trips_sql(relation, fleet, year, month)}
+            ORDER BY pick_up_datetime
+        """).fetchone()[0]
+        record_partition(con, LOAD, taxi_type, year, month, fingerprint, rows)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        if not isinstance(data, str):
+            con.unregister(relation)
+    logger.info(f"Inserted {rows} rows into {table} for {year}-{month:02d}")
+    return rows
+
+
+def fetch_and_fingerprint(source, fleet, year, month, limiter, cache, reader, known_fingerprint, budget):
+    """
+    Worker task: fetch one month and fingerprint it; returns (data, fingerprint, report).
+
+    `data` is a local path or an Arrow table (None when the range reader found the
+    file unchanged from `known_fingerprint`). `report` is the range reader's byte
+    and row-group counts (including the bytes reserved from `budget`), or None
+    for whole-file reads.
+    """
+    name = fleet_file_name(fleet, year, month)
+    if reader == "ranges" and is_remote(source):
+        url = f"{source.rstrip('/')}/{name}"
+        footer = cache.footer(url)
+        if footer and footer[0] == known_fingerprint:
+            # Read recently and loaded since: no request at all
+            report = {"file_bytes": footer[1], "bytes_fetched": 0, "requests": 0, "row_groups": None, "reserved": 0}
+            return None, known_fingerprint, report
+        limiter.wait()
+        columns = fleet["columns"]
+        data, fingerprint, report = read_month(url, source_columns(fleet), columns["pick_up_datetime"],
+                                               columns["drop_off_dt"], year, month, known_fingerprint, budget)
+        cache.record_footer(url, fingerprint, report["file_bytes"])
+        return data, fingerprint, report
+    path = fetch_month(source, name, limiter, cache)
+    return path, file_fingerprint(path), None
+
+
+def ingest_months(con, fleet, year, months,
+                  source=TRIP_DATA_SOURCE, max_workers=MAX_WORKERS,
+                  rate=REQUESTS_PER_SECOND, cache=None, reader=DEFAULT_READER,
+                  budget=None):
+    """
+    Load the given months of one fleet (see fleets.yml) into its table, only touching months that changed.
+
+    Workflow:
+    1. Fetch the month files concurrently (bounded pool + rate limiter) and
+       fingerprint each one.
+    2. Skip every month whose fingerprint matches the partition manifest.
+    3. Replace the remaining months one at a time (see insert_month).
+
+    Remote files are read with byte-range requests for only the needed columns
+    and row groups (`reader="ranges"`), or whole (`reader="cache"`), through
+    `cache` (a ParquetCache created on demand), which keeps the files' footer
+    fingerprints or contents. A rerun on unchanged data does not download
+    anything again, and makes no request at all for files checked within the
+    cache's revalidation period (an older one costs one footer request).
+
+    DuckDB allows a single writer, so only the downloads run in parallel; the
+    inserts are applied on `con` from this thread as files complete. Range-read
+    months waiting to be inserted are reserved (by their size estimated from the
+    footer) from `budget`, a ByteBudget shared with every other load running at
+    the same time (by default download_budget()), so large files such as FHVHV
+    stay bounded.
+    Returns the number of rows inserted by this call.
+    """
+    table, taxi_type = fleet["table"], fleet["name"]
+    loaded = get_partitions(con, LOAD, taxi_type)
+    budget = (budget or download_budget()).share()
+    limiter = RateLimiter(rate)
+    if cache is None and is_remote(source):
+        cache = ParquetCache()
+    inserted = 0
+    unchanged = 0
+    # Range-reader totals: bytes fetched vs. full file sizes, row groups read vs. present
+    fetched = file_bytes = groups = groups_read = 0
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {}
+    consumed = set()
+    try:
+        futures = {
+            pool.submit(fetch_and_fingerprint, source, fleet, year, m, limiter, cache,
+                        reader, loaded.get((taxi_type, year, m)), budget): m
+            for m in months
+        }
+        for future in as_completed(futures):
+            consumed.add(future)
+            m = futures[future]
+            data, fingerprint, report = future.result()
+            if report:
+                fetched += report["bytes_fetched"]
+                file_bytes += report["file_bytes"]
+                if report["row_groups"] is not None:
+                    groups += report["row_groups"]
+                    groups_read += report["row_groups_read"]
+                    logger.info(f"{taxi_type} {year}-{m:02d}: fetched {report['bytes_fetched']:,} of "
+                                f"{report['file_bytes']:,} bytes in {report['requests']} range requests, "
+                                f"read {report['row_groups_read']} of {report['row_groups']} row groups")
+            try:
+                if loaded.get((taxi_type, year, m)) == fingerprint:
+                    unchanged += 1
+                    continue
+                inserted += insert_month(con, fleet, year, m, data, fingerprint)
+            finally:
+                if report:
+                    budget.release(report["reserved"])
+            logger.info(f"Successfully loaded {taxi_type} {year}-{m:02d}")
+            print(f"Loaded {fleet_file_name(fleet, year, m)}")
+    finally:
+        # On failure, don't keep downloading months we are not going to insert
+        # (other loads sharing the budget carry on)
+        budget.close()
+        pool.shutdown(wait=True, cancel_futures=True)
+        # Months fetched but never inserted still hold their reservation in the
+        # shared budget; return it, or later loads in this process could stall
+        for future in futures:
+            if future not in consumed and not future.cancelled() and future.exception() is None:
+                report = future.result()[2]
+                if report:
+                    budget.release(report["reserved"])
+
+    if unchanged:
+        logger.info(f"{table}: {unchanged} month(s) unchanged since the last load, skipped")
+    if file_bytes:
+        summary = f"{table}: fetched {fetched:,} of {file_bytes:,} bytes ({fetched / file_bytes:.0%})"
+        if groups:
+            summary += f", skipped {groups - groups_read} of {groups} row groups"
+        logger.info(summary)
+        print(summary)
+    return inserted
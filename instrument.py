@@ -0,0 +1,191 @@
+import duckdb
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from resources import check_peaks
+
+# Shared instrumentation for the pipeline stages.
+# instrument(con, stage) wraps a DuckDB connection so that every execute() is
+# timed and profiled by DuckDB itself (rows scanned and produced, bytes read,
+# peak buffer memory, spill size). Records are buffered and written by flush()
+# to the run_metrics table in a separate run_metrics.duckdb, so read-only stages
+# (analysis) can be measured too and metrics never contend for the emissions.duckdb
+# write lock. flush() also checks the stage's peak buffer memory and RSS against
+# the resource profile (see resources.py). Slow queries can optionally keep their full operator profile (the
+# same tree EXPLAIN ANALYZE prints) as JSON under profiles/.
+logger = logging.getLogger(__name__)
+
+METRICS_DB = "run_metrics.duckdb"
+
+# Stages flushing at the same time (pipeline.py runs several in threads) would
+# otherwise each attach run_metrics.duckdb and collide; the file is still only
+# held open while writing, so other processes can record their metrics too.
+_metrics_lock = threading.Lock()
+METRICS_TABLE = "run_metrics"
+PROFILE_DIR = "profiles"
+
+# Queries slower than this (seconds) get their profile saved when profiling is on
+SLOW_QUERY_SECONDS = 5.0
+
+
+def new_run_id():
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+# One id per pipeline run. Stages of one process (pipeline.py) share it; a run
+# split over processes (benchmark.py's per-stage children) passes it to each of
+# them in the PIPELINE_RUN_ID environment variable.
+RUN_ID = os.environ.get("PIPELINE_RUN_ID") or new_run_id()
+
+# Top-level operators whose row count lives in their input, not their result
+DML_OPERATORS = {"INSERT", "CREATE_TABLE_AS", "DELETE", "UPDATE"}
+
+
+def ensure_metrics_table(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {METRICS_TABLE} (
+            run_id VARCHAR,
+            stage VARCHAR,
+            query_no INTEGER,
+            started_at TIMESTAMP,
+            duration_s DOUBLE,
+            rows_in BIGINT,
+            rows_out BIGINT,
+            bytes_read BIGINT,
+            peak_buffer_bytes BIGINT,
+            spill_bytes BIGINT,
+            peak_rss_bytes BIGINT,
+            profile_path VARCHAR,
+            query VARCHAR
+        )
+    """)
+
+
+def profile_rows_out(profile):
+    """Rows a statement produced: its result rows, or the rows fed into an INSERT/CREATE/DELETE."""
+    top = profile.get("children") or []
+    if top and top[0].get("operator_type") in DML_OPERATORS:
+        return sum(child.get("operator_cardinality", 0) for child in top[0].get("children", []))
+    return profile.get("rows_returned")
+
+
+class InstrumentedConnection:
+    """
+    DuckDB connection wrapper that records one metrics row per execute().
+
+    Everything other than execute() is passed through to the wrapped
+    connection, so it can be handed to any code expecting a connection.
+    """
+
+    def __init__(self, con, stage, profile_slow=False, slow_seconds=None):
+        self.con = con
+        self.stage = stage
+        self.profile_slow = profile_slow
+        self.slow_seconds = SLOW_QUERY_SECONDS if slow_seconds is None else slow_seconds
+        self.records = []
+        self.pending = None
+        # Older DuckDB builds can't hand profiles back to Python; then we only time
+        self.profiling = hasattr(con, "get_profiling_information")
+        if self.profiling:
+            con.execute("PRAGMA enable_profiling = 'no_output'")
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def execute(self, sql, params=None):
+        # DuckDB only finishes a SELECT when its result is fetched, so a statement is
+        # recorded when the next one starts (or at flush), once its profile is complete.
+        self._finish_pending()
+        started_at = datetime.now()
+        start = time.perf_counter()
+        result = self.con.execute(sql, params) if params is not None else self.con.execute(sql)
+        self.pending = (sql, started_at, start)
+        return result
+
+    def _finish_pending(self):
+        if self.pending:
+            sql, started_at, start = self.pending
+            self.pending = None
+            self._record(sql, started_at, time.perf_counter() - start)
+
+    def _profile(self, sql):
+        """Profile of the statement just run, or {} if DuckDB didn't profile it (e.g. SET)."""
+        if not self.profiling:
+            return {}
+        try:
+            profile = json.loads(self.con.get_profiling_information(format="json"))
+        except (duckdb.Error, ValueError):
+            return {}
+        # Statements that aren't profiled leave the previous query's profile behind
+        if profile.get("query_name", "").strip() != sql.strip():
+            return {}
+        return profile
+
+    def _record(self, sql, started_at, wall_seconds):
+        profile = self._profile(sql)
+        # DuckDB's own latency excludes the caller's work between execute and fetch
+        duration = profile.get("latency", wall_seconds)
+        profile_path = None
+        if profile and self.profile_slow and duration >= self.slow_seconds:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_path = os.path.join(PROFILE_DIR, f"{RUN_ID}-{self.stage}-{len(self.records) + 1}.json")
+            with open(profile_path, "w") as f:
+                json.dump(profile, f, indent=1)
+            logger.info(f"Slow query ({duration:.1f}s) profile saved to {profile_path}")
+
+        self.records.append([
+            RUN_ID, self.stage, len(self.records) + 1, started_at, duration,
+            profile.get("cumulative_rows_scanned"), profile_rows_out(profile) if profile else None,
+            profile.get("total_bytes_read"), profile.get("system_peak_buffer_memory"),
+            profile.get("system_peak_temp_dir_size"),
+            # ru_maxrss is in kilobytes on Linux
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            profile_path, " ".join(sql.split())[:2000],
+        ])
+
+    def flush(self):
+        """Append the buffered records to run_metrics.duckdb and log a one-line stage summary."""
+        self._finish_pending()
+        if not self.records:
+            return
+        total = sum(r[4] for r in self.records)
+        logger.info(f"{self.stage}: {len(self.records)} queries in {total:.2f}s (run {RUN_ID})")
+        # DuckDB reports no buffer memory for statements it doesn't profile (SET, older builds)
+        buffers = [r[8] for r in self.records if r[8] is not None]
+        check_peaks(self.stage, max(buffers) if buffers else None, max(r[10] for r in self.records))
+        try:
+            with _metrics_lock:
+                metrics = duckdb.connect(METRICS_DB)
+                try:
+                    ensure_metrics_table(metrics)
+                    metrics.executemany(
+                        f"INSERT INTO {METRICS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.records
+                    )
+                finally:
+                    metrics.close()
+        except duckdb.Error as e:
+            # Metrics must never fail the stage they measure
+            logger.error(f"Could not write run metrics: {e}")
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.con.close()
+
+
+def instrument(con, stage, profile_slow=None):
+    """
+    Wrap `con` so every query of `stage` is measured.
+
+    Slow-query profiles are saved when `profile_slow` is True or the
+    PIPELINE_PROFILE environment variable is set.
+    """
+    if profile_slow is None:
+        profile_slow = bool(os.environ.get("PIPELINE_PROFILE"))
+    return InstrumentedConnection(con, stage, profile_slow)
@@ -0,0 +1,121 @@
+import argparse
+import logging
+
+from fleets import FLEETS_FILE, select_fleets
+from ingest import (DEFAULT_READER, MAX_WORKERS, READERS, REQUESTS_PER_SECOND, TRIP_DATA_SOURCE, ingest_months,
+                    reset_table)
+from instrument import instrument
+from resources import connect_duckdb
+
+# Generic trip-data loader driven by the fleet specs in fleets.yml.
+# Every fleet (yellow, green, uber, lyft, ...) is loaded the same way: its month
+# files are read through the shared ingestion engine (ingest.py) for each year
+# and month in its spec, with its columns mapped onto our four trip columns.
+# load_yellow.py and load_green.py are thin wrappers kept for the old commands.
+logger = logging.getLogger(__name__)
+
+EMISSIONS_CSV = "data/vehicle_emissions.csv"
+
+
+def load_fleet(con, fleet, source=TRIP_DATA_SOURCE, workers=MAX_WORKERS,
+               rate=REQUESTS_PER_SECOND, fresh=False, reader=DEFAULT_READER, years=None, budget=None):
+    """
+    Load every month of one fleet into its table on an open connection; returns rows inserted.
+
+    `budget` caps the downloaded data held in memory (see ingest.download_budget).
+    """
+    # Start over only when asked to; otherwise only new or changed months are loaded
+    if fresh:
+        reset_table(con, fleet["table"], fleet["name"])
+
+    inserted = 0
+    for year in years or fleet["years"]:
+        inserted += ingest_months(con, fleet, year, fleet["months"], source=source,
+                                  max_workers=workers, rate=rate, reader=reader, budget=budget)
+    return inserted
+
+
+def load_vehicle_emissions(con, fleets=None):
+    """
+    Drop and recreate `vehicle_emissions` so it matches the latest CSV each run.
+
+    Warns about any of `fleets` whose vehicle_type has no row in the CSV (its
+    trips would get no CO2 value).
+    """
+    con.execute("DROP TABLE IF EXISTS vehicle_emissions")
+    con.execute(f"""
+        CREATE TABLE vehicle_emissions AS
+        SELECT * FROM read_csv_auto('{EMISSIONS_CSV}')
+    """)
+    logger.info("Created vehicle_emissions table from CSV")
+
+    known = {row[0] for row in con.execute("SELECT vehicle_type FROM vehicle_emissions").fetchall()}
+    for fleet in (fleets or {}).values():
+        if fleet["vehicle_type"] not in known:
+            logger.warning(f"Fleet {fleet['name']}: vehicle_type '{fleet['vehicle_type']}' is not in {EMISSIONS_CSV}")
+            print(f"Warning: fleet {fleet['name']} maps to unknown vehicle_type '{fleet['vehicle_type']}'")
+
+
+def load_trip_data(names=None, years=None, source=TRIP_DATA_SOURCE, workers=MAX_WORKERS,
+                   rate=REQUESTS_PER_SECOND, fresh=False, reader=DEFAULT_READER, emissions=True):
+    """
+    Load trip data for the given fleets (default: the enabled ones in fleets.yml).
+
+    Workflow:
+    1. Connect to DuckDB database (emissions.duckdb).
+    2. Load each fleet's months into its raw table (fetched in parallel;
+       only new or changed months are loaded unless `fresh`).
+    3. Drop & recreate the `vehicle_emissions` table from the local CSV file.
+    4. Log row counts for every fleet loaded.
+    """
+    con = None
+    try:
+        fleets = select_fleets(names)
+        con = instrument(connect_duckdb('emissions.duckdb', read_only=False), "load")
+        logger.info(f"Connected to DuckDB to load {', '.join(fleets)}")
+
+        for name, fleet in fleets.items():
+            load_fleet(con, fleet, source, workers, rate, fresh, reader, years)
+            count = con.execute(f"SELECT COUNT(*) FROM {fleet['table']}").fetchone()[0]
+            logger.info(f"{name} rows loaded: {count}")
+            print(f"{name} rows loaded: {count}")
+
+        if emissions:
+            load_vehicle_emissions(con, fleets)
+            e_count = con.execute("SELECT COUNT(*) FROM vehicle_emissions").fetchone()[0]
+            logger.info(f"Vehicle emissions rows loaded: {e_count}")
+            print(f"Vehicle emissions rows loaded: {e_count}")
+
+    except Exception as e:
+        # Log and print any errors for troubleshooting
+        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
+    finally:
+        # Always close the connection to avoid DB locks
+        if con:
+            con.close()
+            logger.info("Closed DuckDB connection")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Load NYC trip data for the fleets in {FLEETS_FILE}")
+    parser.add_argument("--fleet", nargs="+", help="Fleets to load (default: every enabled fleet)")
+    parser.add_argument("--years", nargs="+", type=int, help="Years to load (default: each fleet's years)")
+    parser.add_argument("--source", default=TRIP_DATA_SOURCE, help="Base URL or local directory holding the monthly parquet files")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Number of month files to download at the same time")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Maximum downloads started per second (0 = unlimited)")
+    parser.add_argument("--fresh", action="store_true", help="Drop the fleets' tables and reload every month")
+    parser.add_argument("--reader", choices=READERS, default=DEFAULT_READER,
+                        help="Read remote files with byte-range requests or download them whole into the cache")
+    parser.add_argument("--skip-emissions", action="store_true", help="Don't reload vehicle_emissions from the CSV")
+    args = parser.parse_args()
+
+    # Logging is configured here rather than at import time, because the
+    # load_yellow.py / load_green.py wrappers import this module and keep their own log files.
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='load.log'
+    )
+    load_trip_data(args.fleet, args.years, args.source, args.workers, args.rate, args.fresh, args.reader,
+                   not args.skip_emissions)
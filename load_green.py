@@ -1,6 +1,11 @@
-import duckdb
+import argparse
 import logging
-import time
+
+from fleets import select_fleets
+from ingest import DEFAULT_READER, MAX_WORKERS, READERS, REQUESTS_PER_SECOND, TRIP_DATA_SOURCE
+from instrument import instrument
+from load import load_fleet
+from resources import connect_duckdb
 
 # Configure logging to write info and error messages to a log file (load_green_2024.log)
 logging.basicConfig(
@@ -10,64 +15,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Target year and months to load
-year1 = [2024]   # Only process data for 2024
-month1 = range(1, 13)  # All 12 months
+# Green is one fleet of the generic loader (load.py); its files, columns
+# (lpep_pickup_datetime → pick_up_datetime, lpep_dropoff_datetime → drop_off_dt,
+# passenger_count, trip_distance) and months are declared in fleets.yml.
+
+def load_green_trips(con, source=TRIP_DATA_SOURCE, workers=MAX_WORKERS,
+                     rate=REQUESTS_PER_SECOND, fresh=False, reader=DEFAULT_READER):
+    """Load the Green Taxi months into `green_taxi_data` on an open connection; returns rows inserted."""
+    return load_fleet(con, select_fleets(["green"])["green"], source, workers, rate, fresh, reader)
 
-def load_green_2024():
+
+def load_green_2024(source=TRIP_DATA_SOURCE, workers=MAX_WORKERS,
+                    rate=REQUESTS_PER_SECOND, fresh=False, reader=DEFAULT_READER):
     con = None
     try:
         # Connect to the DuckDB database file (creates file if it doesn’t exist)
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        con = instrument(connect_duckdb('emissions.duckdb', read_only=False), "load_green")
         logger.info("Connected to DuckDB for Green Taxi 2024 data")
 
-        # Drop the table if it already exists, ensuring a clean load
-        con.execute("DROP TABLE IF EXISTS green_taxi_data")
-
-        # Define the first file (January 2024) to set up the schema
-        first_file = f"https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_2024-01.parquet"
-
-        # Create an empty table with the required schema
-        # Only keep the relevant columns we need for emissions analysis:
-        #   - lpep_pickup_datetime → pick_up_datetime
-        #   - lpep_dropoff_datetime → drop_off_dt
-        #   - passenger_count
-        #   - trip_distance
-        #
-        # LIMIT 0 ensures no rows are actually inserted here — just the schema.
-        con.execute(f"""
-            CREATE TABLE green_taxi_data AS
-            SELECT lpep_pickup_datetime AS pick_up_datetime,
-                   lpep_dropoff_datetime AS drop_off_dt,
-                   passenger_count,
-                   trip_distance
-            FROM read_parquet('{first_file}')
-            LIMIT 0
-        """)
-        logger.info("Created empty green_taxi_data table with 2024 schema")
-
-        # Loop through each month in 2024 and load the data
-        for m in month1:
-            url = f"https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_2024-{m:02d}.parquet"
-            logger.info(f"Loading file: {url}")
-            print(url)
-
-            # Insert rows from the monthly parquet file into green_taxi_data
-            # Apply date filters so only trips strictly within 2024 are inserted
-            con.execute(f"""
-                INSERT INTO green_taxi_data
-                SELECT lpep_pickup_datetime AS pick_up_datetime,
-                       lpep_dropoff_datetime AS drop_off_dt,
-                       passenger_count,
-                       trip_distance
-                FROM read_parquet('{url}')
-                WHERE lpep_pickup_datetime BETWEEN '2024-01-01' AND '2024-12-31'
-                  AND lpep_dropoff_datetime BETWEEN '2024-01-01' AND '2024-12-31';
-            """)
-            
-            # Sleep 5 seconds between requests to avoid overwhelming the server
-            time.sleep(5)
-            logger.info(f"Successfully loaded monthly file: {url}")
+        load_green_trips(con, source, workers, rate, fresh, reader)
 
         # Verify load by counting the total number of rows inserted
         g_count = con.execute("SELECT COUNT(*) FROM green_taxi_data").fetchone()[0]
@@ -85,4 +51,12 @@ def load_green_2024():
             logger.info("Closed DuckDB connection")
 
 if __name__ == "__main__":
-    load_green_2024()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load 2024 Green Taxi trips into DuckDB")
+    parser.add_argument("--source", default=TRIP_DATA_SOURCE, help="Base URL or local directory holding the monthly parquet files")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Number of month files to download at the same time")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Maximum downloads started per second (0 = unlimited)")
+    parser.add_argument("--fresh", action="store_true", help="Drop green_taxi_data and reload every month")
+    parser.add_argument("--reader", choices=READERS, default=DEFAULT_READER,
+                        help="Read remote files with byte-range requests or download them whole into the cache")
+    args = parser.parse_args()
+    load_green_2024(args.source, args.workers, args.rate, args.fresh, args.reader)
@@ -1,6 +1,11 @@
-import duckdb
+import argparse
 import logging
-import time
+
+from fleets import select_fleets
+from ingest import DEFAULT_READER, MAX_WORKERS, READERS, REQUESTS_PER_SECOND, TRIP_DATA_SOURCE
+from instrument import instrument
+from load import load_fleet, load_vehicle_emissions
+from resources import connect_duckdb
 
 # Configure logging to capture info and error messages into a log file (load_yellow_2024.log)
 logging.basicConfig(
@@ -10,82 +15,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Target year and months to process
-year1 = [2024]   # Only process data for 2024
-month1 = range(1, 13)  # All 12 months
+# Yellow is one fleet of the generic loader (load.py); its files, columns
+# (tpep_pickup_datetime → pick_up_datetime, tpep_dropoff_datetime → drop_off_dt,
+# passenger_count, trip_distance) and months are declared in fleets.yml.
+
+def load_yellow_trips(con, source=TRIP_DATA_SOURCE, workers=MAX_WORKERS,
+                      rate=REQUESTS_PER_SECOND, fresh=False, reader=DEFAULT_READER):
+    """Load the Yellow Taxi months into `yellow_taxi_data` on an open connection; returns rows inserted."""
+    return load_fleet(con, select_fleets(["yellow"])["yellow"], source, workers, rate, fresh, reader)
 
-def load_yellow_2024_and_csv():
+
+def load_yellow_2024_and_csv(source=TRIP_DATA_SOURCE, workers=MAX_WORKERS,
+                             rate=REQUESTS_PER_SECOND, fresh=False, reader=DEFAULT_READER):
     """
     Load 2024 Yellow Taxi trip data and a vehicle emissions CSV file into DuckDB.
 
     Workflow:
     1. Connect to DuckDB database (emissions.duckdb).
-    2. Drop & recreate the `yellow_taxi_data` table with the required schema.
-    3. Loop through all 12 monthly parquet files for 2024 and insert rows.
-    4. Drop & recreate the `vehicle_emissions` table from a local CSV file.
-    5. Log row counts for both datasets.
+    2. Load the yellow months listed in fleets.yml into `yellow_taxi_data`
+       (fetched in parallel; only new or changed months are loaded unless `fresh`).
+    3. Drop & recreate the `vehicle_emissions` table from a local CSV file.
+    4. Log row counts for both datasets.
     """
     con = None
     try:
         # Connect to DuckDB database (creates if it doesn’t exist).
         # Using the same file as other loaders for integration.
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
+        con = instrument(connect_duckdb('emissions.duckdb', read_only=False), "load_yellow")
         logger.info("Connected to DuckDB for Yellow Taxi + Vehicle Emissions (2024)")
 
-        # Create Yellow Taxi Table
-        # Drop any existing yellow_taxi_data table so we start fresh
-        con.execute("DROP TABLE IF EXISTS yellow_taxi_data")
-
-        # Define January 2024 parquet file to establish schema
-        first_file = f"https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_2024-01.parquet"
-
-        # Create table structure by selecting only the relevant columns:
-        #   - tpep_pickup_datetime → pick_up_datetime
-        #   - tpep_dropoff_datetime → drop_off_dt
-        #   - passenger_count
-        #   - trip_distance
-        # LIMIT 0 ensures no rows are inserted, just the schema definition.
-        con.execute(f"""
-            CREATE TABLE yellow_taxi_data AS
-            SELECT tpep_pickup_datetime AS pick_up_datetime,
-                   tpep_dropoff_datetime AS drop_off_dt,
-                   passenger_count,
-                   trip_distance
-            FROM read_parquet('{first_file}')
-            LIMIT 0
-        """)
-        logger.info("Created empty yellow_taxi_data table with 2024 schema")
-
-        # Load Yellow Taxi Monthly Data
-        for m in month1:
-            url = f"https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_2024-{m:02d}.parquet"
-            logger.info(f"Loading file: {url}")
-            print(url)
-
-            # Insert rows into yellow_taxi_data
-            # Apply filters so only trips fully within 2024 are included
-            con.execute(f"""
-                INSERT INTO yellow_taxi_data
-                SELECT tpep_pickup_datetime AS pick_up_datetime,
-                       tpep_dropoff_datetime AS drop_off_dt,
-                       passenger_count,
-                       trip_distance
-                FROM read_parquet('{url}')
-                WHERE tpep_pickup_datetime BETWEEN '2024-01-01' AND '2024-12-31'
-                  AND tpep_dropoff_datetime BETWEEN '2024-01-01' AND '2024-12-31';
-            """)
-            
-            # Sleep 5 seconds between file loads (server-friendly and avoids rate limiting)
-            time.sleep(5)
+        load_yellow_trips(con, source, workers, rate, fresh, reader)
 
         # Load Vehicle Emissions Reference Data
-        # Drop and recreate so it matches the latest CSV each run
-        con.execute("DROP TABLE IF EXISTS vehicle_emissions")
-        con.execute("""
-            CREATE TABLE vehicle_emissions AS
-            SELECT * FROM read_csv_auto('data/vehicle_emissions.csv')
-        """)
-        logger.info("Created vehicle_emissions table from CSV")
+        load_vehicle_emissions(con)
 
         #Row Counts for Validation
         y_count = con.execute("SELECT COUNT(*) FROM yellow_taxi_data").fetchone()[0]
@@ -107,5 +69,13 @@ def load_yellow_2024_and_csv():
             logger.info("Closed DuckDB connection")
 
 if __name__ == "__main__":
-    load_yellow_2024_and_csv()
+    parser = argparse.ArgumentParser(description="Load 2024 Yellow Taxi trips and vehicle emissions into DuckDB")
+    parser.add_argument("--source", default=TRIP_DATA_SOURCE, help="Base URL or local directory holding the monthly parquet files")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Number of month files to download at the same time")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Maximum downloads started per second (0 = unlimited)")
+    parser.add_argument("--fresh", action="store_true", help="Drop yellow_taxi_data and reload every month")
+    parser.add_argument("--reader", choices=READERS, default=DEFAULT_READER,
+                        help="Read remote files with byte-range requests or download them whole into the cache")
+    args = parser.parse_args()
+    load_yellow_2024_and_csv(args.source, args.workers, args.rate, args.fresh, args.reader)
 
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+
+# Partition manifest shared by the load, clean and transform stages.
+# Every stage records one row per (taxi_type, year, month) partition it has
+# produced, together with the fingerprint of the input it was built from and the
+# number of rows it wrote. A stage only (re)processes partitions whose upstream
+# fingerprint differs from the one it recorded last time, so adding December
+# only touches December and a no-change rerun does almost nothing.
+logger = logging.getLogger(__name__)
+
+MANIFEST_TABLE = "partition_manifest"
+
+# Stage names in pipeline order
+LOAD = "load"
+CLEAN = "clean"
+TRANSFORM = "transform"
+EXPORT = "export"
+
+
+def ensure_manifest(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            stage VARCHAR,
+            taxi_type VARCHAR,
+            year INTEGER,
+            month INTEGER,
+            fingerprint VARCHAR,
+            row_count BIGINT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (stage, taxi_type, year, month)
+        )
+    """)
+
+
+def get_partitions(con, stage, taxi_type=None):
+    """Return {(taxi_type, year, month): fingerprint} for everything `stage` has recorded."""
+    ensure_manifest(con)
+    sql = f"SELECT taxi_type, year, month, fingerprint FROM {MANIFEST_TABLE} WHERE stage = ?"
+    params = [stage]
+    if taxi_type:
+        sql += " AND taxi_type = ?"
+        params.append(taxi_type)
+    return {(t, y, m): fp for t, y, m, fp in con.execute(sql, params).fetchall()}
+
+
+def pending_partitions(con, stage, upstream_stage, taxi_type=None, salt=None):
+    """
+    Partitions `stage` still has to (re)build from `upstream_stage`.
+
+    Returns a sorted list of (taxi_type, year, month, fingerprint) for partitions
+    that are new upstream or whose upstream fingerprint changed. `salt` folds in
+    any other input the stage depends on (e.g. the emissions lookup), so changing
+    it makes every partition pending.
+    """
+    upstream = get_partitions(con, upstream_stage, taxi_type)
+    done = get_partitions(con, stage, taxi_type)
+    pending = []
+    for (t, y, m), fp in upstream.items():
+        expected = f"{fp}:{salt}" if salt else fp
+        if done.get((t, y, m)) != expected:
+            pending.append((t, y, m, expected))
+    return sorted(pending)
+
+
+def record_partition(con, stage, taxi_type, year, month, fingerprint, row_count):
+    """Insert or update the manifest row for one partition of `stage`."""
+    con.execute(
+        f"INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, now())",
+        [stage, taxi_type, year, month, fingerprint, row_count],
+    )
+
+
+def forget_partitions(con, stage, taxi_type):
+    """Drop every manifest row of `stage` for one taxi type (used for full reloads)."""
+    ensure_manifest(con)
+    con.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE stage = ? AND taxi_type = ?", [stage, taxi_type])
+
+
+def month_bounds(year, month):
+    """Return ('YYYY-MM-01', first day of the next month) as SQL-ready strings."""
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year}-{month:02d}-01", f"{next_year}-{next_month:02d}-01"
+
+
+def file_fingerprint(path):
+    """
+    Content fingerprint of a local file.
+
+    Files from the parquet cache are already named after their SHA-256, so their
+    name is reused; anything else is hashed.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+        return stem
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def table_fingerprint(con, table):
+    """Cheap checksum of a small reference table (e.g. vehicle_emissions)."""
+    return con.execute(
+        f"SELECT md5(string_agg(t::VARCHAR, '|' ORDER BY t::VARCHAR)) FROM {table} t"
+    ).fetchone()[0]
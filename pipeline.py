@@ -0,0 +1,282 @@
+import argparse
+import duckdb
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import matplotlib
+# Analysis runs on a worker thread and only saves its plot, so use the file-only backend
+matplotlib.use("Agg")
+
+from analysis import PLOT_PATH, run_analysis
+from clean import clean_taxi, configure
+from emission_models import DEFAULT_MODEL, EMISSIONS_MODELS, model_salt
+from export import export_pending
+from fleets import select_fleets
+from ingest import DEFAULT_READER, MAX_WORKERS, READERS, REQUESTS_PER_SECOND, TRIP_DATA_SOURCE, download_budget
+from instrument import instrument
+from load import load_fleet, load_vehicle_emissions
+from manifest import CLEAN, EXPORT, LOAD, MANIFEST_TABLE, TRANSFORM, pending_partitions, table_fingerprint
+from rollup import rollup_is_current
+from sample import sample_exists
+from snapshot import publish_snapshot, snapshot_is_stale
+from transform import transform_pending
+
+# Single entry point for the whole pipeline.
+# The stages are nodes of a dependency graph:
+#
+#   load_yellow ──> clean_yellow ──┐
+#   load_green  ──> clean_green  ──┼──> transform ──> export (--parquet)
+#   load_emissions ────────────────┘          ├─────> snapshot (--snapshot)
+#                                             └─────> analysis
+#
+# with one load/clean branch per fleet in fleets.yml (the enabled ones, or --fleet).
+# Nodes whose dependencies are done run at the same time on a thread pool, so the
+# fleet branches load and clean side by side. Every node gets its own
+# cursor on one long-lived connection to emissions.duckdb (DuckDB cursors share the
+# database and its buffer pool; each has its own transactions). A node is skipped
+# when its inputs haven't changed since it last ran, judged from the partition
+# manifest, unless --force is given.
+logger = logging.getLogger(__name__)
+
+DATABASE = "emissions.duckdb"
+
+# Nodes that may run at once (each load also downloads with its own worker pool)
+MAX_PARALLEL_STAGES = 3
+
+
+# ---- up-to-date checks: return True when the node has work to do ----
+
+def clean_is_stale(taxi_type):
+    return lambda con: bool(pending_partitions(con, CLEAN, LOAD, taxi_type))
+
+
+def transform_is_stale(con, model=DEFAULT_MODEL):
+    if not con.execute(f"SELECT COUNT(*) FROM {MANIFEST_TABLE} WHERE stage = ?", [TRANSFORM]).fetchone()[0]:
+        return True
+    try:
+        emissions_fp = table_fingerprint(con, "vehicle_emissions")
+    except duckdb.CatalogException:
+        return True
+    # Also stale when the analysis rollup (built alongside the trips) is missing or
+    # out of date, or the sample is missing
+    return (bool(pending_partitions(con, TRANSFORM, CLEAN, salt=model_salt(model, emissions_fp)))
+            or not rollup_is_current(con) or not sample_exists(con))
+
+
+def export_is_stale(con):
+    return bool(pending_partitions(con, EXPORT, TRANSFORM))
+
+
+def analysis_is_stale(con):
+    # The report is stale if a month was transformed after the plot was last saved
+    if not os.path.exists(PLOT_PATH):
+        return True
+    return bool(con.execute(
+        f"SELECT COALESCE(MAX(updated_at) > CAST(to_timestamp(?) AS TIMESTAMP), false) "
+        f"FROM {MANIFEST_TABLE} WHERE stage = ?",
+        [os.path.getmtime(PLOT_PATH), TRANSFORM],
+    ).fetchone()[0])
+
+
+def run_snapshot(con):
+    # Publishes one read-only snapshot for serve.py (see snapshot.py)
+    publish_snapshot(con)
+    return 1
+
+
+def always(con):
+    # Loads compare every month file's fingerprint to the manifest themselves
+    return True
+
+
+def build_graph(args):
+    """
+    The pipeline DAG as {name: (dependencies, run(con), is_stale(con))}.
+
+    run() returns how many rows or months it changed (None when it can't tell);
+    a non-zero result makes the node's dependents run even if they look current.
+    """
+    fleets = select_fleets(args.fleet)
+    # Loads run concurrently, so they draw on one download buffer budget
+    budget = download_budget()
+    graph = {
+        "load_emissions": ([], lambda con: load_vehicle_emissions(con, fleets), always),
+        "transform": (
+            [f"clean_{name}" for name in fleets] + ["load_emissions"],
+            lambda con: transform_pending(con, args.emissions_model),
+            lambda con: transform_is_stale(con, args.emissions_model),
+        ),
+        "analysis": (["transform"], run_analysis, analysis_is_stale),
+    }
+    for name, fleet in fleets.items():
+        graph[f"load_{name}"] = (
+            [], lambda con, f=fleet: load_fleet(con, f, args.source, args.workers, args.rate, args.fresh, args.reader,
+                                                 args.years, budget),
+            always,
+        )
+        graph[f"clean_{name}"] = ([f"load_{name}"], lambda con, n=name: clean_taxi(con, n), clean_is_stale(name))
+    if args.parquet:
+        graph["export"] = (["transform"], export_pending, export_is_stale)
+    if args.snapshot:
+        graph["snapshot"] = (["transform"], run_snapshot, snapshot_is_stale)
+    return graph
+
+
+def resolve(graph, names):
+    """Node names matching `names`; a stage prefix like 'clean' selects clean_yellow and clean_green."""
+    selected = set()
+    for name in names:
+        matches = {node for node in graph if node == name or node.startswith(name + "_")}
+        if not matches:
+            raise SystemExit(f"Unknown stage '{name}'. Stages: {', '.join(sorted(graph))}")
+        selected |= matches
+    return selected
+
+
+def closure(graph, start, upstream):
+    """`start` plus every node reachable from it (downstream, or upstream when `upstream`)."""
+    edges = {node: set() for node in graph}
+    for node, (deps, _, _) in graph.items():
+        for dep in deps:
+            if upstream:
+                edges[node].add(dep)
+            else:
+                edges[dep].add(node)
+    seen = set(start)
+    todo = list(start)
+    while todo:
+        for nxt in edges[todo.pop()]:
+            if nxt not in seen:
+                seen.add(nxt)
+                todo.append(nxt)
+    return seen
+
+
+def select_nodes(graph, start=None, stop=None):
+    """Nodes of a --from/--to partial run: downstream of `start` and upstream of `stop`."""
+    selected = set(graph)
+    if start:
+        selected &= closure(graph, resolve(graph, start), upstream=False)
+    if stop:
+        selected &= closure(graph, resolve(graph, stop), upstream=True)
+    return selected
+
+
+def run_node(con, name, run, is_stale, force):
+    """Run one node on its own cursor. Returns ('ran', changed, seconds) or ('skipped', 0, seconds)."""
+    start = time.perf_counter()
+    cursor = instrument(con.cursor(), name)
+    try:
+        if not force and not is_stale(cursor):
+            logger.info(f"{name}: inputs unchanged, skipped")
+            return "skipped", 0, time.perf_counter() - start
+        logger.info(f"{name}: started")
+        changed = run(cursor)
+        return "ran", changed, time.perf_counter() - start
+    finally:
+        cursor.close()
+
+
+def run_pipeline(graph, selected, force=False, parallel=MAX_PARALLEL_STAGES):
+    """
+    Run the selected nodes of `graph` in dependency order, independent ones concurrently.
+
+    Workflow:
+    1. Open one connection to emissions.duckdb and apply the resource profile (see resources.py).
+    2. Start every node whose selected dependencies are finished, up to `parallel` at once.
+    3. Skip a node when its inputs are unchanged (unless `force` or a dependency changed data).
+    4. When a node fails, skip everything downstream of it but finish the independent branches.
+    Returns {name: status}; status is 'ran', 'skipped', 'failed' or 'blocked'.
+    """
+    con = duckdb.connect(database=DATABASE, read_only=False)
+    logger.info(f"Connected to {DATABASE} for a pipeline run of: {', '.join(sorted(selected))}")
+    # Shared tables are created up front so concurrent nodes never race to create them
+    configure(con)
+
+    status = {}
+    changed = {}
+    running = {}
+    pool = ThreadPoolExecutor(max_workers=parallel)
+    try:
+        while len(status) < len(selected):
+            for name in sorted(selected):
+                if name in status or name in running:
+                    continue
+                deps = [d for d in graph[name][0] if d in selected]
+                if any(status.get(d) in ("failed", "blocked") for d in deps):
+                    status[name] = "blocked"
+                    logger.error(f"{name}: not run because an upstream stage failed")
+                    print(f"[{name}] not run (upstream failure)")
+                    continue
+                if all(d in status for d in deps):
+                    _, run, is_stale = graph[name]
+                    node_force = force or any(changed.get(d) for d in deps)
+                    running[name] = pool.submit(run_node, con, name, run, is_stale, node_force)
+                    print(f"[{name}] started")
+
+            if not running:
+                continue
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name in [n for n, f in running.items() if f in done]:
+                future = running.pop(name)
+                try:
+                    status[name], changed[name], seconds = future.result()
+                    print(f"[{name}] {status[name]} in {seconds:.1f}s")
+                    logger.info(f"{name}: {status[name]} in {seconds:.1f}s")
+                except Exception as e:
+                    status[name] = "failed"
+                    print(f"[{name}] failed: {e}")
+                    logger.error(f"{name}: failed: {e}")
+    finally:
+        pool.shutdown(wait=True)
+        con.close()
+        logger.info("DuckDB connection closed")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the taxi emissions pipeline as a dependency graph")
+    parser.add_argument("--from", dest="start", nargs="+", metavar="STAGE",
+                        help="Start at these stages (e.g. clean, transform, clean_green); upstream stages are not run")
+    parser.add_argument("--to", dest="stop", nargs="+", metavar="STAGE",
+                        help="Stop after these stages; downstream stages are not run")
+    parser.add_argument("--fleet", nargs="+", help="Fleets to run (default: every enabled fleet in fleets.yml)")
+    parser.add_argument("--years", nargs="+", type=int, help="Years to load (default: each fleet's years)")
+    parser.add_argument("--force", action="store_true", help="Run the selected stages even if their inputs are unchanged")
+    parser.add_argument("--parallel", type=int, default=MAX_PARALLEL_STAGES, help="Stages that may run at the same time")
+    parser.add_argument("--parquet", action="store_true", help="Also export changed partitions as hive-partitioned parquet")
+    parser.add_argument("--emissions-model", choices=list(EMISSIONS_MODELS), default=DEFAULT_MODEL,
+                        help="How transform computes CO2 per trip (see emission_models.py)")
+    parser.add_argument("--snapshot", action="store_true", help="Also publish a read-only snapshot of the analysis tables for serve.py")
+    parser.add_argument("--source", default=TRIP_DATA_SOURCE, help="Base URL or local directory holding the monthly parquet files")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Number of month files to download at the same time")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Maximum downloads started per second (0 = unlimited)")
+    parser.add_argument("--fresh", action="store_true", help="Drop the trip tables and reload every month")
+    parser.add_argument("--reader", choices=READERS, default=DEFAULT_READER,
+                        help="Read remote files with byte-range requests or download them whole into the cache")
+    parser.add_argument("--list", action="store_true", help="Print the stages and their dependencies, then exit")
+    args = parser.parse_args()
+
+    # The stage modules set up their own log files when imported; the pipeline
+    # run gets one log of its own instead.
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s',
+        filename='pipeline.log',
+        force=True
+    )
+
+    graph = build_graph(args)
+    if args.list:
+        for name, (deps, _, _) in graph.items():
+            print(f"{name}: {', '.join(deps) or '-'}")
+        sys.exit(0)
+
+    selected = select_nodes(graph, args.start, args.stop)
+    if not selected:
+        raise SystemExit("No stages are both downstream of --from and upstream of --to")
+    status = run_pipeline(graph, selected, args.force, args.parallel)
+    sys.exit(0 if all(s in ("ran", "skipped") for s in status.values()) else 1)
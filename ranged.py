@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import threading
+import urllib.request
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from manifest import month_bounds
+
+# Byte-range reader for remote parquet month files.
+# Instead of downloading a whole TLC file (50-60 MB for a yellow month), the
+# reader fetches the file footer first (one request for the last 64 KB, which also
+# reveals the file size), uses its schema and per-row-group min/max statistics to
+# drop row groups whose pickup/drop-off times can't fall in the target month, and
+# then requests only the column chunks of the four columns we keep. The server has
+# to support HTTP Range requests (CloudFront and S3 do).
+logger = logging.getLogger(__name__)
+
+# Bytes requested from the end of the file; TLC footers fit in this easily
+FOOTER_READ_SIZE = 64 * 1024
+
+
+def http_range(url, start=None, end=None, suffix=None):
+    """
+    GET a byte range of `url`: [start, end) or, with `suffix`, the last `suffix` bytes.
+
+    Returns (data, total_size). Raises if the server ignores the Range header.
+    """
+    header = f"bytes=-{suffix}" if suffix else f"bytes={start}-{end - 1}"
+    request = urllib.request.Request(url, headers={"Range": header})
+    with urllib.request.urlopen(request) as response:
+        if response.status != 206:
+            raise IOError(f"{url} does not support range requests (HTTP {response.status})")
+        # Content-Range: bytes <first>-<last>/<total>
+        total = int(response.headers["Content-Range"].rsplit("/", 1)[1])
+        return response.read(), total
+
+
+class RangeFile:
+    """
+    Read-only, seekable file object over a remote file, fetched with HTTP Range requests.
+
+    Reads that fall inside the prefetched footer are served from memory;
+    everything else is one range request per read. `bytes_fetched` and
+    `requests` count the network traffic.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.position = 0
+        self.lock = threading.Lock()
+        tail, self.size = http_range(url, suffix=FOOTER_READ_SIZE)
+        self.requests = 1
+        self.bytes_fetched = len(tail)
+        # The footer is <metadata><4-byte little-endian length>PAR1
+        if tail[-4:] != b"PAR1":
+            raise IOError(f"{url} is not a parquet file")
+        footer_len = int.from_bytes(tail[-8:-4], "little")
+        if footer_len + 8 > len(tail):
+            tail = self._fetch(self.size - footer_len - 8, self.size)
+        self.tail = tail
+        self.tail_start = self.size - len(tail)
+        self.footer = tail[-footer_len - 8:]
+
+    def _fetch(self, start, end):
+        data, _ = http_range(self.url, start, end)
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        return data
+
+    # The subset of the io API that pyarrow needs
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def read(self, nbytes=None):
+        start = self.position
+        end = self.size if nbytes is None or nbytes < 0 else min(self.size, start + nbytes)
+        if start >= end:
+            return b""
+        with self.lock:
+            if start >= self.tail_start:
+                data = self.tail[start - self.tail_start:end - self.tail_start]
+            else:
+                data = self._fetch(start, end)
+        self.position = end
+        return data
+
+    def close(self):
+        pass
+
+    @property
+    def closed(self):
+        return False
+
+
+def overlaps(stats, low, high):
+    """False only when row-group statistics prove no value lies in [low, high)."""
+    if stats is None or not stats.has_min_max:
+        return True
+    lo, hi = stats.min, stats.max
+    # Stats without a timestamp logical type (e.g. INT96) can't be compared; keep the row group
+    if not isinstance(lo, datetime) or not isinstance(hi, datetime):
+        return True
+    return hi >= low and lo < high
+
+
+def read_month(url, columns, pickup, dropoff, year, month, known_fingerprint=None, budget=None):
+    """
+    Read `columns` of one remote month file with footer-driven range requests.
+
+    Returns (arrow_table, fingerprint, report). The table holds only the row
+    groups whose `pickup` statistics overlap the month and whose `dropoff`
+    statistics overlap the year. The fingerprint hashes the footer (which records
+    every column chunk's size, offsets and statistics), so an unchanged file is
+    recognised from its footer alone: when it matches `known_fingerprint` no data
+    is read and the table is None. Before reading, the uncompressed size of the
+    chunks to read is reserved from `budget` (an ingest.ByteBudget share); the caller
+    releases `report["reserved"]` once the table is no longer needed.
+    `report` also has the byte and row-group counts.
+    """
+    start, end = (datetime.fromisoformat(d) for d in month_bounds(year, month))
+    year_start, year_end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+    remote = RangeFile(url)
+    fingerprint = hashlib.sha256(remote.size.to_bytes(8, "little") + remote.footer).hexdigest()
+    report = {"file_bytes": remote.size, "row_groups": None, "row_groups_read": 0, "reserved": 0}
+    if fingerprint == known_fingerprint:
+        report.update(bytes_fetched=remote.bytes_fetched, requests=remote.requests)
+        return None, fingerprint, report
+    parquet = pq.ParquetFile(remote)
+    metadata = parquet.metadata
+
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    missing = [c for c in columns if c not in names]
+    if missing:
+        raise ValueError(f"{url} has no column(s) {', '.join(missing)}")
+    pickup_idx, dropoff_idx = names.index(pickup), names.index(dropoff)
+    column_idx = [names.index(c) for c in columns]
+
+    keep = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        if (overlaps(row_group.column(pickup_idx).statistics, start, end)
+                and overlaps(row_group.column(dropoff_idx).statistics, year_start, year_end)):
+            keep.append(i)
+
+    if budget:
+        report["reserved"] = sum(
+            metadata.row_group(i).column(c).total_uncompressed_size for i in keep for c in column_idx
+        )
+        budget.reserve(report["reserved"])
+    try:
+        if keep:
+            table = parquet.read_row_groups(keep, columns=columns)
+        else:
+            table = pa.schema([parquet.schema_arrow.field(c) for c in columns]).empty_table()
+    except Exception:
+        if budget:
+            budget.release(report["reserved"])
+        raise
+
+    report.update(bytes_fetched=remote.bytes_fetched, requests=remote.requests,
+                  row_groups=metadata.num_row_groups, row_groups_read=len(keep))
+    return table, fingerprint, report
@@ -0,0 +1,174 @@
+import argparse
+import duckdb
+import logging
+import os
+import re
+
+# Central resource profile for every DuckDB connection the pipeline opens.
+# The profile is sized from the machine (its memory and CPUs, honouring cgroup
+# limits, so a 4 GB container gets a 4 GB profile even on a large host):
+#   - DuckDB's memory_limit is DUCKDB_MEMORY_SHARE of the memory, leaving room
+#     for Python, pandas/Arrow results and the loaders' download buffers
+#   - those download buffers (ingest.py) get ARROW_BUFFER_SHARE
+#   - threads is the number of usable CPUs
+#   - temp_directory is where DuckDB spills hash tables and sorts that don't fit
+#   - preserve_insertion_order is off, so large inserts can stream and spill
+# Every setting can be overridden with an environment variable:
+#   PIPELINE_MEMORY          memory to size for, e.g. 4GB (default: detected)
+#   DUCKDB_MEMORY_LIMIT      DuckDB memory_limit, e.g. 2GB
+#   DUCKDB_THREADS           DuckDB threads
+#   DUCKDB_TEMP_DIRECTORY    spill directory (default: duckdb_spill)
+# dbt/profiles.yml reads the same DUCKDB_* variables, plus DUCKDB_PATH for the
+# database file; `python resources.py --env` prints them for the current machine. After a stage runs, instrument.py checks
+# its peak DuckDB buffer memory and process RSS against the profile (check_peaks).
+logger = logging.getLogger(__name__)
+
+TEMP_DIRECTORY = "duckdb_spill"
+
+# The database dbt builds its models in (exported as DUCKDB_PATH)
+DATABASE = "emissions.duckdb"
+
+# Shares of the machine's memory
+DUCKDB_MEMORY_SHARE = 0.6
+ARROW_BUFFER_SHARE = 0.2
+
+# Used when the machine's memory can't be detected
+FALLBACK_MEMORY = 4 * 1024 ** 3
+
+# A stage whose process RSS goes over this share of the memory is reported
+RSS_WARNING_SHARE = 0.9
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+def parse_bytes(text):
+    """'4GB', '512 MB', '2048MiB', '2.5g' or a plain number of bytes -> bytes (units are powers of 1024)."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)(I?B)?\s*", str(text).upper())
+    if not match:
+        raise ValueError(f"Not a size: '{text}'")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2) + "B"])
+
+
+def format_bytes(n):
+    for unit in ("TB", "GB", "MB", "KB"):
+        if n >= SIZE_UNITS[unit]:
+            return f"{n / SIZE_UNITS[unit]:.1f}{unit}"
+    return f"{n}B"
+
+
+def read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def machine_memory():
+    """Bytes of memory this process may use: the cgroup limit if there is one, else physical memory."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = read_first_line(path)
+        # cgroup v1 reports "no limit" as a huge number
+        if value and value.isdigit() and int(value) < 1 << 60:
+            physical = physical_memory()
+            return min(int(value), physical) if physical else int(value)
+    return physical_memory() or FALLBACK_MEMORY
+
+
+def physical_memory():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def machine_cpus():
+    """CPUs this process may use: its affinity set, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = read_first_line("/sys/fs/cgroup/cpu.max")
+    if quota and not quota.startswith("max"):
+        limit, period = quota.split()
+        cpus = min(cpus, max(1, int(int(limit) / int(period))))
+    return cpus
+
+
+def resource_profile():
+    """The settings every stage runs with, as a dict (see the module comment)."""
+    memory = parse_bytes(os.environ["PIPELINE_MEMORY"]) if os.environ.get("PIPELINE_MEMORY") else machine_memory()
+    duckdb_memory = (parse_bytes(os.environ["DUCKDB_MEMORY_LIMIT"]) if os.environ.get("DUCKDB_MEMORY_LIMIT")
+                     else int(memory * DUCKDB_MEMORY_SHARE))
+    return {
+        "memory_bytes": memory,
+        "duckdb_memory_bytes": duckdb_memory,
+        "buffer_bytes": int(memory * ARROW_BUFFER_SHARE),
+        "threads": int(os.environ.get("DUCKDB_THREADS") or machine_cpus()),
+        "temp_directory": os.environ.get("DUCKDB_TEMP_DIRECTORY") or TEMP_DIRECTORY,
+    }
+
+
+def connect_duckdb(database=":memory:", read_only=False):
+    """duckdb.connect() with the resource profile applied."""
+    con = duckdb.connect(database=database, read_only=read_only)
+    apply_profile(con)
+    return con
+
+
+def apply_profile(con, profile=None):
+    """Apply the resource profile to a DuckDB connection; returns the profile used."""
+    profile = profile or resource_profile()
+    # DuckDB takes memory sizes in whole MiB here to avoid unit ambiguity
+    con.execute(f"SET memory_limit = '{profile['duckdb_memory_bytes'] // 1024 ** 2}MiB'")
+    con.execute(f"SET threads = {profile['threads']}")
+    con.execute(f"SET temp_directory = '{profile['temp_directory']}'")
+    con.execute("SET preserve_insertion_order = false")
+    return profile
+
+
+def check_peaks(stage, peak_buffer_bytes, peak_rss_bytes, profile=None):
+    """
+    Compare a stage's peak DuckDB buffer memory and process RSS with the profile.
+
+    Logs the peaks either way and warns (returning False) when the stage used
+    more than its share. Either peak may be None when it wasn't measured.
+    """
+    profile = profile or resource_profile()
+    within = True
+    parts = []
+    if peak_buffer_bytes is not None:
+        parts.append(f"DuckDB peak {format_bytes(peak_buffer_bytes)} of {format_bytes(profile['duckdb_memory_bytes'])}")
+        within &= peak_buffer_bytes <= profile["duckdb_memory_bytes"]
+    if peak_rss_bytes is not None:
+        rss_limit = profile["memory_bytes"] * RSS_WARNING_SHARE
+        parts.append(f"RSS peak {format_bytes(peak_rss_bytes)} of {format_bytes(profile['memory_bytes'])}")
+        within &= peak_rss_bytes <= rss_limit
+    if not parts:
+        return True
+    if within:
+        logger.info(f"{stage}: {', '.join(parts)}")
+    else:
+        logger.warning(f"{stage} went over its memory budget: {', '.join(parts)}")
+        print(f"Warning: {stage} went over its memory budget ({', '.join(parts)})")
+    return within
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the DuckDB resource profile for this machine")
+    parser.add_argument("--env", action="store_true",
+                        help="Print it as DUCKDB_* exports for the shell (read by dbt/profiles.yml)")
+    args = parser.parse_args()
+
+    profile = resource_profile()
+    if args.env:
+        print(f"export DUCKDB_PATH={os.path.abspath(DATABASE)}")
+        print(f"export DUCKDB_MEMORY_LIMIT={profile['duckdb_memory_bytes'] // 1024 ** 2}MiB")
+        print(f"export DUCKDB_THREADS={profile['threads']}")
+        print(f"export DUCKDB_TEMP_DIRECTORY={os.path.abspath(profile['temp_directory'])}")
+    else:
+        print(f"Memory:            {format_bytes(profile['memory_bytes'])}")
+        print(f"DuckDB memory:     {format_bytes(profile['duckdb_memory_bytes'])}")
+        print(f"Download buffers:  {format_bytes(profile['buffer_bytes'])}")
+        print(f"Threads:           {profile['threads']}")
+        print(f"Spill directory:   {profile['temp_directory']}")
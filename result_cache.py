@@ -0,0 +1,146 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.ipc
+
+from manifest import MANIFEST_TABLE, TRANSFORM
+
+# Persistent result cache for analysis queries.
+# A result is stored once per (SQL text, data version) as an Arrow IPC file under
+#   data/analysis_cache/<source>/<data version>/<sha256 of the SQL>.arrow
+# The data version is a fingerprint of what the queries read: the transform
+# (and dbt) partition manifest of emissions.duckdb, or the file list of the
+# parquet export. Any change to the data gives a new version, so stale results
+# are never served; directories of older versions are deleted when a new one is
+# opened. Rerunning analysis on unchanged data then only reads a few small files.
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "data/analysis_cache"
+
+# Manifest stages whose partitions end up in taxi_trips_transformed
+DATA_STAGES = [TRANSFORM, "dbt_transform"]
+
+TRIP_TABLE = "taxi_trips_transformed"
+
+
+def table_exists(con, table):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table]
+    ).fetchone()[0] > 0
+
+
+def database_version(con):
+    """
+    Data version of taxi_trips_transformed in emissions.duckdb.
+
+    Built from the manifest rows of the stages that write the table plus its
+    row count (metadata only), so a table rebuilt outside the manifest is
+    still noticed. Without a manifest the table itself is summarized.
+    """
+    digest = hashlib.sha256()
+    if table_exists(con, MANIFEST_TABLE):
+        rows = con.execute(f"""
+            SELECT stage, taxi_type, year, month, fingerprint, row_count, updated_at
+            FROM {MANIFEST_TABLE}
+            WHERE stage IN ({', '.join('?' for _ in DATA_STAGES)})
+            ORDER BY ALL
+        """, DATA_STAGES).fetchall()
+        digest.update(repr(rows).encode())
+        digest.update(repr(con.execute(
+            "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ?", [TRIP_TABLE]
+        ).fetchall()).encode())
+    else:
+        digest.update(repr(con.execute(f"""
+            SELECT COUNT(*), MIN(pick_up_datetime), MAX(pick_up_datetime), SUM(co2_kg_per_trip)
+            FROM {TRIP_TABLE}
+        """).fetchall()).encode())
+    return digest.hexdigest()[:16]
+
+
+def export_version(export_dir):
+    """Data version of the parquet export: every file's path, size and modification time."""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(export_dir, "*", "*", "*", "*.parquet"))):
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    On-disk cache of query results for one data version.
+
+    `fetchdf(con, sql)` returns the cached DataFrame for `sql` if there is one,
+    otherwise runs the query, stores its Arrow result and returns it. Output
+    files (e.g. plots) made from the cached results can be registered with
+    `record_artifact` so callers can skip regenerating them.
+    """
+
+    def __init__(self, version, cache_dir=CACHE_DIR):
+        self.version = version
+        self.cache_dir = cache_dir
+        self.version_dir = os.path.join(cache_dir, version)
+        self.artifacts_path = os.path.join(self.version_dir, "artifacts.json")
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.version_dir, exist_ok=True)
+        self._drop_old_versions()
+
+    def _drop_old_versions(self):
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name != self.version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Dropped analysis results of data version {name}")
+
+    def result_path(self, sql):
+        key = hashlib.sha256(" ".join(sql.split()).encode()).hexdigest()
+        return os.path.join(self.version_dir, f"{key}.arrow")
+
+    def fetchdf(self, con, sql):
+        path = self.result_path(sql)
+        if os.path.exists(path):
+            try:
+                with pa.memory_map(path) as source:
+                    table = pa.ipc.open_file(source).read_all()
+                self.hits += 1
+                return table.to_pandas()
+            except (OSError, pa.ArrowInvalid) as e:
+                logger.warning(f"Ignoring unreadable cached result {path}: {e}")
+
+        self.misses += 1
+        table = con.execute(sql).arrow()
+        if isinstance(table, pa.RecordBatchReader):
+            table = table.read_all()
+        # Written next to its final name and renamed, so a crash never leaves half a file
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        return table.to_pandas()
+
+    def _artifacts(self):
+        if not os.path.exists(self.artifacts_path):
+            return {}
+        with open(self.artifacts_path) as f:
+            return json.load(f)
+
+    def artifact_is_current(self, path, tag=""):
+        """
+        True when `path` was saved from this data version (by a run labelled
+        `tag`, e.g. exact or approximate) and hasn't been touched since.
+        """
+        recorded = self._artifacts().get(f"{os.path.abspath(path)}:{tag}")
+        return recorded is not None and os.path.exists(path) and os.path.getmtime(path) == recorded
+
+    def record_artifact(self, path, tag=""):
+        artifacts = self._artifacts()
+        artifacts[f"{os.path.abspath(path)}:{tag}"] = os.path.getmtime(path)
+        with open(self.artifacts_path, "w") as f:
+            json.dump(artifacts, f, indent=1)
@@ -0,0 +1,152 @@
+import logging
+
+from manifest import MANIFEST_TABLE
+
+# Pre-aggregated rollup of taxi_trips_transformed.
+# One row per taxi_type x year x month x week x day-of-week x hour holds the
+# COUNT/SUM/MAX of CO2, distance and duration. That is a few tens of thousands of
+# rows instead of tens of millions of trips, and any average, maximum or total
+# over a subset of those dimensions can be re-aggregated from it exactly
+# (AVG = SUM(sum) / SUM(count)). The rollup is refreshed per month by
+# transform.py; analysis.py asks aggregate_sql() for a query and transparently
+# falls back to the trip table when the rollup can't answer it. Every rollup row
+# records when it was refreshed, so a month rewritten without refreshing the
+# rollup (e.g. by the dbt model) is noticed even when its row count is unchanged.
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = "trip_rollup"
+SOURCE_TABLE = "taxi_trips_transformed"
+
+# Partition manifest stages that write the trip table (see manifest.py)
+WRITER_STAGES = ["transform", "dbt_transform"]
+
+# Grouping columns kept in the rollup
+ROLLUP_DIMENSIONS = ["taxi_type", "trip_year", "trip_month", "trip_week", "trip_day_of_week", "trip_hour"]
+
+# Trip column -> prefix of its count/sum/max columns in the rollup
+ROLLUP_MEASURES = {
+    "co2_kg_per_trip": "co2",
+    "trip_distance": "distance",
+    "trip_duration_seconds": "duration",
+}
+
+# How each aggregate is re-computed from the rollup columns of a measure
+ROLLUP_AGGREGATES = {
+    "avg": "SUM({p}_sum) / SUM({p}_count)",
+    "sum": "SUM({p}_sum)",
+    "count": "SUM({p}_count)",
+    "max": "MAX({p}_max)",
+}
+
+
+def rollup_select_sql(where="TRUE"):
+    """SELECT that aggregates the trip table (restricted by `where`) to rollup grain."""
+    measures = ",\n".join(
+        f"COUNT({col}) AS {p}_count, SUM({col}) AS {p}_sum, MAX({col}) AS {p}_max"
+        for col, p in ROLLUP_MEASURES.items()
+    )
+    dims = ", ".join(ROLLUP_DIMENSIONS)
+    return f"""
+        SELECT {dims},
+               COUNT(*) AS trip_count,
+               {measures},
+               -- The transaction's start time, the same as the manifest row written with it
+               now()::TIMESTAMP AS refreshed_at
+        FROM {SOURCE_TABLE}
+        WHERE {where}
+        GROUP BY {dims}
+    """
+
+
+def rebuild_rollup(con):
+    """Rebuild the whole rollup from the trip table."""
+    con.execute(f"CREATE OR REPLACE TABLE {ROLLUP_TABLE} AS {rollup_select_sql()}")
+    logger.info(f"Rebuilt {ROLLUP_TABLE}")
+
+
+def refresh_rollup_month(con, taxi_type, year, month):
+    """
+    Replace the rollup rows of one (taxi_type, year, month) partition.
+
+    Meant to run inside transform.py's per-month transaction, right after the
+    partition's trips were rewritten, so the two never disagree.
+    """
+    if not rollup_exists(con):
+        con.execute(f"CREATE TABLE {ROLLUP_TABLE} AS {rollup_select_sql('FALSE')}")
+    where = f"taxi_type = '{taxi_type}' AND trip_year = {year} AND trip_month = {month}"
+    con.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE {where}")
+    con.execute(f"INSERT INTO {ROLLUP_TABLE} {rollup_select_sql(where)}")
+
+
+def rollup_exists(con):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [ROLLUP_TABLE]
+    ).fetchone()[0] > 0
+
+
+def rollup_has_refresh_times(con):
+    """False for a rollup built before rows recorded their refresh time (it needs a rebuild)."""
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_columns() WHERE table_name = ? AND column_name = 'refreshed_at'",
+        [ROLLUP_TABLE],
+    ).fetchone()[0] > 0
+
+
+def rollup_is_current(con):
+    """
+    True when the rollup covers every trip in the trip table and no month of it
+    was rewritten after its rollup rows were refreshed.
+
+    The counts come from small or metadata-only scans, and the refresh times are
+    compared with the partition manifest's transform and dbt_transform rows; this
+    guards against a trip table rebuilt elsewhere (e.g. by dbt, after a change to
+    vehicle_emissions.csv) without refreshing the rollup.
+    """
+    if not rollup_exists(con) or not rollup_has_refresh_times(con):
+        return False
+    rolled = con.execute(f"SELECT COALESCE(SUM(trip_count), 0) FROM {ROLLUP_TABLE}").fetchone()[0]
+    trips = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
+    if rolled != trips:
+        return False
+    has_manifest = con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [MANIFEST_TABLE]
+    ).fetchone()[0] > 0
+    if not has_manifest:
+        return True
+    stages = ", ".join(f"'{s}'" for s in WRITER_STAGES)
+    outdated = con.execute(f"""
+        SELECT COUNT(*)
+        FROM {MANIFEST_TABLE} m
+        LEFT JOIN (
+            SELECT CAST(taxi_type AS VARCHAR) AS taxi_type, trip_year, trip_month,
+                   MIN(refreshed_at) AS refreshed_at
+            FROM {ROLLUP_TABLE}
+            GROUP BY ALL
+        ) r ON r.taxi_type = m.taxi_type AND r.trip_year = m.year AND r.trip_month = m.month
+        WHERE m.stage IN ({stages}) AND m.row_count > 0
+          AND (r.refreshed_at IS NULL OR r.refreshed_at < m.updated_at)
+    """).fetchone()[0]
+    return outdated == 0
+
+
+def aggregate_sql(con, measure, agg, group_by, alias, current=None):
+    """
+    SQL for `agg(measure) AS alias ... GROUP BY group_by`, answered from the rollup when possible.
+
+    Falls back to the trip table when the measure, aggregate or a grouping
+    column isn't in the rollup, or the rollup is missing or out of date.
+    `current` is a rollup_is_current() result the caller already has, so a
+    report building several queries only checks the rollup once.
+    """
+    dims = ", ".join(group_by)
+    covered = (
+        measure in ROLLUP_MEASURES
+        and agg in ROLLUP_AGGREGATES
+        and all(col in ROLLUP_DIMENSIONS for col in group_by)
+    )
+    if covered and (rollup_is_current(con) if current is None else current):
+        expr = ROLLUP_AGGREGATES[agg].format(p=ROLLUP_MEASURES[measure])
+        return f"SELECT {dims}, {expr} AS {alias} FROM {ROLLUP_TABLE} GROUP BY {dims}"
+
+    logger.info(f"{agg}({measure}) by {dims} not served by {ROLLUP_TABLE}; scanning {SOURCE_TABLE}")
+    return f"SELECT {dims}, {agg.upper()}({measure}) AS {alias} FROM {SOURCE_TABLE} GROUP BY {dims}"
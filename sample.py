@@ -0,0 +1,148 @@
+import logging
+from statistics import NormalDist
+
+from rollup import ROLLUP_DIMENSIONS, ROLLUP_MEASURES
+
+# Stratified reservoir sample of taxi_trips_transformed for approximate analysis.
+# Each (taxi_type, year, month) partition is one stratum: transform.py replaces a
+# stratum's sample whenever it rewrites the month, drawing SAMPLE_ROWS trips
+# uniformly at random (reservoir sampling) and storing, with every sampled row,
+# how many trips the stratum had and how many were sampled. Averages and totals
+# over any grouping are then estimated from the sample with the standard
+# stratified estimators, each with a normal-approximation confidence interval
+# (see estimate_sql). analysis.py --approximate answers its questions this way.
+logger = logging.getLogger(__name__)
+
+SAMPLE_TABLE = "trip_sample"
+SOURCE_TABLE = "taxi_trips_transformed"
+
+# Trips kept per stratum (a month of one taxi type). For a month of 3M yellow
+# trips this gives averages within about 1% at 95% confidence.
+SAMPLE_ROWS = 20000
+
+# Seed for the reservoir draw, so re-transforming unchanged data gives the same sample
+SAMPLE_SEED = 42
+
+CONFIDENCE = 0.95
+
+# Columns that define a stratum
+STRATUM_COLUMNS = ["taxi_type", "trip_year", "trip_month"]
+
+# Columns kept for each sampled trip: the rollup's dimensions and measures
+SAMPLE_COLUMNS = ROLLUP_DIMENSIONS + list(ROLLUP_MEASURES)
+
+
+def sample_select_sql(where="TRUE", rows=SAMPLE_ROWS):
+    """SELECT drawing up to `rows` trips at random from the trips matching `where` (one stratum)."""
+    columns = ", ".join(SAMPLE_COLUMNS)
+    return f"""
+        SELECT s.*, p.population AS stratum_population, LEAST(p.population, {rows}) AS stratum_sample
+        FROM (
+            SELECT {columns} FROM (SELECT {columns} FROM {SOURCE_TABLE} WHERE {where})
+            USING SAMPLE reservoir({rows} ROWS) REPEATABLE ({SAMPLE_SEED})
+        ) s,
+        (SELECT COUNT(*) AS population FROM {SOURCE_TABLE} WHERE {where}) p
+    """
+
+
+def sample_exists(con):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [SAMPLE_TABLE]
+    ).fetchone()[0] > 0
+
+
+def refresh_sample_month(con, taxi_type, year, month):
+    """
+    Redraw the sample of one (taxi_type, year, month) stratum.
+
+    Like refresh_rollup_month, meant to run inside transform.py's per-month
+    transaction right after the month's trips were rewritten.
+    """
+    if not sample_exists(con):
+        con.execute(f"CREATE TABLE {SAMPLE_TABLE} AS {sample_select_sql('FALSE')}")
+    where = f"taxi_type = '{taxi_type}' AND trip_year = {year} AND trip_month = {month}"
+    con.execute(f"DELETE FROM {SAMPLE_TABLE} WHERE {where}")
+    con.execute(f"INSERT INTO {SAMPLE_TABLE} {sample_select_sql(where)}")
+
+
+def rebuild_sample(con):
+    """Redraw the sample of every stratum in the trip table."""
+    con.execute(f"CREATE OR REPLACE TABLE {SAMPLE_TABLE} AS {sample_select_sql('FALSE')}")
+    strata = con.execute(
+        f"SELECT DISTINCT {', '.join(STRATUM_COLUMNS)} FROM {SOURCE_TABLE} ORDER BY ALL"
+    ).fetchall()
+    for taxi_type, year, month in strata:
+        refresh_sample_month(con, taxi_type, year, month)
+    logger.info(f"Rebuilt {SAMPLE_TABLE} ({len(strata)} strata)")
+
+
+def sample_is_current(con):
+    """True when the sample exists and its strata add up to every trip in the trip table."""
+    if not sample_exists(con):
+        return False
+    sampled = con.execute(f"""
+        SELECT COALESCE(SUM(population), 0) FROM (
+            SELECT ANY_VALUE(stratum_population) AS population
+            FROM {SAMPLE_TABLE} GROUP BY {', '.join(STRATUM_COLUMNS)}
+        )
+    """).fetchone()[0]
+    trips = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE}").fetchone()[0]
+    return sampled == trips
+
+
+def estimate_sql(measure, agg, group_by, alias, confidence=CONFIDENCE):
+    """
+    SQL estimating `agg(measure) AS alias ... GROUP BY group_by` from the sample.
+
+    Returns the group columns, the estimate `alias` and `{alias}_margin`, the
+    half-width of its `confidence` interval. With N trips and n sampled in a
+    stratum, each sampled trip stands for N / n trips:
+      - sum: sum of (N / n) * value, with the stratified variance
+        sum over strata of N^2 (1 - n/N) s^2 / n
+      - avg: estimated sum / estimated number of trips in the group (a ratio
+        estimator), with its linearized variance
+    Groups cut across strata (e.g. trip_hour), so every stratum contributes the
+    trips of each group it sampled.
+    """
+    if measure not in ROLLUP_MEASURES or agg not in ("avg", "sum"):
+        raise ValueError(f"Can't estimate {agg}({measure}) from {SAMPLE_TABLE}")
+    groups = ", ".join(group_by)
+    cells = ", ".join(dict.fromkeys(list(group_by) + STRATUM_COLUMNS))
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    # Per-stratum variance factor N^2 (1 - n/N) / n / (n - 1); DuckDB names are
+    # case-insensitive, so N is called pop
+    factor = "pop * pop * (1 - n / pop) / n / GREATEST(n - 1, 1)"
+    if agg == "sum":
+        variance = f"SUM({factor} * (syy - sy * sy / n))"
+        estimate = "total"
+    else:
+        # Deviations from the group's ratio r = total / trips, summed per stratum
+        variance = (f"SUM({factor} * ((syy - 2 * r * sy + r * r * c) - POWER(sy - r * c, 2) / n))"
+                    f" / (trips * trips)")
+        estimate = "r"
+    return f"""
+        WITH cells AS (
+            SELECT {cells},
+                   ANY_VALUE(stratum_population) AS pop,
+                   ANY_VALUE(stratum_sample) AS n,
+                   COUNT(*) AS c,
+                   SUM(CAST({measure} AS DOUBLE)) AS sy,
+                   SUM(POWER(CAST({measure} AS DOUBLE), 2)) AS syy
+            FROM {SAMPLE_TABLE}
+            WHERE {measure} IS NOT NULL
+            GROUP BY {cells}
+        ),
+        group_totals AS (
+            SELECT {groups},
+                   SUM(pop / n * sy) AS total,
+                   SUM(pop / n * c) AS trips,
+                   SUM(pop / n * sy) / SUM(pop / n * c) AS r
+            FROM cells
+            GROUP BY {groups}
+        )
+        SELECT {groups},
+               {estimate} AS {alias},
+               {z} * SQRT(GREATEST({variance}, 0)) AS {alias}_margin
+        FROM cells JOIN group_totals USING ({groups})
+        GROUP BY {groups}, total, trips, r
+    """
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import decimal
+import json
+import logging
+import os
+import queue
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pyarrow as pa
+import pyarrow.ipc
+
+import distributions
+from analysis import QUESTIONS, analysis_queries
+from export import EXPORT_DIR, parquet_connection
+from resources import connect_duckdb
+from result_cache import export_version
+from snapshot import SNAPSHOT_DIR, latest_snapshot
+
+# Local read-only query service for the analysis results.
+# An asyncio HTTP server answers
+#   GET /health                        which data is being served
+#   GET /analysis                      the analysis questions (see analysis.QUESTIONS)
+#   GET /analysis/<question>           e.g. /analysis/hours?approximate=1
+#   GET /distributions/<kind>          quantiles, histogram or top, with the
+#                                      parameters of distributions.py, e.g.
+#                                      /distributions/quantiles?measure=avg_mph&group_by=taxi_type
+# as JSON, or as an Arrow IPC stream with ?format=arrow (or an Accept header of
+# application/vnd.apache.arrow.stream).
+#
+# It never opens emissions.duckdb, whose write lock the loaders hold: it reads
+# the latest published snapshot (see snapshot.py) or the parquet export, through
+# a pool of read-only cursors whose queries run on worker threads so the event
+# loop keeps accepting requests. Every REFRESH_SECONDS it checks for a newer
+# snapshot (or a changed export) and swaps in a new pool; requests already
+# running finish on the old one, which is closed when the last of them is done. Results are immutable for a given snapshot, so
+# each pool memoizes the answers to the fixed analysis questions (and the
+# histogram ranges); distribution queries take arbitrary parameters and are not
+# kept, so memory doesn't grow with every new combination.
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Read-only cursors per pool (queries that can run at the same time)
+POOL_SIZE = 4
+
+# How often to look for a newer snapshot or export
+REFRESH_SECONDS = 30
+
+# Most rows /distributions/top returns per group
+MAX_TOP_TRIPS = 1000
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+class RequestError(Exception):
+    """A bad request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ReadPool:
+    """
+    Fixed set of read-only cursors over one snapshot (or the export).
+
+    `run(sql)` borrows a cursor, runs the query and returns an Arrow table;
+    with `memoize` the result is kept for later calls (only for queries from a
+    small fixed set). Call it from a worker thread; it blocks while every
+    cursor is busy. Requests bracket their use of the pool with enter() and
+    leave(), so a retired pool is only closed once no request is using it.
+    """
+
+    def __init__(self, source, version, size=POOL_SIZE, snapshot_dir=SNAPSHOT_DIR, export_dir=EXPORT_DIR):
+        self.source = source
+        self.version = version
+        if source == "parquet":
+            self.con = parquet_connection(export_dir)
+        else:
+            self.con = connect_duckdb(version, read_only=True)
+        self.cursors = queue.Queue()
+        for _ in range(size):
+            self.cursors.put(self.con.cursor())
+        self.results = {}
+        self.approximate_sql = None
+        self.exact_sql = None
+        self.lock = threading.Lock()
+        self.active = 0
+        self.retired = False
+        self.closed = False
+
+    def enter(self):
+        """Start a request on this pool; False if the pool is already closed."""
+        with self.lock:
+            if self.closed:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+            if self.retired and self.active == 0:
+                self.close()
+
+    def retire(self):
+        """Stop serving from this pool: close it now if it is idle, else when its last request leaves."""
+        with self.lock:
+            self.retired = True
+            if self.active == 0:
+                self.close()
+
+    def run(self, sql, memoize=False):
+        if sql in self.results:
+            return self.results[sql]
+        cursor = self.cursors.get()
+        try:
+            table = cursor.execute(sql).arrow()
+            if isinstance(table, pa.RecordBatchReader):
+                table = table.read_all()
+        finally:
+            self.cursors.put(cursor)
+        if memoize:
+            self.results[sql] = table
+        return table
+
+    def questions(self, approximate):
+        """SQL of the analysis questions for this pool's data (built once per mode)."""
+        attr = "approximate_sql" if approximate else "exact_sql"
+        if getattr(self, attr) is None:
+            cursor = self.cursors.get()
+            try:
+                setattr(self, attr, analysis_queries(cursor, approximate))
+            finally:
+                self.cursors.put(cursor)
+        return getattr(self, attr)
+
+    def close(self):
+        self.closed = True
+        self.con.close()
+
+
+def current_version(source, snapshot_dir=SNAPSHOT_DIR, export_dir=EXPORT_DIR):
+    """What a pool should be serving now: the latest snapshot's path, or the export's version."""
+    if source == "parquet":
+        return export_version(export_dir)
+    return latest_snapshot(snapshot_dir)
+
+
+def first(params, name, default=None):
+    values = params.get(name)
+    return values[0] if values else default
+
+
+def flag(params, name):
+    return first(params, name, "0").lower() in ("1", "true", "yes")
+
+
+def parse_number(name, value, kind=float):
+    try:
+        return kind(value)
+    except ValueError:
+        raise RequestError(400, f"{name} must be a number, not '{value}'")
+
+
+def number(params, name, default, kind=float):
+    value = first(params, name)
+    if value is None:
+        return default
+    return parse_number(name, value, kind)
+
+
+def json_value(value):
+    """JSON encoding of the values json can't encode itself."""
+    # DECIMAL columns (e.g. trip_distance) are numbers to a client, not strings
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def distribution_sql(pool, kind, params):
+    """Build the distributions.py query for a /distributions/<kind> request."""
+    try:
+        return build_distribution_sql(pool, kind, params)
+    except ValueError as e:
+        # The query builders reject out-of-range parameters (quantiles, bins, ranges)
+        raise RequestError(400, str(e))
+
+
+def build_distribution_sql(pool, kind, params):
+    measure = first(params, "measure", "co2_kg_per_trip")
+    if measure not in distributions.MEASURES:
+        raise RequestError(400, f"measure must be one of {', '.join(distributions.MEASURES)}")
+    group_by = [c for c in first(params, "group_by", "").split(",") if c]
+    # Checked before any query runs (e.g. the histogram's default range)
+    distributions.check_group_by(group_by)
+
+    if kind == "quantiles":
+        quantiles = [parse_number("q", q) for q in params.get("q", [])] or distributions.DEFAULT_QUANTILES
+        return distributions.quantiles_sql(measure, quantiles, group_by or distributions.DEFAULT_GROUP_BY,
+                                           flag(params, "exact"))
+    if kind == "histogram":
+        group_by = group_by or distributions.DEFAULT_GROUP_BY
+        low, high = number(params, "low", None), number(params, "high", None)
+        if low is None or high is None:
+            edges = pool.run(f"""
+                SELECT MIN({measure}), approx_quantile({measure}, {distributions.HISTOGRAM_UPPER_QUANTILE})
+                FROM {distributions.TRIP_TABLE} WHERE {measure} IS NOT NULL AND isfinite({measure})
+            """, memoize=True).to_pylist()[0]
+            low, high = [float(v) for v in edges.values()]
+        return distributions.histogram_sql(measure, low, high, number(params, "bins", distributions.DEFAULT_BINS, int),
+                                           group_by)
+    if kind == "top":
+        n = min(number(params, "n", 10, int), MAX_TOP_TRIPS)
+        return distributions.top_trips_sql(measure, n, group_by or ["taxi_type"])
+    raise RequestError(404, f"Unknown distribution '{kind}'; use quantiles, histogram or top")
+
+
+class AnalysisServer:
+    def __init__(self, source="duckdb", pool_size=POOL_SIZE, refresh_seconds=REFRESH_SECONDS,
+                 snapshot_dir=SNAPSHOT_DIR, export_dir=EXPORT_DIR):
+        self.source = source
+        self.pool_size = pool_size
+        self.refresh_seconds = refresh_seconds
+        self.snapshot_dir = snapshot_dir
+        self.export_dir = export_dir
+        self.pool = None
+
+    def refresh(self):
+        """Switch to a new pool if a newer snapshot or export was published."""
+        version = current_version(self.source, self.snapshot_dir, self.export_dir)
+        if version is None:
+            raise RuntimeError(f"No snapshot in {self.snapshot_dir}/; run `python snapshot.py` "
+                               f"or `python pipeline.py --snapshot` first")
+        if self.pool is not None and self.pool.version == version:
+            return
+        old, self.pool = self.pool, ReadPool(self.source, version, self.pool_size, self.snapshot_dir, self.export_dir)
+        logger.info(f"Serving {self.source} data version {version}")
+        print(f"Serving {self.source} data version {version}")
+        if old is not None:
+            old.retire()
+
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Could not refresh the served data: {e}")
+
+    def answer(self, path, params):
+        """Run one request on a worker thread; returns (payload dict, Arrow table or None)."""
+        # A refresh can retire the pool between reading it and entering it; then use the new one
+        pool = self.pool
+        while not pool.enter():
+            pool = self.pool
+        try:
+            return self.answer_from(pool, path, params)
+        finally:
+            pool.leave()
+
+    def answer_from(self, pool, path, params):
+        parts = [p for p in path.split("/") if p]
+        meta = {"source": self.source, "version": pool.version}
+        if parts == ["health"]:
+            return dict(meta, status="ok"), None
+        if parts == ["analysis"]:
+            return dict(meta, questions=QUESTIONS), None
+        if len(parts) == 2 and parts[0] == "analysis":
+            if parts[1] not in QUESTIONS:
+                raise RequestError(404, f"Unknown question '{parts[1]}'; see /analysis")
+            queries, approximate = pool.questions(flag(params, "approximate"))
+            return dict(meta, question=parts[1], approximate=approximate), pool.run(queries[parts[1]], memoize=True)
+        if len(parts) == 2 and parts[0] == "distributions":
+            return dict(meta, distribution=parts[1]), pool.run(distribution_sql(pool, parts[1], params))
+        raise RequestError(404, f"No endpoint {path}")
+
+    async def handle(self, reader, writer):
+        status, body, content_type = 200, b"", "application/json"
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2 or request_line[0] != "GET":
+                raise RequestError(405, "Only GET is supported")
+
+            url = urlsplit(request_line[1])
+            params = parse_qs(url.query)
+            payload, table = await asyncio.to_thread(self.answer, url.path, params)
+            arrow = first(params, "format") == "arrow" or ARROW_STREAM in headers.get("accept", "")
+            if table is not None and arrow:
+                sink = pa.BufferOutputStream()
+                with pa.ipc.new_stream(sink, table.schema) as stream:
+                    stream.write_table(table)
+                body, content_type = sink.getvalue().to_pybytes(), ARROW_STREAM
+            else:
+                if table is not None:
+                    payload["columns"] = table.column_names
+                    payload["rows"] = table.to_pylist()
+                body = json.dumps(payload, default=json_value).encode()
+        except RequestError as e:
+            status, body = e.status, json.dumps({"error": str(e)}).encode()
+        except Exception as e:
+            logger.error(f"Error answering request: {e}")
+            status, body = 500, json.dumps({"error": str(e)}).encode()
+
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        self.refresh()
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"Listening on http://{host}:{port}")
+        print(f"Listening on http://{host}:{port}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.refresh_forever())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the analysis queries over HTTP from a read-only snapshot")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--source", choices=["duckdb", "parquet"], default="duckdb",
+                        help="Serve the latest published snapshot of emissions.duckdb or the parquet export")
+    parser.add_argument("--connections", type=int, default=POOL_SIZE, help="Queries that may run at the same time")
+    parser.add_argument("--refresh", type=float, default=REFRESH_SECONDS,
+                        help="Seconds between checks for a newer snapshot or export")
+    args = parser.parse_args()
+
+    # analysis.py sets up its own log file when imported; the server gets one
+    # log of its own instead.
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='serve.log',
+        force=True
+    )
+    server = AnalysisServer(args.source, args.connections, args.refresh)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Stopped")
+    except Exception as e:
+        logger.error(f"Server error: {e}")
+        print("Server error:", e)
@@ -0,0 +1,119 @@
+import logging
+import os
+import time
+
+from manifest import MANIFEST_TABLE, TRANSFORM
+from resources import connect_duckdb
+from rollup import ROLLUP_TABLE
+from sample import SAMPLE_TABLE
+
+# Published read-only snapshots of the analysis tables.
+# DuckDB lets only one process open emissions.duckdb while it is being written,
+# so readers that must keep working during a load or clean (serve.py) read a
+# snapshot instead: a separate database file holding just the tables analysis
+# needs, written by whoever holds the write lock (pipeline.py's snapshot node,
+# or `python snapshot.py` when nothing else has the database open). Each
+# snapshot is written under a new name and then announced by rewriting the
+# LATEST file, so readers never see a half-written snapshot; older snapshots are
+# deleted once KEEP_SNAPSHOTS newer ones exist (readers that still have one open
+# keep reading it until they switch).
+logger = logging.getLogger(__name__)
+
+DATABASE = "emissions.duckdb"
+SNAPSHOT_DIR = "snapshots"
+LATEST_FILE = "LATEST"
+
+# Snapshots kept on disk, including the latest
+KEEP_SNAPSHOTS = 2
+
+# Tables copied into a snapshot (those that exist)
+SNAPSHOT_TABLES = ["taxi_trips_transformed", ROLLUP_TABLE, SAMPLE_TABLE, MANIFEST_TABLE]
+
+
+def latest_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Path of the most recently published snapshot, or None if there is none."""
+    try:
+        with open(os.path.join(snapshot_dir, LATEST_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(snapshot_dir, name)
+    return path if os.path.exists(path) else None
+
+
+def publish_snapshot(con, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Copy the analysis tables of `con` into a new snapshot file and make it the latest.
+
+    Works on a read-only connection too. Returns the snapshot's path.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"emissions-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.duckdb"
+    path = os.path.join(snapshot_dir, name)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    existing = {row[0] for row in con.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE database_name = current_database()"
+    ).fetchall()}
+    con.execute(f"ATTACH '{tmp_path}' AS snapshot (READ_WRITE)")
+    try:
+        for table in SNAPSHOT_TABLES:
+            if table in existing:
+                con.execute(f"CREATE TABLE snapshot.{table} AS SELECT * FROM {table}")
+    finally:
+        con.execute("DETACH snapshot")
+    os.replace(tmp_path, path)
+
+    # Announce the new snapshot only once it is complete
+    latest_tmp = os.path.join(snapshot_dir, LATEST_FILE + ".tmp")
+    with open(latest_tmp, "w") as f:
+        f.write(name)
+    os.replace(latest_tmp, os.path.join(snapshot_dir, LATEST_FILE))
+    logger.info(f"Published snapshot {path}")
+
+    prune_snapshots(snapshot_dir)
+    return path
+
+
+def prune_snapshots(snapshot_dir=SNAPSHOT_DIR, keep=KEEP_SNAPSHOTS):
+    """Delete all but the `keep` newest snapshots."""
+    snapshots = sorted(
+        (name for name in os.listdir(snapshot_dir) if name.endswith(".duckdb")),
+        key=lambda name: os.path.getmtime(os.path.join(snapshot_dir, name)),
+    )
+    for name in snapshots[:-keep]:
+        os.remove(os.path.join(snapshot_dir, name))
+        logger.info(f"Deleted old snapshot {name}")
+
+
+def snapshot_is_stale(con, snapshot_dir=SNAPSHOT_DIR):
+    """True when a partition was transformed after the latest snapshot was published."""
+    path = latest_snapshot(snapshot_dir)
+    if path is None:
+        return True
+    return bool(con.execute(
+        f"SELECT COALESCE(MAX(updated_at) > CAST(to_timestamp(?) AS TIMESTAMP), false) "
+        f"FROM {MANIFEST_TABLE} WHERE stage = ?",
+        [os.path.getmtime(path), TRANSFORM],
+    ).fetchone()[0])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='snapshot.log'
+    )
+    con = None
+    try:
+        con = connect_duckdb(DATABASE, read_only=True)
+        path = publish_snapshot(con)
+        print(f"Published snapshot {path}")
+    except Exception as e:
+        logger.error(f"Error publishing snapshot: {e}")
+        print("Error publishing snapshot:", e)
+    finally:
+        if con:
+            con.close()
@@ -0,0 +1,277 @@
+import argparse
+import logging
+import os
+import statistics
+import time
+
+from fleets import TRIP_COLUMNS, load_fleets
+from resources import connect_duckdb
+from rollup import rebuild_rollup
+from sample import rebuild_sample
+
+# Storage schema for the trip tables.
+# Every raw, clean, quarantined and transformed trip table is created from the DDL here
+# instead of inheriting whatever types read_parquet or EXTRACT produce:
+#   - calendar parts as TINYINT/SMALLINT instead of DOUBLE/BIGINT
+#   - passenger_count as SMALLINT and trip_distance as DECIMAL(9, 3) (exact to
+#     the TLC's three decimals, stored in 4 bytes)
+#   - taxi_type as an ENUM of the fleets in fleets.yml instead of VARCHAR
+# Rows are inserted in pickup-time order, so each row group covers a narrow time
+# range and DuckDB's min/max zonemaps skip row groups on pickup-time filters.
+#
+# Run `python storage.py` for a size and scan-time report, or
+# `python storage.py --migrate` to convert a database built before this layout
+# (the report is printed before and after).
+logger = logging.getLogger(__name__)
+
+DATABASE = "emissions.duckdb"
+
+TAXI_TYPE_ENUM = "taxi_type_enum"
+
+# Largest |trip_distance| DECIMAL(9, 3) holds. Raw values beyond it (the TLC data
+# has a few absurd ones) are clamped, which keeps them over the clean stage's
+# 100 mile limit, so they are still quarantined as over_100_miles.
+MAX_TRIP_DISTANCE = 999999
+
+# Raw and clean trip tables (one per fleet, see fleets.yml)
+TRIP_TABLE_COLUMNS = """
+    pick_up_datetime TIMESTAMP,
+    drop_off_dt TIMESTAMP,
+    passenger_count SMALLINT,
+    trip_distance DECIMAL(9, 3)
+"""
+
+# Rows the clean stage rejected (see clean.py): the trip columns plus the taxi
+# type, the rejection rule bitmask and how many raw copies there were
+QUARANTINE_TABLE = "clean_quarantine"
+QUARANTINE_COLUMNS = f"""
+    taxi_type {TAXI_TYPE_ENUM},{TRIP_TABLE_COLUMNS},
+    reject_mask UTINYINT,
+    copies INTEGER
+"""
+
+# taxi_trips_transformed
+TRANSFORMED_TABLE = "taxi_trips_transformed"
+TRANSFORMED_COLUMNS = f"""
+    taxi_type {TAXI_TYPE_ENUM},
+    pick_up_datetime TIMESTAMP,
+    drop_off_dt TIMESTAMP,
+    passenger_count SMALLINT,
+    trip_distance DECIMAL(9, 3),
+    trip_duration_seconds INTEGER,
+    avg_mph FLOAT,
+    co2_kg_per_trip DOUBLE,
+    trip_hour TINYINT,
+    trip_day_of_week TINYINT,
+    trip_week TINYINT,
+    trip_month TINYINT,
+    trip_year SMALLINT
+"""
+
+# Scan-time probes for the report: a one-week pickup window (zonemap pruning)
+# and a full-table aggregate
+SCAN_QUERIES = {
+    "one_week": f"""
+        SELECT COUNT(*), SUM(co2_kg_per_trip) FROM {TRANSFORMED_TABLE}
+        WHERE pick_up_datetime >= (SELECT MIN(pick_up_datetime) FROM {TRANSFORMED_TABLE}) + INTERVAL 90 DAY
+          AND pick_up_datetime < (SELECT MIN(pick_up_datetime) FROM {TRANSFORMED_TABLE}) + INTERVAL 97 DAY
+    """,
+    "by_hour": f"""
+        SELECT taxi_type, trip_hour, AVG(co2_kg_per_trip), SUM(trip_distance)
+        FROM {TRANSFORMED_TABLE} GROUP BY ALL
+    """,
+}
+SCAN_REPEATS = 5
+
+
+def raw_column_sql(column, expression):
+    """Fit a source expression into the raw trip-table type of `column`."""
+    if column == "passenger_count":
+        return f"TRY_CAST({expression} AS SMALLINT)"
+    if column == "trip_distance":
+        return f"CAST(LEAST(GREATEST({expression}, -{MAX_TRIP_DISTANCE}), {MAX_TRIP_DISTANCE}) AS DECIMAL(9, 3))"
+    return f"CAST({expression} AS TIMESTAMP)"
+
+
+def create_trip_table(con, table):
+    con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({TRIP_TABLE_COLUMNS})")
+
+
+def enum_values(con, type_name):
+    """Values of an ENUM type, or None if it doesn't exist."""
+    exists = con.execute(
+        "SELECT COUNT(*) FROM duckdb_types() WHERE type_name = ? AND NOT internal", [type_name]
+    ).fetchone()[0]
+    if not exists:
+        return None
+    return con.execute(f"SELECT enum_range(NULL::{type_name})").fetchone()[0]
+
+
+def ensure_taxi_type_enum(con):
+    """
+    Create (or widen) the taxi_type ENUM so it lists every fleet in fleets.yml.
+
+    DuckDB can't add values to an ENUM in place, so when a fleet is added the
+    columns using it are switched to VARCHAR, the type is recreated and the
+    columns are switched back.
+    """
+    names = list(load_fleets())
+    current = enum_values(con, TAXI_TYPE_ENUM)
+    if current is not None and set(names) <= set(current):
+        return
+    values = ", ".join(f"'{n}'" for n in (current or []) + [n for n in names if n not in (current or [])])
+    users = con.execute(
+        "SELECT table_name, column_name FROM duckdb_columns() WHERE data_type LIKE 'ENUM%' AND column_name = 'taxi_type'"
+    ).fetchall() if current is not None else []
+    for table, column in users:
+        con.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE VARCHAR")
+    con.execute(f"DROP TYPE IF EXISTS {TAXI_TYPE_ENUM}")
+    con.execute(f"CREATE TYPE {TAXI_TYPE_ENUM} AS ENUM ({values})")
+    for table, column in users:
+        con.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {TAXI_TYPE_ENUM}")
+    logger.info(f"{TAXI_TYPE_ENUM} now lists {values}")
+
+
+def create_quarantine_table(con):
+    ensure_taxi_type_enum(con)
+    con.execute(f"CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} ({QUARANTINE_COLUMNS})")
+
+
+def create_transformed_table(con, replace=False):
+    ensure_taxi_type_enum(con)
+    create = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+    con.execute(f"{create} {TRANSFORMED_TABLE} ({TRANSFORMED_COLUMNS})")
+
+
+def table_exists(con, table):
+    return con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [table]
+    ).fetchone()[0] > 0
+
+
+def trip_tables(con):
+    """Raw and clean tables of every fleet that exist in the database."""
+    tables = []
+    for fleet in load_fleets().values():
+        for table in (fleet["table"], f"clean_{fleet['table']}"):
+            if table_exists(con, table):
+                tables.append(table)
+    return tables
+
+
+def table_bytes(con, table):
+    """Bytes of storage blocks a table occupies (after a checkpoint)."""
+    block_size = con.execute("SELECT block_size FROM pragma_database_size()").fetchone()[0]
+    blocks = con.execute(
+        f"SELECT COUNT(DISTINCT block_id) FROM pragma_storage_info('{table}') WHERE block_id >= 0"
+    ).fetchone()[0]
+    return blocks * block_size
+
+
+def scan_seconds(con, sql):
+    """Median wall time of `sql` over SCAN_REPEATS runs (after one warm-up)."""
+    con.execute(sql).fetchall()
+    times = []
+    for _ in range(SCAN_REPEATS):
+        start = time.perf_counter()
+        con.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def storage_report(con, path=DATABASE):
+    """Print and return database size, per-table size and scan times."""
+    con.execute("CHECKPOINT")
+    report = {"file_bytes": os.path.getsize(path), "tables": {}, "scans": {}}
+    for table in trip_tables(con) + [TRANSFORMED_TABLE]:
+        if table_exists(con, table):
+            rows = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            report["tables"][table] = {"rows": rows, "bytes": table_bytes(con, table)}
+    if table_exists(con, TRANSFORMED_TABLE):
+        for name, sql in SCAN_QUERIES.items():
+            report["scans"][name] = scan_seconds(con, sql)
+
+    print(f"{path}: {report['file_bytes'] / 1024 ** 2:,.1f} MB on disk")
+    for table, info in report["tables"].items():
+        per_row = info["bytes"] / info["rows"] if info["rows"] else 0
+        print(f"  {table:<32} {info['rows']:>12,} rows {info['bytes'] / 1024 ** 2:>10,.1f} MB  ({per_row:.1f} B/row)")
+    for name, seconds in report["scans"].items():
+        print(f"  scan {name:<27} {seconds * 1000:>10,.1f} ms")
+    logger.info(f"Storage report: {report}")
+    return report
+
+
+def rewrite_table(con, table, columns, order_by="pick_up_datetime", select="*"):
+    """Rewrite `table` with the typed `columns`, physically sorted by `order_by`."""
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"CREATE TABLE {table}__typed ({columns})")
+        con.execute(f"INSERT INTO {table}__typed SELECT {select} FROM {table} ORDER BY {order_by}")
+        con.execute(f"DROP TABLE {table}")
+        con.execute(f"ALTER TABLE {table}__typed RENAME TO {table}")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    logger.info(f"Rewrote {table} with the compact sorted layout")
+
+
+def migrate(con):
+    """Convert every trip table to the typed, sorted layout and rebuild the rollup and sample from it."""
+    # Out-of-range raw values are fitted the same way new loads fit them
+    fitted = ", ".join(raw_column_sql(c, c) for c in TRIP_COLUMNS)
+    for table in trip_tables(con):
+        rewrite_table(con, table, TRIP_TABLE_COLUMNS, select=fitted)
+    if table_exists(con, QUARANTINE_TABLE):
+        ensure_taxi_type_enum(con)
+        rewrite_table(con, QUARANTINE_TABLE, QUARANTINE_COLUMNS,
+                      "taxi_type, pick_up_datetime", f"taxi_type, {fitted}, reject_mask, copies")
+    if table_exists(con, TRANSFORMED_TABLE):
+        ensure_taxi_type_enum(con)
+        rewrite_table(con, TRANSFORMED_TABLE, TRANSFORMED_COLUMNS, "taxi_type, pick_up_datetime")
+        rebuild_rollup(con)
+        rebuild_sample(con)
+
+
+def compact(path=DATABASE):
+    """Copy the database into a fresh file so the space freed by a migration is returned to the OS."""
+    tmp_path = path + ".compact"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = connect_duckdb(path)
+    try:
+        con.execute(f"ATTACH '{tmp_path}' AS compacted")
+        con.execute(f"COPY FROM DATABASE {os.path.splitext(os.path.basename(path))[0]} TO compacted")
+        con.execute("DETACH compacted")
+    finally:
+        con.close()
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report (and optionally migrate) the trip tables' storage layout")
+    parser.add_argument("--migrate", action="store_true",
+                        help="Rewrite the trip tables with narrow types, a taxi_type ENUM and pickup-time order")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename='storage.log'
+    )
+    con = connect_duckdb(DATABASE)
+    try:
+        if args.migrate:
+            print("Before:")
+            storage_report(con)
+            migrate(con)
+            con.close()
+            compact()
+            con = connect_duckdb(DATABASE)
+            print("After:")
+        storage_report(con)
+    except Exception as e:
+        logger.error(f"Error during storage migration: {e}")
+        print("Error during storage migration:", e)
+    finally:
+        con.close()
@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+from datetime import datetime
+
+from fleets import fleet_file_name, load_fleets
+from manifest import month_bounds
+from resources import connect_duckdb
+
+# Deterministic synthetic NYC trip-data generator for benchmarks and offline runs.
+# Writes yellow/green-shaped monthly parquet files (tpep_/lpep_ column names,
+# named by the fleets' file templates in fleets.yml) that ingest.py can read
+# from a local directory. All randomness
+# comes from DuckDB's hash() of the row number and a seed, so the same seed and
+# scale always produce byte-identical data. A realistic share of dirty rows
+# (zero passengers, zero or >100 mile trips, >24 hour trips, missing drop-offs,
+# out-of-month pickups) and exact duplicates is mixed in so the cleaning stage
+# has real work to do.
+logger = logging.getLogger(__name__)
+
+# Taxi type -> TLC column prefix
+PREFIXES = {"yellow": "tpep", "green": "lpep"}
+
+# Green volume relative to yellow. Real 2024 data is closer to 1.5%; 10% keeps the
+# green branch measurable at small scales.
+GREEN_RATIO = 0.1
+
+# Share of generated rows that get each kind of defect (cumulative thresholds below)
+DIRTY_RATES = [
+    ("no_passengers", 0.02),
+    ("zero_distance", 0.01),
+    ("over_100_miles", 0.0005),
+    ("over_24_hours", 0.0005),
+    ("missing_dropoff", 0.001),
+    ("previous_month_pickup", 0.0002),
+]
+DUPLICATE_RATE = 0.005
+
+
+def parse_scale(text):
+    """Parse '1M', '500k' or '2000' into a row count."""
+    text = str(text).strip().upper()
+    factor = {"K": 10 ** 3, "M": 10 ** 6, "B": 10 ** 9}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+def uniform(k, seed):
+    """SQL for a deterministic uniform [0, 1) value per row, independent for each k."""
+    return f"((hash(i, {seed}, {k}) % 1000000000) / 1e9)"
+
+
+def month_sql(prefix, year, month, rows, seed):
+    """SELECT generating `rows` trips (plus duplicates) for one month."""
+    start, end = month_bounds(year, month)
+    seconds = int((datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds())
+    thresholds = []
+    total = 0.0
+    for name, rate in DIRTY_RATES:
+        total += rate
+        thresholds.append((name, total))
+    defect = "CASE " + " ".join(
+        f"WHEN {uniform(5, seed)} < {t} THEN '{name}'" for name, t in thresholds
+    ) + " ELSE 'clean' END"
+
+    return f"""
+        WITH base AS (
+            SELECT i,
+                   {defect} AS defect,
+                   TIMESTAMP '{start}' + to_seconds(CAST({uniform(1, seed)} * {seconds} AS BIGINT)) AS pickup,
+                   -- Exponential-ish trip durations around 15 minutes
+                   CAST(60 - ln(1 - {uniform(2, seed)}) * 900 AS BIGINT) AS duration_s,
+                   5 + {uniform(3, seed)} * 20 AS speed_mph,
+                   1 + CAST(floor(pow({uniform(4, seed)}, 3) * 5) AS BIGINT) AS passengers
+            FROM range({rows}) t(i)
+        ),
+        trips AS (
+            SELECT
+                CAST(1 + i % 2 AS INTEGER) AS VendorID,
+                CASE WHEN defect = 'previous_month_pickup' THEN pickup - INTERVAL 35 DAY ELSE pickup END
+                    AS {prefix}_pickup_datetime,
+                CASE
+                    WHEN defect = 'missing_dropoff' THEN NULL
+                    WHEN defect = 'over_24_hours' THEN pickup + INTERVAL 2 DAY
+                    ELSE pickup + to_seconds(duration_s)
+                END AS {prefix}_dropoff_datetime,
+                CASE WHEN defect = 'no_passengers' THEN 0 ELSE passengers END AS passenger_count,
+                CASE
+                    WHEN defect = 'zero_distance' THEN 0.0
+                    WHEN defect = 'over_100_miles' THEN round(100 + {uniform(6, seed)} * 400, 2)
+                    ELSE round(duration_s / 3600.0 * speed_mph, 2)
+                END AS trip_distance,
+                CAST(1 AS BIGINT) AS RatecodeID,
+                CAST(1 + hash(i, {seed}, 7) % 263 AS INTEGER) AS PULocationID,
+                CAST(1 + hash(i, {seed}, 8) % 263 AS INTEGER) AS DOLocationID,
+                CAST(1 + hash(i, {seed}, 9) % 4 AS BIGINT) AS payment_type,
+                round(3 + duration_s / 3600.0 * speed_mph * 2.5, 2) AS fare_amount,
+                round(5 + duration_s / 3600.0 * speed_mph * 3.1, 2) AS total_amount,
+                i
+            FROM base
+        )
+        SELECT * EXCLUDE (i) FROM trips
+        UNION ALL
+        SELECT * EXCLUDE (i) FROM trips WHERE {uniform(10, seed)} < {DUPLICATE_RATE}
+    """
+
+
+def generate(output_dir, rows, year=2024, seed=42, green_ratio=GREEN_RATIO):
+    """
+    Write 12 monthly files per taxi type to `output_dir`.
+
+    `rows` is the yellow row count for the whole year (before duplicates);
+    green gets `rows * green_ratio`. Returns {taxi_type: rows generated}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    con = connect_duckdb()
+    fleets = load_fleets()
+    totals = {}
+    for taxi_type, prefix in PREFIXES.items():
+        yearly = int(rows * (1 if taxi_type == "yellow" else green_ratio))
+        totals[taxi_type] = yearly
+        for month in range(1, 13):
+            per_month = yearly // 12 + (1 if month <= yearly % 12 else 0)
+            path = os.path.join(output_dir, fleet_file_name(fleets[taxi_type], year, month))
+            # Different seed stream per taxi type and month keeps files independent
+            month_seed = seed * 1000 + month * 10 + (1 if taxi_type == "yellow" else 2)
+            con.execute(f"COPY ({month_sql(prefix, year, month, per_month, month_seed)}) TO '{path}' (FORMAT PARQUET)")
+            logger.info(f"Wrote {path} ({per_month} base rows)")
+    con.close()
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic NYC taxi parquet files")
+    parser.add_argument("output_dir", help="Directory to write <taxi>_tripdata_YYYY-MM.parquet files to")
+    parser.add_argument("--rows", default="1M", help="Yellow rows for the year, e.g. 1M, 10M, 50M")
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--green-ratio", type=float, default=GREEN_RATIO)
+    args = parser.parse_args()
+    totals = generate(args.output_dir, parse_scale(args.rows), args.year, args.seed, args.green_ratio)
+    print(f"Generated {totals} rows in {args.output_dir}")
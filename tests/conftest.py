@@ -0,0 +1,52 @@
+import os
+import shutil
+import sys
+
+import duckdb
+import pytest
+
+# The pipeline modules live at the top of the repository, not in a package
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+YEAR = 2024
+
+
+@pytest.fixture(scope="session")
+def transformed_db(tmp_path_factory):
+    """
+    Path of an emissions.duckdb that went through load, clean and transform
+    with a small synthetic year of yellow and green trips.
+    """
+    from clean import clean_taxi, configure
+    from fleets import load_fleets
+    from load import load_fleet, load_vehicle_emissions
+    from synthetic import generate
+    from transform import transform_pending
+
+    directory = tmp_path_factory.mktemp("pipeline")
+    generate(str(directory / "files"), 6000, year=YEAR)
+    fleets = load_fleets()
+    with pytest.MonkeyPatch.context() as mp:
+        # The emissions CSV is relative to the repository; the cache and spill files to the working directory
+        mp.setattr("load.EMISSIONS_CSV", os.path.join(REPO, "data", "vehicle_emissions.csv"))
+        mp.chdir(directory)
+        con = duckdb.connect(str(directory / "emissions.duckdb"))
+        configure(con)
+        load_vehicle_emissions(con, fleets)
+        for name in ("yellow", "green"):
+            load_fleet(con, fleets[name], source=str(directory / "files"), rate=0, years=[YEAR])
+            clean_taxi(con, name)
+        transform_pending(con)
+        con.close()
+    return str(directory / "emissions.duckdb")
+
+
+@pytest.fixture
+def pipeline_con(transformed_db, tmp_path, monkeypatch):
+    """Connection to a private copy of `transformed_db`, so a test may change it."""
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(transformed_db, tmp_path / "emissions.duckdb")
+    con = duckdb.connect(str(tmp_path / "emissions.duckdb"))
+    yield con
+    con.close()
@@ -0,0 +1,41 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import analysis
+from rollup import SOURCE_TABLE, rebuild_rollup
+
+# Tests of the analysis report (analysis.py) over a database holding more than
+# one year: months of different years must stay apart.
+
+
+def add_next_year(con):
+    """Copy the yellow January trips into January of the next year."""
+    con.execute(f"""
+        INSERT INTO {SOURCE_TABLE}
+        SELECT * REPLACE (pick_up_datetime + INTERVAL 1 YEAR AS pick_up_datetime,
+                          drop_off_dt + INTERVAL 1 YEAR AS drop_off_dt,
+                          trip_year + 1 AS trip_year)
+        FROM {SOURCE_TABLE} WHERE taxi_type = 'yellow' AND trip_month = 1
+    """)
+    rebuild_rollup(con)
+
+
+def test_monthly_totals_keep_years_apart(pipeline_con):
+    add_next_year(pipeline_con)
+    queries, _ = analysis.analysis_queries(pipeline_con)
+
+    totals = pipeline_con.execute(queries["monthly_totals"]).fetchdf()
+    january = totals[(totals["taxi_type"] == "yellow") & (totals["trip_month"] == 1)]
+    assert sorted(january["trip_year"]) == [2024, 2025]
+    assert january["total_co2"].iloc[0] == january["total_co2"].iloc[1]
+
+    months = pipeline_con.execute(queries["months"]).fetchdf()
+    assert len(months) == 2
+
+
+def test_report_plots_every_year_month(pipeline_con, tmp_path, monkeypatch):
+    add_next_year(pipeline_con)
+    monkeypatch.setattr(analysis, "PLOT_PATH", str(tmp_path / "trend.png"))
+    analysis.run_analysis(pipeline_con)
+    assert (tmp_path / "trend.png").exists()
@@ -0,0 +1,87 @@
+import duckdb
+import pytest
+
+from clean import REJECTION_RULES, REJECTION_SUMMARY_TABLE, clean_taxi, configure, rejection_mask_sql
+from manifest import CLEAN, LOAD, get_partitions, record_partition
+from storage import QUARANTINE_TABLE, create_trip_table
+
+# Tests of the cleaning step (clean.py): every raw row gets the bitmask of the
+# rules it breaks, clean rows are deduplicated, rejected rows are quarantined
+# with their mask and copy count, and the per-rule summary adds up.
+
+RAW_TABLE = "yellow_taxi_data"
+
+# (pickup, dropoff, passengers, miles) of January 2024 raw rows, and their bitmask
+RAW_ROWS = [
+    ("2024-01-05 08:00", "2024-01-05 08:20", 1, 3.2, 0),
+    ("2024-01-05 08:00", "2024-01-05 08:20", 1, 3.2, 0),      # duplicate of the row above
+    ("2024-01-06 09:00", "2024-01-06 09:10", 2, 1.5, 0),
+    ("2024-01-07 10:00", None, 1, 2.0, 1),                     # missing_dropoff
+    ("2024-01-08 11:00", "2024-01-08 11:05", 0, 0.0, 2 | 4),   # no_passengers and zero_distance
+    ("2024-01-08 11:00", "2024-01-08 11:05", 0, 0.0, 2 | 4),   # ... twice
+    ("2024-01-09 12:00", "2024-01-09 15:00", 1, 150.0, 8),     # over_100_miles
+    ("2024-01-10 13:00", "2024-01-11 19:00", 1, 40.0, 16),     # over_24_hours
+]
+
+
+@pytest.fixture
+def con(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    con = duckdb.connect(str(tmp_path / "emissions.duckdb"))
+    configure(con)
+    create_trip_table(con, RAW_TABLE)
+    con.executemany(f"INSERT INTO {RAW_TABLE} VALUES (?, ?, ?, ?)", [row[:4] for row in RAW_ROWS])
+    record_partition(con, LOAD, "yellow", 2024, 1, "loaded", len(RAW_ROWS))
+    yield con
+    con.close()
+
+
+def test_rejection_mask_sets_one_bit_per_broken_rule(con):
+    masks = con.execute(f"SELECT {rejection_mask_sql()} FROM {RAW_TABLE} ORDER BY rowid").fetchall()
+    assert [m for (m,) in masks] == [row[4] for row in RAW_ROWS]
+    assert [bit for bit, _, _ in REJECTION_RULES] == [1, 2, 4, 8, 16]
+
+
+def test_clean_keeps_unique_valid_rows_and_quarantines_the_rest(con):
+    assert clean_taxi(con, "yellow") == 1
+
+    assert con.execute(f"SELECT COUNT(*) FROM clean_{RAW_TABLE}").fetchone()[0] == 2
+    quarantined = con.execute(
+        f"SELECT reject_mask, copies FROM {QUARANTINE_TABLE} WHERE taxi_type = 'yellow' ORDER BY reject_mask"
+    ).fetchall()
+    assert quarantined == [(1, 1), (6, 2), (8, 1), (16, 1)]
+    # The manifest records the clean rows of the month
+    assert con.execute(
+        "SELECT row_count FROM partition_manifest WHERE stage = ? AND taxi_type = 'yellow'", [CLEAN]
+    ).fetchone()[0] == 2
+
+
+def test_rejection_summary_counts_every_raw_copy(con):
+    clean_taxi(con, "yellow")
+
+    summary = dict(con.execute(
+        f"SELECT rule, rows_rejected FROM {REJECTION_SUMMARY_TABLE} WHERE taxi_type = 'yellow' AND year = 2024 AND month = 1"
+    ).fetchall())
+    assert summary == {
+        "duplicate": 1,
+        "missing_dropoff": 1,
+        "no_passengers": 2,
+        "zero_distance": 2,
+        "over_100_miles": 1,
+        "over_24_hours": 1,
+    }
+
+
+def test_recleaning_a_month_replaces_its_quarantine(con):
+    clean_taxi(con, "yellow")
+    # The month is reloaded with one more rejected row
+    con.execute(f"INSERT INTO {RAW_TABLE} VALUES ('2024-01-20 07:00', NULL, 1, 1.0)")
+    record_partition(con, LOAD, "yellow", 2024, 1, "reloaded", len(RAW_ROWS) + 1)
+
+    assert clean_taxi(con, "yellow") == 1
+    assert clean_taxi(con, "yellow") == 0
+    assert con.execute(f"SELECT SUM(copies) FROM {QUARANTINE_TABLE}").fetchone()[0] == 6
+    assert con.execute(
+        f"SELECT rows_rejected FROM {REJECTION_SUMMARY_TABLE} WHERE rule = 'missing_dropoff'"
+    ).fetchone()[0] == 2
+    assert get_partitions(con, CLEAN, "yellow") == get_partitions(con, LOAD, "yellow")
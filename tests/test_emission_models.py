@@ -0,0 +1,59 @@
+import duckdb
+import pytest
+
+from emission_models import (CITY_MPH, COMBINED_CITY_SHARE, DEFAULT_MODEL, HIGHWAY_MPH, co2_sql, model_salt,
+                             resolve_factors)
+
+# Tests of the per-trip CO2 models (emission_models.py), evaluated in DuckDB
+# with the numbers of the yellow_taxi row of data/vehicle_emissions.csv.
+
+FACTORS = {"co2_grams_per_mile": 380.0, "mpg_city": 25.0, "mpg_highway": 32.0}
+
+
+def kg_co2(model, miles, mph, factors=FACTORS):
+    return duckdb.execute(f"SELECT {co2_sql(model, factors, repr(float(miles)), repr(float(mph)))}").fetchone()[0]
+
+
+def test_per_mile_is_distance_times_the_rated_grams():
+    assert kg_co2("per_mile", 10, 30) == pytest.approx(3.8)
+
+
+def test_combined_mix_reproduces_the_rated_grams_per_mile():
+    # The speed at which 45% of the blend is highway driving
+    mix_mph = CITY_MPH + (1 - COMBINED_CITY_SHARE) * (HIGHWAY_MPH - CITY_MPH)
+    assert kg_co2("city_highway", 1, mix_mph) == pytest.approx(FACTORS["co2_grams_per_mile"] / 1000)
+    assert kg_co2("city_highway", 10, mix_mph) == pytest.approx(kg_co2("per_mile", 10, mix_mph))
+
+
+def test_speeds_beyond_the_cycles_are_clamped():
+    city = kg_co2("city_highway", 1, CITY_MPH)
+    highway = kg_co2("city_highway", 1, HIGHWAY_MPH)
+    # Fuel per mile scales with 1/mpg, so all-city over all-highway is the mpg ratio
+    assert city / highway == pytest.approx(FACTORS["mpg_highway"] / FACTORS["mpg_city"])
+    assert kg_co2("city_highway", 1, 2) == pytest.approx(city)
+    assert kg_co2("city_highway", 1, 0) == pytest.approx(city)
+    assert kg_co2("city_highway", 1, 90) == pytest.approx(highway)
+    assert highway < kg_co2("city_highway", 1, 35) < city
+
+
+def test_missing_factors_give_null():
+    assert kg_co2("city_highway", 1, 30, {"co2_grams_per_mile": 380.0}) is None
+    assert kg_co2("per_mile", 1, 30, {}) is None
+
+
+def test_factors_come_from_the_vehicle_emissions_row():
+    con = duckdb.connect()
+    con.execute("CREATE TABLE vehicle_emissions AS SELECT 'yellow_taxi' AS vehicle_type, 380 AS co2_grams_per_mile, "
+                "25 AS mpg_city, 32 AS mpg_highway")
+    assert resolve_factors(con, "yellow_taxi") == {"co2_grams_per_mile": 380, "mpg_city": 25, "mpg_highway": 32}
+    assert resolve_factors(con, "rickshaw") == {}
+
+
+def test_unknown_model_is_rejected():
+    with pytest.raises(ValueError):
+        co2_sql("per_kilogram", FACTORS, "1", "30")
+
+
+def test_only_other_models_change_the_partition_salt():
+    assert model_salt(DEFAULT_MODEL, "fp") == "fp"
+    assert model_salt("city_highway", "fp") != "fp"
@@ -0,0 +1,201 @@
+import functools
+import os
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import duckdb
+import pytest
+
+import ingest
+from cache import ParquetCache
+from fleets import load_fleets
+from manifest import LOAD, get_partitions
+from synthetic import generate
+
+# Offline tests of the month ingestion engine (ingest.py).
+# Month files come from synthetic.py, read either from a local directory or
+# through a local HTTP server that answers byte-range requests the way the TLC's
+# CDN does, so the range reader (ranged.py) and the parquet cache (cache.py) are
+# exercised without the network.
+
+YEAR = 2024
+MONTHS = list(range(1, 13))
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler that also answers `Range: bytes=a-b` (and suffix) requests."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get("Range")
+        if not range_header or not os.path.isfile(path):
+            return super().do_GET()
+        size = os.path.getsize(path)
+        first, last = re.match(r"bytes=(\d*)-(\d*)", range_header).groups()
+        if first == "":
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture(scope="module")
+def trip_files(tmp_path_factory):
+    """A small synthetic year of yellow and green month files."""
+    directory = tmp_path_factory.mktemp("trip_files")
+    generate(str(directory), 6000, year=YEAR)
+    return str(directory)
+
+
+@pytest.fixture(scope="module")
+def http_source(trip_files):
+    """Base URL of a local range-capable HTTP server over `trip_files`."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                 functools.partial(RangeRequestHandler, directory=trip_files))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def con(tmp_path, monkeypatch):
+    # The parquet cache and DuckDB's spill directory are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    con = duckdb.connect(str(tmp_path / "emissions.duckdb"))
+    yield con
+    con.close()
+
+
+@pytest.fixture
+def fleet():
+    return load_fleets()["yellow"]
+
+
+def table_rows(con, fleet):
+    return con.execute(f"SELECT COUNT(*) FROM {fleet['table']}").fetchone()[0]
+
+
+def test_local_load_then_rerun_skips_unchanged_months(con, fleet, trip_files):
+    inserted = ingest.ingest_months(con, fleet, YEAR, MONTHS, source=trip_files, rate=0)
+
+    assert inserted > 0
+    assert inserted == table_rows(con, fleet)
+    assert sorted(m for (_, _, m) in get_partitions(con, LOAD, "yellow")) == MONTHS
+    assert ingest.ingest_months(con, fleet, YEAR, MONTHS, source=trip_files, rate=0) == 0
+
+
+@pytest.mark.parametrize("reader", ingest.READERS)
+def test_http_readers_load_the_same_rows_as_local_files(con, fleet, trip_files, http_source, reader):
+    expected = duckdb.connect()
+    local = ingest.ingest_months(expected, fleet, YEAR, MONTHS, source=trip_files, rate=0)
+    expected.close()
+
+    assert ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0, reader=reader) == local
+    # Unchanged files are recognised on the rerun (ranges: from the footer; cache: from the cached copy)
+    assert ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0, reader=reader) == 0
+    assert table_rows(con, fleet) == local
+
+
+def test_unchanged_rerun_makes_no_requests(con, fleet, http_source, monkeypatch):
+    loaded = ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0)
+    assert loaded > 0
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("the range reader was used on an unchanged rerun")
+
+    # The default (range) reader trusts the footers it read recently, like the cache trusts its files
+    monkeypatch.setattr(ingest, "read_month", no_network)
+    assert ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0) == 0
+
+
+def test_footers_are_read_again_once_they_expire(con, fleet, http_source, monkeypatch):
+    ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0)
+    real_read_month = ingest.read_month
+    reads = []
+
+    def counting_read_month(url, *args):
+        reads.append(url)
+        return real_read_month(url, *args)
+
+    monkeypatch.setattr(ingest, "read_month", counting_read_month)
+    cache = ParquetCache(revalidate_after=0)
+    assert ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0, cache=cache) == 0
+    assert len(reads) == len(MONTHS)
+
+
+def test_failed_load_resumes_where_it_stopped(con, fleet, http_source, monkeypatch):
+    real_insert_month = ingest.insert_month
+
+    def failing_insert_month(con, fleet, year, month, data, fingerprint):
+        if month == 7:
+            raise RuntimeError("injected failure")
+        return real_insert_month(con, fleet, year, month, data, fingerprint)
+
+    monkeypatch.setattr(ingest, "insert_month", failing_insert_month)
+    with pytest.raises(RuntimeError, match="injected failure"):
+        ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0, max_workers=2)
+    done = get_partitions(con, LOAD, "yellow")
+    rows_before = table_rows(con, fleet)
+    assert (("yellow", YEAR, 7) not in done) and len(done) < len(MONTHS)
+    # Recorded months are complete: the manifest's row counts match the table
+    assert rows_before == con.execute(
+        "SELECT COALESCE(SUM(row_count), 0) FROM partition_manifest WHERE stage = ? AND taxi_type = 'yellow'", [LOAD]
+    ).fetchone()[0]
+
+    monkeypatch.setattr(ingest, "insert_month", real_insert_month)
+    inserted = ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0, max_workers=2)
+
+    # Only the months missing after the failure were loaded again
+    assert inserted == table_rows(con, fleet) - rows_before
+    assert sorted(m for (_, _, m) in get_partitions(con, LOAD, "yellow")) == MONTHS
+
+
+def test_failed_load_returns_its_reservations_to_the_budget(con, fleet, http_source, monkeypatch):
+    def failing_insert_month(con, fleet, year, month, data, fingerprint):
+        raise RuntimeError("injected failure")
+
+    budget = ingest.ByteBudget(1024 ** 3)
+    monkeypatch.setattr(ingest, "insert_month", failing_insert_month)
+    with pytest.raises(RuntimeError, match="injected failure"):
+        ingest.ingest_months(con, fleet, YEAR, MONTHS, source=http_source, rate=0, max_workers=4, budget=budget)
+
+    # Months fetched but never inserted must not keep their bytes reserved
+    assert budget.used == 0
+
+
+def test_shared_budget_cancels_only_the_closed_share():
+    budget = ingest.ByteBudget(100)
+    first, second = budget.share(), budget.share()
+    first.reserve(80)
+
+    # A reservation that doesn't fit waits; closing its share fails it without touching the other
+    errors = []
+
+    def reserve_too_much():
+        try:
+            second.reserve(50)
+        except RuntimeError as e:
+            errors.append(e)
+
+    waiter = threading.Thread(target=reserve_too_much)
+    waiter.start()
+    second.close()
+    waiter.join(timeout=5)
+    assert not waiter.is_alive() and errors
+
+    first.release(80)
+    first.reserve(100)
+    assert budget.used == 100
@@ -0,0 +1,43 @@
+import threading
+
+import duckdb
+
+import instrument
+
+# Tests of the per-query run metrics (instrument.py).
+
+STAGES = [f"stage_{i}" for i in range(12)]
+QUERIES_PER_STAGE = 5
+
+
+def test_concurrent_flushes_record_every_row(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    base = duckdb.connect()
+    connections = [instrument.instrument(base.cursor(), stage) for stage in STAGES]
+    for con in connections:
+        for i in range(QUERIES_PER_STAGE):
+            con.execute(f"SELECT {i}").fetchall()
+
+    # Flush every stage at once, as pipeline.py's parallel nodes do when they finish together
+    start = threading.Barrier(len(connections))
+
+    def flush(con):
+        start.wait()
+        con.flush()
+
+    threads = [threading.Thread(target=flush, args=(con,)) for con in connections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    base.close()
+
+    metrics = duckdb.connect(instrument.METRICS_DB, read_only=True)
+    try:
+        counts = dict(metrics.execute(
+            f"SELECT stage, COUNT(*) FROM {instrument.METRICS_TABLE} WHERE run_id = ? GROUP BY stage",
+            [instrument.RUN_ID],
+        ).fetchall())
+    finally:
+        metrics.close()
+    assert counts == {stage: QUERIES_PER_STAGE for stage in STAGES}
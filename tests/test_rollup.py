@@ -0,0 +1,56 @@
+import pytest
+
+from manifest import TRANSFORM
+from rollup import ROLLUP_AGGREGATES, ROLLUP_MEASURES, ROLLUP_TABLE, SOURCE_TABLE, aggregate_sql, rollup_is_current
+from transform import transform_pending
+
+# Tests of the analysis rollup (rollup.py): its answers must equal the ones
+# scanned from the trip table, and it must notice a trip table rewritten
+# without it (e.g. by the dbt model).
+
+
+@pytest.mark.parametrize("measure", list(ROLLUP_MEASURES))
+@pytest.mark.parametrize("agg", list(ROLLUP_AGGREGATES))
+@pytest.mark.parametrize("group_by", [["taxi_type"], ["taxi_type", "trip_month"], ["trip_hour"]])
+def test_rollup_answers_equal_the_trip_table(pipeline_con, measure, agg, group_by):
+    sql = aggregate_sql(pipeline_con, measure, agg, group_by, "value", current=True)
+    assert ROLLUP_TABLE in sql
+
+    dims = ", ".join(group_by)
+    exact = pipeline_con.execute(
+        f"SELECT {dims}, {agg.upper()}({measure}) AS value FROM {SOURCE_TABLE} GROUP BY {dims} ORDER BY {dims}"
+    ).fetchall()
+    rolled = pipeline_con.execute(f"SELECT * FROM ({sql}) ORDER BY {dims}").fetchall()
+    assert [row[:-1] for row in rolled] == [row[:-1] for row in exact]
+    assert [float(row[-1]) for row in rolled] == pytest.approx([float(row[-1]) for row in exact])
+
+
+def test_unknown_grouping_falls_back_to_the_trip_table(pipeline_con):
+    sql = aggregate_sql(pipeline_con, "co2_kg_per_trip", "avg", ["passenger_count"], "value", current=True)
+    assert ROLLUP_TABLE not in sql and SOURCE_TABLE in sql
+
+
+def test_month_rewritten_elsewhere_makes_the_rollup_stale(pipeline_con):
+    assert rollup_is_current(pipeline_con)
+
+    # What a dbt run does after vehicle_emissions.csv changed: same rows, new CO2
+    pipeline_con.execute(f"""
+        UPDATE {SOURCE_TABLE} SET co2_kg_per_trip = co2_kg_per_trip * 2
+        WHERE taxi_type = 'yellow' AND trip_month = 3
+    """)
+    pipeline_con.execute("""
+        INSERT OR REPLACE INTO partition_manifest
+        SELECT 'dbt_transform', taxi_type, year, month, fingerprint, row_count, now()
+        FROM partition_manifest WHERE stage = ? AND taxi_type = 'yellow' AND month = 3
+    """, [TRANSFORM])
+    assert not rollup_is_current(pipeline_con)
+
+    # The next transform run rebuilds it from the rewritten trips
+    transform_pending(pipeline_con)
+    assert rollup_is_current(pipeline_con)
+    sql = aggregate_sql(pipeline_con, "co2_kg_per_trip", "sum", ["taxi_type", "trip_month"], "value", current=True)
+    rolled = pipeline_con.execute(f"SELECT value FROM ({sql}) WHERE taxi_type = 'yellow' AND trip_month = 3").fetchone()[0]
+    exact = pipeline_con.execute(
+        f"SELECT SUM(co2_kg_per_trip) FROM {SOURCE_TABLE} WHERE taxi_type = 'yellow' AND trip_month = 3"
+    ).fetchone()[0]
+    assert float(rolled) == pytest.approx(float(exact))
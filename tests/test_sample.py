@@ -0,0 +1,68 @@
+import pytest
+
+from sample import SAMPLE_TABLE, SOURCE_TABLE, STRATUM_COLUMNS, estimate_sql, sample_is_current, sample_select_sql
+
+# Tests of the stratified trip sample (sample.py): estimates from a sample that
+# holds every trip are exact, and the confidence intervals of estimates from a
+# small sample cover the exact answers about as often as they claim to.
+
+
+def redraw_sample(con, rows):
+    """Replace the sample with one of at most `rows` trips per stratum."""
+    con.execute(f"CREATE OR REPLACE TABLE {SAMPLE_TABLE} AS {sample_select_sql('FALSE', rows)}")
+    strata = con.execute(f"SELECT DISTINCT {', '.join(STRATUM_COLUMNS)} FROM {SOURCE_TABLE}").fetchall()
+    for taxi_type, year, month in strata:
+        where = f"taxi_type = '{taxi_type}' AND trip_year = {year} AND trip_month = {month}"
+        con.execute(f"INSERT INTO {SAMPLE_TABLE} {sample_select_sql(where, rows)}")
+
+
+def compare(con, measure, agg, group_by):
+    """[(estimate, margin, exact)] per group of `group_by`."""
+    dims = ", ".join(group_by)
+    return con.execute(f"""
+        SELECT e.value, e.value_margin, x.value
+        FROM ({estimate_sql(measure, agg, group_by, "value")}) e
+        JOIN (SELECT {dims}, {agg.upper()}({measure}) AS value FROM {SOURCE_TABLE} GROUP BY {dims}) x
+        USING ({dims})
+    """).fetchall()
+
+
+def test_sample_of_every_trip_gives_exact_answers(pipeline_con):
+    # The synthetic months are smaller than SAMPLE_ROWS, so each stratum is sampled whole
+    assert sample_is_current(pipeline_con)
+    for agg in ("avg", "sum"):
+        for estimate, margin, exact in compare(pipeline_con, "co2_kg_per_trip", agg, ["taxi_type", "trip_hour"]):
+            assert estimate == pytest.approx(float(exact))
+            assert margin == pytest.approx(0, abs=1e-9)
+
+
+@pytest.mark.parametrize("measure", ["co2_kg_per_trip", "trip_distance"])
+@pytest.mark.parametrize("agg", ["avg", "sum"])
+def test_confidence_intervals_cover_the_exact_answers(pipeline_con, measure, agg):
+    # Fewer trips than any synthetic month has, so every stratum is sampled
+    redraw_sample(pipeline_con, 30)
+    results = compare(pipeline_con, measure, agg, ["taxi_type", "trip_month"])
+
+    assert len(results) == 24
+    covered = sum(abs(estimate - float(exact)) <= margin + 1e-9 for estimate, margin, exact in results)
+    # 95% intervals; allow for the spread of a couple of dozen groups
+    assert covered >= 0.8 * len(results)
+    assert all(margin > 0 for _, margin, _ in results)
+
+
+def test_smaller_samples_have_wider_margins(pipeline_con):
+    redraw_sample(pipeline_con, 10)
+    wide = [margin for _, margin, _ in compare(pipeline_con, "co2_kg_per_trip", "avg", ["taxi_type"])]
+    redraw_sample(pipeline_con, 40)
+    narrow = [margin for _, margin, _ in compare(pipeline_con, "co2_kg_per_trip", "avg", ["taxi_type"])]
+    assert all(n < w for n, w in zip(narrow, wide))
+
+
+def test_sample_is_stale_after_the_trips_change(pipeline_con):
+    pipeline_con.execute(f"DELETE FROM {SOURCE_TABLE} WHERE taxi_type = 'green' AND trip_month = 5")
+    assert not sample_is_current(pipeline_con)
+
+
+def test_only_averages_and_totals_can_be_estimated():
+    with pytest.raises(ValueError):
+        estimate_sql("co2_kg_per_trip", "max", ["taxi_type"], "value")
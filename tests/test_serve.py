@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import duckdb
+import pytest
+
+import serve
+from snapshot import publish_snapshot
+
+# Tests of the query service (serve.py) over HTTP, served from a snapshot of the
+# small synthetic database: answers, the 400/404 answers to bad parameters, and
+# the 500 answer to a query that fails.
+
+
+@pytest.fixture
+def base_url(pipeline_con, tmp_path):
+    """URL of an AnalysisServer on an event loop thread, serving a snapshot of `pipeline_con`."""
+    snapshot_dir = str(tmp_path / "snapshots")
+    publish_snapshot(pipeline_con, snapshot_dir)
+    server = serve.AnalysisServer(pool_size=2, snapshot_dir=snapshot_dir)
+    server.refresh()
+
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(asyncio.start_server(server.handle, "127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    listener.close()
+    loop.close()
+    server.pool.retire()
+
+
+def get(url):
+    """(status, decoded JSON body) of a GET request."""
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_answers_questions_and_distributions(base_url):
+    status, body = get(f"{base_url}/analysis/largest_trip")
+    assert status == 200 and {row["taxi_type"] for row in body["rows"]} == {"yellow", "green"}
+
+    status, body = get(f"{base_url}/distributions/quantiles?measure=avg_mph&group_by=taxi_type&q=0.5")
+    assert status == 200 and len(body["rows"]) == 2
+
+
+def test_decimal_columns_are_json_numbers(base_url):
+    status, body = get(f"{base_url}/distributions/top?measure=trip_distance&n=3")
+    assert status == 200
+    assert all(isinstance(row["trip_distance"], float) for row in body["rows"])
+
+
+@pytest.mark.parametrize("query", [
+    "quantiles?group_by=no_such_column",
+    "quantiles?group_by=pick_up_datetime",
+    "histogram?group_by=taxi_type;DROP",
+    "quantiles?measure=fare",
+    "quantiles?q=2",
+    "quantiles?q=half",
+    "histogram?low=5&high=1",
+    "histogram?bins=0",
+    "top?n=many",
+])
+def test_bad_parameters_are_a_400(base_url, query):
+    status, body = get(f"{base_url}/distributions/{query}")
+    assert status == 400 and body["error"]
+
+
+@pytest.mark.parametrize("path", ["/analysis/no_such_question", "/distributions/median", "/nothing"])
+def test_unknown_paths_are_a_404(base_url, path):
+    assert get(base_url + path)[0] == 404
+
+
+def test_failed_query_is_a_500_and_the_server_keeps_serving(base_url, monkeypatch):
+    real_run = serve.ReadPool.run
+
+    def failing_run(pool, sql, memoize=False):
+        if "approx_quantile" in sql:
+            raise duckdb.IOException("injected failure")
+        return real_run(pool, sql, memoize)
+
+    monkeypatch.setattr(serve.ReadPool, "run", failing_run)
+    status, body = get(f"{base_url}/distributions/quantiles")
+    assert status == 500 and "injected failure" in body["error"]
+    assert get(f"{base_url}/health")[0] == 200
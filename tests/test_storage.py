@@ -0,0 +1,112 @@
+import duckdb
+import pytest
+
+import storage
+from rollup import ROLLUP_TABLE
+from storage import (MAX_TRIP_DISTANCE, QUARANTINE_TABLE, TAXI_TYPE_ENUM, TRANSFORMED_TABLE, create_quarantine_table,
+                     create_transformed_table, enum_values, ensure_taxi_type_enum, migrate)
+
+# Tests of the compact storage layout (storage.py): widening the taxi_type ENUM
+# when a fleet is added, and migrating a database built with the loose types
+# read_parquet and EXTRACT produce.
+
+
+def column_types(con, table):
+    return dict(con.execute(
+        "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = ?", [table]
+    ).fetchall())
+
+
+@pytest.fixture
+def con(tmp_path):
+    con = duckdb.connect(str(tmp_path / "emissions.duckdb"))
+    yield con
+    con.close()
+
+
+def test_enum_is_widened_when_a_fleet_is_added(con, monkeypatch):
+    fleets = storage.load_fleets()
+    monkeypatch.setattr(storage, "load_fleets", lambda: {"yellow": fleets["yellow"]})
+    create_transformed_table(con)
+    create_quarantine_table(con)
+    con.execute(f"INSERT INTO {TRANSFORMED_TABLE} (taxi_type, trip_year, trip_month) VALUES ('yellow', 2024, 1)")
+    con.execute(f"INSERT INTO {QUARANTINE_TABLE} (taxi_type, reject_mask, copies) VALUES ('yellow', 4, 2)")
+    assert enum_values(con, TAXI_TYPE_ENUM) == ["yellow"]
+
+    monkeypatch.setattr(storage, "load_fleets", lambda: fleets)
+    ensure_taxi_type_enum(con)
+
+    # Existing values keep their place, and the tables keep their rows and the ENUM type
+    values = enum_values(con, TAXI_TYPE_ENUM)
+    assert values[0] == "yellow" and set(values) == set(fleets)
+    for table in (TRANSFORMED_TABLE, QUARANTINE_TABLE):
+        assert column_types(con, table)["taxi_type"].startswith("ENUM")
+        assert con.execute(f"SELECT taxi_type::VARCHAR FROM {table}").fetchall() == [("yellow",)]
+    con.execute(f"INSERT INTO {TRANSFORMED_TABLE} (taxi_type, trip_year, trip_month) VALUES ('green', 2024, 1)")
+
+
+def test_enum_is_left_alone_when_every_fleet_is_listed(con):
+    ensure_taxi_type_enum(con)
+    create_transformed_table(con)
+    con.execute(f"INSERT INTO {TRANSFORMED_TABLE} (taxi_type) VALUES ('green')")
+    ensure_taxi_type_enum(con)
+    assert enum_values(con, TAXI_TYPE_ENUM) == list(storage.load_fleets())
+
+
+def test_migrate_converts_a_loosely_typed_database(pipeline_con):
+    con = pipeline_con
+    totals_sql = (f"SELECT taxi_type::VARCHAR, COUNT(*), SUM(trip_distance), SUM(co2_kg_per_trip) "
+                  f"FROM {TRANSFORMED_TABLE} GROUP BY ALL ORDER BY ALL")
+    expected = con.execute(totals_sql).fetchall()
+    raw_rows = con.execute("SELECT COUNT(*) FROM yellow_taxi_data").fetchone()[0]
+    quarantined = con.execute(f"SELECT COUNT(*), SUM(copies) FROM {QUARANTINE_TABLE}").fetchone()
+
+    # The layout of a database built before storage.py: VARCHAR taxi types,
+    # DOUBLE distances, BIGINT calendar parts and no particular row order
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {TRANSFORMED_TABLE} AS
+        SELECT * REPLACE (taxi_type::VARCHAR AS taxi_type, trip_distance::DOUBLE AS trip_distance,
+                          trip_month::BIGINT AS trip_month, trip_year::DOUBLE AS trip_year)
+        FROM {TRANSFORMED_TABLE} ORDER BY random()
+    """)
+    con.execute("""
+        CREATE OR REPLACE TABLE yellow_taxi_data AS
+        SELECT pick_up_datetime, drop_off_dt, passenger_count::DOUBLE AS passenger_count,
+               trip_distance::DOUBLE AS trip_distance
+        FROM yellow_taxi_data
+    """)
+    con.execute("INSERT INTO yellow_taxi_data VALUES ('2024-03-01 10:00', '2024-03-01 10:30', 1, 5e7)")
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {QUARANTINE_TABLE} AS
+        SELECT * REPLACE (taxi_type::VARCHAR AS taxi_type, reject_mask::BIGINT AS reject_mask,
+                          copies::BIGINT AS copies, trip_distance::DOUBLE AS trip_distance)
+        FROM {QUARANTINE_TABLE}
+    """)
+
+    migrate(con)
+
+    types = column_types(con, TRANSFORMED_TABLE)
+    assert types["taxi_type"].startswith("ENUM")
+    assert (types["trip_distance"], types["trip_month"], types["trip_year"]) == ("DECIMAL(9,3)", "TINYINT", "SMALLINT")
+    assert con.execute(totals_sql).fetchall() == expected
+    # Rows are stored in pickup order within each taxi type
+    assert con.execute(f"""
+        SELECT bool_and(pick_up_datetime >= previous) FROM (
+            SELECT pick_up_datetime, LAG(pick_up_datetime) OVER (ORDER BY rowid) AS previous, taxi_type,
+                   LAG(taxi_type) OVER (ORDER BY rowid) AS previous_type
+            FROM {TRANSFORMED_TABLE}
+        ) WHERE taxi_type = previous_type
+    """).fetchone()[0]
+
+    assert column_types(con, "yellow_taxi_data")["passenger_count"] == "SMALLINT"
+    assert con.execute("SELECT COUNT(*) FROM yellow_taxi_data").fetchone()[0] == raw_rows + 1
+    # An absurd raw distance is clamped, so it is still over the clean stage's limit
+    assert con.execute("SELECT MAX(trip_distance) FROM yellow_taxi_data").fetchone()[0] == MAX_TRIP_DISTANCE
+
+    quarantine_types = column_types(con, QUARANTINE_TABLE)
+    assert quarantine_types["taxi_type"].startswith("ENUM")
+    assert (quarantine_types["reject_mask"], quarantine_types["copies"]) == ("UTINYINT", "INTEGER")
+    assert con.execute(f"SELECT COUNT(*), SUM(copies) FROM {QUARANTINE_TABLE}").fetchone() == quarantined
+
+    # The rollup is rebuilt from the migrated trips
+    assert con.execute(f"SELECT SUM(trip_count) FROM {ROLLUP_TABLE}").fetchone()[0] == sum(r[1] for r in expected)
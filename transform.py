@@ -1,9 +1,20 @@
 #DISCLAIMER# #MADE A DBT THIS IS JUST FOR PLANNING*******
 
 
-import duckdb
+import argparse
 import logging
 
+from emission_models import DEFAULT_MODEL, EMISSIONS_MODELS, co2_sql, model_salt, resolve_factors
+from export import EXPORT_DIR, export_pending
+from fleets import load_fleets
+from instrument import instrument
+from manifest import (CLEAN, TRANSFORM, ensure_manifest, get_partitions, month_bounds, pending_partitions,
+                      record_partition, table_fingerprint)
+from resources import connect_duckdb
+from rollup import rebuild_rollup, refresh_rollup_month, rollup_is_current
+from sample import rebuild_sample, refresh_sample_month, sample_exists
+from storage import create_transformed_table, ensure_taxi_type_enum
+
 #Setting up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -13,61 +24,113 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def transform_select_sql(fleet, start, end, factors, model=DEFAULT_MODEL):
+    """
+    SELECT producing the transformed rows of one fleet (see fleets.yml) for pickups in [start, end).
 
-def transform_taxi_data():
-    #Connecting to Duckdb database
-    con = duckdb.connect(database='emissions.duckdb', read_only=False)
-    logger.info("Connected to emissions.duckdb")
-
-    try:
-        con.execute("""
-        CREATE OR REPLACE TABLE taxi_trips_transformed AS
+    Reads the fleet's cleaned table; CO2 comes from the emissions `model`
+    applied to `factors`, the fleet's vehicle_emissions row (see
+    emission_models.py), which is inlined as constants rather than joined.
+    """
+    distance = "CAST(t.trip_distance AS DOUBLE)"
+    mph = f"{distance} / (EXTRACT(EPOCH FROM (t.drop_off_dt - t.pick_up_datetime)) / 3600)"
+    return f"""
         SELECT
-            'yellow' AS taxi_type,
+            '{fleet["name"]}' AS taxi_type,
             t.pick_up_datetime,
             t.drop_off_dt,
             t.passenger_count,
             t.trip_distance,
-            
-            
-            EXTRACT(EPOCH FROM (t.drop_off_dt - t.pick_up_datetime)) AS trip_duration_seconds,
-            t.trip_distance / (EXTRACT(EPOCH FROM (t.drop_off_dt - t.pick_up_datetime)) / 3600) AS avg_mph,  -- Average speed in mph
-            (t.trip_distance * v.co2_grams_per_mile)/1000 AS co2_kg_per_trip,
-            
-            EXTRACT(HOUR FROM t.pick_up_datetime) AS trip_hour,
-            EXTRACT(DOW FROM t.pick_up_datetime) AS trip_day_of_week,
-            EXTRACT(WEEK FROM t.pick_up_datetime) AS trip_week,
-            EXTRACT(MONTH FROM t.pick_up_datetime) AS trip_month
-        
-        FROM yellow_taxi_data t
-        LEFT JOIN vehicle_emissions v
-            ON v.vehicle_type = 'yellow_taxi'
-        WHERE t.drop_off_dt > t.pick_up_datetime
 
-        UNION ALL
 
-        SELECT
-            'green' AS taxi_type,
-            t.pick_up_datetime,
-            t.drop_off_dt,
-            t.passenger_count,
-            t.trip_distance,
-            
             EXTRACT(EPOCH FROM (t.drop_off_dt - t.pick_up_datetime)) AS trip_duration_seconds,
-            t.trip_distance / (EXTRACT(EPOCH FROM (t.drop_off_dt - t.pick_up_datetime)) / 3600) AS avg_mph,  -- Average speed in mph
-            (t.trip_distance * v.co2_grams_per_mile)/1000 AS co2_kg_per_trip,
+            {mph} AS avg_mph,  -- Average speed in mph
+            {co2_sql(model, factors, distance, mph)} AS co2_kg_per_trip,
+
             EXTRACT(HOUR FROM t.pick_up_datetime) AS trip_hour,
             EXTRACT(DOW FROM t.pick_up_datetime) AS trip_day_of_week,
             EXTRACT(WEEK FROM t.pick_up_datetime) AS trip_week,
-            EXTRACT(MONTH FROM t.pick_up_datetime) AS trip_month
-        
-        FROM green_taxi_data t
-        LEFT JOIN vehicle_emissions v
-            ON v.vehicle_type = 'green_taxi'
+            EXTRACT(MONTH FROM t.pick_up_datetime) AS trip_month,
+            EXTRACT(YEAR FROM t.pick_up_datetime) AS trip_year
+
+        FROM clean_{fleet["table"]} t
         WHERE t.drop_off_dt > t.pick_up_datetime
-        """)
-        logger.info("Transformation complete: saved as 'taxi_trips_transformed'")
-        print("Transformation complete..Finally!")
+          AND t.pick_up_datetime >= '{start}' AND t.pick_up_datetime < '{end}'
+    """
+
+
+def transform_pending(con, model=DEFAULT_MODEL):
+    """
+    Refresh every month of `taxi_trips_transformed` whose cleaned month (or the
+    emissions lookup, or the emissions `model`) changed since it was last
+    transformed. Returns the number of months refreshed.
+    """
+    ensure_manifest(con)
+
+    # A transformed month depends on its cleaned month AND on the emissions lookup
+    # and model, so changing vehicle_emissions.csv or the model re-transforms every month.
+    emissions_fp = table_fingerprint(con, "vehicle_emissions")
+    pending = pending_partitions(con, TRANSFORM, CLEAN, salt=model_salt(model, emissions_fp))
+    built = get_partitions(con, TRANSFORM)
+
+    fleets = load_fleets()
+    # Each fleet's emission factors are looked up once, not joined to every trip
+    factors = {name: resolve_factors(con, fleet["vehicle_type"]) for name, fleet in fleets.items()}
+
+    # The taxi_type ENUM has to list every fleet before any of its months go in
+    ensure_taxi_type_enum(con)
+    if not built:
+        # First run (or a table from before partitioning): create the table empty,
+        # with the compact column types from storage.py
+        create_transformed_table(con, replace=True)
+    if not built or not rollup_is_current(con):
+        # The analysis rollup (see rollup.py) is kept in step with the trip table,
+        # also after the table was rewritten elsewhere (e.g. by dbt)
+        rebuild_rollup(con)
+    if not built or not sample_exists(con):
+        # So is the stratified sample behind analysis.py --approximate (see sample.py)
+        rebuild_sample(con)
+
+    for taxi_type, year, month, fingerprint in pending:
+        start, end = month_bounds(year, month)
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(
+                "DELETE FROM taxi_trips_transformed WHERE taxi_type = ? AND trip_year = ? AND trip_month = ?",
+                [taxi_type, year, month],
+            )
+            rows = con.execute(f"""
+                INSERT INTO taxi_trips_transformed
+                {transform_select_sql(fleets[taxi_type], start, end, factors[taxi_type], model)}
+                ORDER BY t.pick_up_datetime
+            """).fetchone()[0]
+            refresh_rollup_month(con, taxi_type, year, month)
+            refresh_sample_month(con, taxi_type, year, month)
+            record_partition(con, TRANSFORM, taxi_type, year, month, fingerprint, rows)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        logger.info(f"Transformed {taxi_type} {year}-{month:02d}: {rows} rows")
+
+    logger.info(f"Transformation complete ({model} emissions model): {len(pending)} month(s) refreshed in 'taxi_trips_transformed'")
+    return len(pending)
+
+
+def transform_taxi_data(parquet=False, model=DEFAULT_MODEL):
+    #Connecting to Duckdb database
+    con = instrument(connect_duckdb('emissions.duckdb', read_only=False), "transform")
+    logger.info("Connected to emissions.duckdb")
+
+    try:
+        refreshed = transform_pending(con, model)
+        print(f"Transformation complete..Finally! ({refreshed} month(s) refreshed)")
+
+        # Optional parquet materialization for readers that shouldn't open the database
+        if parquet:
+            written = export_pending(con)
+            logger.info(f"Exported {written} partition(s) to {EXPORT_DIR}")
+            print(f"Exported {written} partition(s) to {EXPORT_DIR}")
 
     except Exception as e:
         logger.error(f"Error during transformation: {e}")
@@ -78,5 +141,9 @@ def transform_taxi_data():
         logger.info("DuckDB connection closed")
 
 if __name__ == "__main__":
-    transform_taxi_data()
-
+    parser = argparse.ArgumentParser(description="Build taxi_trips_transformed from the cleaned trip tables")
+    parser.add_argument("--parquet", action="store_true", help="Also export changed partitions as hive-partitioned parquet")
+    parser.add_argument("--emissions-model", choices=list(EMISSIONS_MODELS), default=DEFAULT_MODEL,
+                        help="How CO2 per trip is computed (see emission_models.py)")
+    args = parser.parse_args()
+    transform_taxi_data(args.parquet, args.emissions_model)